@@ -1,6 +1,21 @@
 from django.contrib import admin
+from django.urls import reverse
+from django.utils.html import format_html, format_html_join
 from django.utils.translation import gettext_lazy as _
 from .models import Category, Location, Ad, AdImage, AdReport
+from .duplicates import duplicate_ads
+from .normalization import normalize_search_text
+
+
+def match_list(matches, rows):
+    """Linked ``(url, object, distance)`` rows, noting when ``matches`` was cut off"""
+    html = format_html_join(format_html('<br>'), '<a href="{}">{}</a> ({} bit)', rows)
+    if matches.truncated:
+        html = format_html(
+            '{}<br><em>{}</em>', html,
+            _('Faqat eng yaqin %(count)d tasi ko\'rsatilgan') % {'count': len(matches)},
+        )
+    return html
 
 
 @admin.register(Category)
@@ -11,6 +26,15 @@ class CategoryAdmin(admin.ModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     list_editable = ('is_active', 'order')
 
+    def get_search_results(self, request, queryset, search_term):
+        # Also match Cyrillic/Latin spellings through the normalized key
+        results, may_have_duplicates = super().get_search_results(request, queryset, search_term)
+        normalized = normalize_search_text(search_term)
+        if normalized:
+            # From the incoming queryset, so list_filter selections still apply
+            results |= queryset.filter(search_key__contains=normalized)
+        return results, may_have_duplicates
+
 
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
@@ -30,10 +54,10 @@ class AdImageInline(admin.TabularInline):
 
 @admin.register(Ad)
 class AdAdmin(admin.ModelAdmin):
-    list_display = ('title', 'category', 'location', 'user', 'price', 'status', 'is_active', 'is_featured', 'is_vip', 'views_count', 'created_at')
+    list_display = ('title', 'category', 'location', 'user', 'price', 'status', 'is_active', 'is_featured', 'is_vip', 'views_count', 'unique_views_count', 'created_at')
     list_filter = ('status', 'is_active', 'is_featured', 'is_vip', 'category', 'location', 'created_at')
     search_fields = ('title', 'description', 'user__username', 'phone')
-    readonly_fields = ('views_count', 'favorites_count', 'created_at', 'updated_at')
+    readonly_fields = ('views_count', 'unique_views_count', 'favorites_count', 'created_at', 'updated_at')
     list_editable = ('is_active', 'is_featured', 'is_vip')
     date_hierarchy = 'created_at'
     inlines = [AdImageInline]
@@ -52,7 +76,7 @@ class AdAdmin(admin.ModelAdmin):
             'fields': ('status', 'is_active', 'is_featured', 'is_vip')
         }),
         (_('Statistika'), {
-            'fields': ('views_count', 'favorites_count'),
+            'fields': ('views_count', 'unique_views_count', 'favorites_count'),
             'classes': ('collapse',)
         }),
         (_('Sanalar'), {
@@ -72,6 +96,17 @@ class AdImageAdmin(admin.ModelAdmin):
     search_fields = ('ad__title',)
     list_editable = ('is_main', 'order')
     raw_id_fields = ('ad',)
+    readonly_fields = ('width', 'height', 'processed_at', 'content_hash', 'near_duplicate_images')
+
+    @admin.display(description=_('O\'xshash rasmlar'))
+    def near_duplicate_images(self, obj):
+        matches = obj.near_duplicates if obj.pk else []
+        if not matches:
+            return '-'
+        return match_list(matches, (
+            (reverse('admin:ads_adimage_change', args=[image.pk]), image, distance)
+            for image, distance in matches
+        ))
 
 
 @admin.register(AdReport)
@@ -80,14 +115,43 @@ class AdReportAdmin(admin.ModelAdmin):
     list_filter = ('reason', 'is_resolved', 'created_at')
     search_fields = ('ad__title', 'user__username', 'description')
     list_editable = ('is_resolved',)
-    readonly_fields = ('created_at',)
+    readonly_fields = ('created_at', 'duplicate_candidates')
     raw_id_fields = ('ad', 'user')
+    actions = ['deactivate_duplicates']
     
     fieldsets = (
         (_('Report ma\'lumotlari'), {
             'fields': ('ad', 'user', 'reason', 'description')
         }),
+        (_('Takroriy e\'lonlar'), {
+            'fields': ('duplicate_candidates',)
+        }),
         (_('Status'), {
             'fields': ('is_resolved', 'created_at')
         }),
     )
+    
+    @admin.display(description=_('O\'xshash rasmli e\'lonlar'))
+    def duplicate_candidates(self, obj):
+        if not obj.pk or obj.reason != 'duplicate':
+            return '-'
+        candidates = duplicate_ads(obj.ad)
+        if not candidates:
+            return format_html('{}', _('Topilmadi'))
+        return match_list(candidates, (
+            (reverse('admin:ads_ad_change', args=[ad.pk]), ad, distance) for ad, distance in candidates
+        ))
+    
+    @admin.action(description=_('Takroriy e\'lonlarni faolsizlantirish va hal qilingan deb belgilash'))
+    def deactivate_duplicates(self, request, queryset):
+        """Deactivate reported ads whose images duplicate another ad, and resolve those reports"""
+        resolved = 0
+        for report in queryset.filter(reason='duplicate', is_resolved=False).select_related('ad'):
+            if not duplicate_ads(report.ad):
+                continue
+            report.ad.is_active = False
+            report.ad.save(update_fields=['is_active'])
+            report.is_resolved = True
+            report.save(update_fields=['is_resolved'])
+            resolved += 1
+        self.message_user(request, _('%(count)d ta takroriy e\'lon faolsizlantirildi') % {'count': resolved})
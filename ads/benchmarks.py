@@ -0,0 +1,221 @@
+"""
+Latency and query-count benchmarks for the listing and detail views.
+
+``seeded_database`` creates a throwaway test database filled by
+``generate_load_data``. ``build_scenarios`` turns its contents into a
+fixed list of representative requests: every listing view with typical
+filters (q, category, location, price range) and deep pages, plus the
+detail page; ``filter_combinations`` enumerates all of them instead.
+``run_scenario`` drives one through the test client; ``compare`` checks a
+run against a stored baseline. Only successful responses are measured:
+an error page is fast and cheap, so it would make a misleading baseline. The ``benchmark_views`` and
+``check_query_plans`` commands tie them together.
+"""
+import itertools
+import math
+import tempfile
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from io import StringIO
+from urllib.parse import urlencode
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from django.urls import reverse
+
+from .pagination import encode_cursor
+from .search import order_listing
+from .view_counts import flush_views
+
+Scenario = namedtuple('Scenario', 'name url')
+
+# Offset of the row a "deep page" cursor points at
+DEEP_OFFSET = 5000
+DEEP_PAGE = 50
+MIDDLE_PAGE = 3
+PRICE_RANGE = {'min_price': 1_000_000, 'max_price': 50_000_000}
+# Latency differences below this are noise, whatever the tolerance
+LATENCY_SLACK_MS = 5.0
+
+
+@contextmanager
+def seeded_database(ads, users, seed, keepdb=False, stdout=None):
+    """A test database seeded by generate_load_data; destroyed on exit unless ``keepdb``"""
+    from .models import Ad
+
+    output = stdout or StringIO()
+    old_name = connection.settings_dict['NAME']
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb, serialize=False)
+    try:
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            if not (keepdb and Ad.objects.count() >= ads):
+                call_command('populate_data', stdout=output)
+                call_command(
+                    'generate_load_data', users=users, ads=ads, favorites=ads // 4,
+                    images_per_ad=1, image_variants=20, seed=seed, stdout=output,
+                )
+            yield
+            # Buffered view counts belong to the test database
+            flush_views()
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+def with_query(url, **params):
+    return f'{url}?{urlencode(params)}' if params else url
+
+
+def deep_cursor(queryset):
+    """Cursor of the listing row at DEEP_OFFSET (or the last one)"""
+    queryset = order_listing(queryset)
+    total = queryset.count()
+    if not total:
+        return None
+    return encode_cursor(queryset[min(DEEP_OFFSET, total - 1)])
+
+
+def build_scenarios():
+    from .models import Ad, Category, Location
+
+    active = Ad.objects.filter(is_active=True)
+    category = Category.objects.filter(is_active=True).order_by('-ads_count', 'id').first()
+    location = Location.objects.filter(is_active=True).order_by('-ads_count', 'id').first()
+    ads = order_listing(active)
+    total = ads.count()
+    if category is None or location is None or not total:
+        return []
+    ad = ads[total // 2]
+    term = ad.title.split()[0]
+
+    home = reverse('core:home')
+    listing = reverse('ads:list')
+    category_url = reverse('ads:category', kwargs={'slug': category.slug})
+    location_url = reverse('ads:location', kwargs={'slug': location.slug})
+    places = {'category': category.slug, 'location': location.slug}
+
+    scenarios = [
+        Scenario('home', home),
+        Scenario('home:q', with_query(home, q=term)),
+        Scenario('home:category+location', with_query(home, **places)),
+        Scenario('list', listing),
+        Scenario('list:q', with_query(listing, q=term)),
+        Scenario('list:category', with_query(listing, category=category.slug)),
+        Scenario('list:location', with_query(listing, location=location.slug)),
+        Scenario('list:category+location', with_query(listing, **places)),
+        Scenario('list:q+category', with_query(listing, q=term, category=category.slug)),
+        Scenario('list:q:deep-page', with_query(listing, q=term, page=DEEP_PAGE)),
+        Scenario('list:deep-cursor', with_query(listing, cursor=deep_cursor(active))),
+        Scenario('category', category_url),
+        Scenario('category:location', with_query(category_url, location=location.slug)),
+        Scenario('category:price', with_query(category_url, **PRICE_RANGE)),
+        Scenario('category:q+location+price', with_query(
+            category_url, q=term, location=location.slug, **PRICE_RANGE,
+        )),
+        Scenario('category:deep-cursor', with_query(category_url, cursor=deep_cursor(category.ads.filter(is_active=True)))),
+        Scenario('location', location_url),
+        Scenario('location:deep-cursor', with_query(location_url, cursor=deep_cursor(location.ads.filter(is_active=True)))),
+        Scenario('detail', reverse('ads:detail', kwargs={'slug': ad.slug})),
+    ]
+    return scenarios
+
+
+def filter_combinations():
+    """
+    Every filter combination the listing views accept, each at the first
+    page, a numbered page and a deep page (a keyset cursor, or a deep page
+    number for relevance-ranked searches, which are not keyset paginated).
+    """
+    from .models import Ad, Category, Location
+
+    active = Ad.objects.filter(is_active=True)
+    category = Category.objects.filter(is_active=True).order_by('-ads_count', 'id').first()
+    location = Location.objects.filter(is_active=True).order_by('-ads_count', 'id').first()
+    ad = order_listing(active).first()
+    if category is None or location is None or ad is None:
+        return []
+    term = ad.title.split()[0]
+    # A keyset cursor is a position in listing order, valid for any filter
+    cursor = deep_cursor(active)
+
+    places = {'q': term, 'category': category.slug, 'location': location.slug}
+    views = [
+        ('home', reverse('core:home'), places),
+        ('list', reverse('ads:list'), places),
+        ('category', reverse('ads:category', kwargs={'slug': category.slug}), {
+            'q': term, 'location': location.slug, **PRICE_RANGE,
+        }),
+        ('location', reverse('ads:location', kwargs={'slug': location.slug}), {}),
+    ]
+    scenarios = []
+    for view, url, available in views:
+        for size in range(len(available) + 1):
+            for names in itertools.combinations(available, size):
+                params = {name: available[name] for name in names}
+                label = f'{view}:{"+".join(names)}' if names else view
+                scenarios.append(Scenario(label, with_query(url, **params)))
+                scenarios.append(Scenario(f'{label}:page-{MIDDLE_PAGE}', with_query(url, **params, page=MIDDLE_PAGE)))
+                if 'q' in params:
+                    scenarios.append(Scenario(f'{label}:page-{DEEP_PAGE}', with_query(url, **params, page=DEEP_PAGE)))
+                else:
+                    scenarios.append(Scenario(f'{label}:deep-cursor', with_query(url, **params, cursor=cursor)))
+    return scenarios
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(samples)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+
+def run_scenario(scenario, repeat=20, warmup=2, client=None):
+    """
+    {'status', 'p50_ms', 'p95_ms', 'queries'} for ``repeat`` requests after
+    ``warmup``; just {'status'} as soon as a request does not return 200.
+    """
+    client = client or Client(raise_request_exception=False)
+    for _ in range(warmup):
+        status = client.get(scenario.url).status_code
+        if status != 200:
+            return {'status': status}
+
+    timings, queries = [], 0
+    for _ in range(max(repeat, 1)):
+        with CaptureQueriesContext(connection) as captured:
+            started = time.perf_counter()
+            response = client.get(scenario.url)
+            timings.append((time.perf_counter() - started) * 1000)
+        queries = max(queries, len(captured))
+        status = response.status_code
+        if status != 200:
+            return {'status': status}
+    return {
+        'status': status,
+        'p50_ms': round(percentile(timings, 0.5), 2),
+        'p95_ms': round(percentile(timings, 0.95), 2),
+        'queries': queries,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """[(scenario name, problem), ...] where ``results`` are worse than ``baseline``"""
+    problems = []
+    for name, result in results.items():
+        if result['status'] != 200:
+            problems.append((name, f'status {result["status"]}'))
+            continue
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result['queries'] > expected['queries']:
+            problems.append((name, f'queries {expected["queries"]} -> {result["queries"]}'))
+        limit = max(expected['p95_ms'] * (1 + tolerance), expected['p95_ms'] + LATENCY_SLACK_MS)
+        if result['p95_ms'] > limit:
+            problems.append((name, f'p95 {expected["p95_ms"]:.1f}ms -> {result["p95_ms"]:.1f}ms'))
+    return problems
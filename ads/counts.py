@@ -0,0 +1,150 @@
+"""
+Cached, approximate result counts for ad listings.
+
+Small result sets are counted exactly with a bounded ``COUNT`` over
+``LIMIT COUNT_EXACT_LIMIT + 1`` rows. Bigger ones are estimated from the
+query plan on PostgreSQL (counted in full elsewhere) and cached under the
+normalized filter for ``COUNT_CACHE_TIMEOUT`` seconds.
+
+Each cached count remembers the versions of the slices it depends on:
+its category and/or location, or all ads when it has neither. Saving or
+deleting an ad bumps the versions of all ads and of the categories and
+locations it was and is in; a count whose versions moved is still served
+for at most ``COUNT_STALE_SECONDS`` before it is recomputed.
+
+The versions only reach other worker processes through a shared cache
+(see ``CACHES`` in settings); with a per-process cache, counts are only
+refreshed after ``COUNT_CACHE_TIMEOUT``.
+"""
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import metrics
+from .normalization import normalize_search_text
+
+CACHE_PREFIX = 'ads:count'
+# Every count depends on the epoch; bumping it invalidates them all
+EPOCH_KEY = f'{CACHE_PREFIX}:version:epoch'
+ALL_KEY = f'{CACHE_PREFIX}:version:all'
+
+
+class AdCount(int):
+    """An int that knows whether it is exact"""
+
+    def __new__(cls, value, is_exact=True):
+        count = super().__new__(cls, value)
+        count.is_exact = is_exact
+        return count
+
+
+def category_key(category):
+    return f'{CACHE_PREFIX}:version:category:{category}'
+
+
+def location_key(location):
+    return f'{CACHE_PREFIX}:version:location:{location}'
+
+
+def slice_keys(category=None, location=None):
+    """Version keys of the narrowest slices a count depends on"""
+    keys = [EPOCH_KEY]
+    if category:
+        keys.append(category_key(category))
+    if location:
+        keys.append(location_key(location))
+    if len(keys) == 1:
+        keys.append(ALL_KEY)
+    return keys
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        # Start from the clock so a version lost from the cache never
+        # matches a count cached under the old one
+        initial = time.time_ns()
+        for key in missing:
+            cache.add(key, initial, timeout=None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key) for key in keys]
+
+
+def bump_versions(categories=(), locations=()):
+    """
+    Invalidate cached counts over ads in these categories/locations (and
+    unscoped counts), or every cached count when neither is given.
+    """
+    if not categories and not locations:
+        keys = [EPOCH_KEY]
+    else:
+        keys = [ALL_KEY]
+        keys += [category_key(category) for category in set(categories) if category]
+        keys += [location_key(location) for location in set(locations) if location]
+    # A fresh unique value rather than cache.incr, which is not atomic
+    # across processes on every backend (FileBasedCache reads, adds and
+    # writes); versions are only ever compared for equality
+    version = uuid.uuid4().hex
+    cache.set_many(dict.fromkeys(keys, version), timeout=None)
+
+
+def filter_key(filters):
+    normalized = {
+        name: normalize_search_text(value) if name == 'q' else str(value)
+        for name, value in filters.items()
+        if value not in (None, '')
+    }
+    digest = hashlib.md5(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+    return f'{CACHE_PREFIX}:{digest}'
+
+
+def estimate_count(queryset):
+    """Row estimate from the planner, or None where there is no cheap one"""
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def count_ads(queryset, category=None, location=None, **filters):
+    """
+    Count ``queryset``, cached under its filters.
+
+    ``category``/``location`` are ids used to scope invalidation; every
+    other keyword (q, min_price, max_price, slugs, ...) only goes into the
+    cache key and must describe the rest of the queryset's filtering.
+    """
+    exact_limit = getattr(settings, 'COUNT_EXACT_LIMIT', 1000)
+    key = filter_key(dict(filters, category=category, location=location))
+    versions = get_versions(slice_keys(category, location))
+
+    entry = cache.get(key)
+    if entry is not None:
+        value, cached_versions, computed_at = entry
+        age = time.time() - computed_at
+        if cached_versions == versions or age < getattr(settings, 'COUNT_STALE_SECONDS', 30):
+            metrics.inc('olx_cache_requests_total', cache='counts', result='hit')
+            return AdCount(value, is_exact=value <= exact_limit and cached_versions == versions)
+
+    metrics.inc('olx_cache_requests_total', cache='counts', result='miss')
+    queryset = queryset.order_by()
+    value = queryset[:exact_limit + 1].count()
+    is_exact = value <= exact_limit
+    if not is_exact:
+        estimate = estimate_count(queryset)
+        value = estimate if estimate is not None and estimate > exact_limit else queryset.count()
+        is_exact = estimate is None
+
+    cache.set(key, (value, versions, time.time()), getattr(settings, 'COUNT_CACHE_TIMEOUT', 300))
+    return AdCount(value, is_exact=is_exact)
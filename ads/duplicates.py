@@ -0,0 +1,161 @@
+"""
+Perceptual hashing and near-duplicate lookup for ad images.
+
+Every processed image gets a 64-bit difference hash (dHash) of a 9x8
+grayscale copy; re-encoded, resized or lightly edited copies of a photo
+end up only a few bits apart. For lookup the hash is cut into ``BANDS``
+bands stored in ``AdImageHashBand``. Two hashes at most
+``NEAR_DUPLICATE_DISTANCE`` bits apart always agree on at least one band,
+so candidates come from an indexed equality lookup and only their exact
+Hamming distance is checked in Python. A common hash could match thousands
+of images, so at most ``NEAR_DUPLICATE_CANDIDATES`` candidates (those
+sharing the most bands) are checked and only the closest
+``NEAR_DUPLICATE_LIMIT`` are kept; ``Matches.truncated`` tells when either
+cut dropped something.
+
+Byte-identical files are recognised by ``content_hash`` and share one
+stored file (see ``ads.images.process_image``).
+"""
+import hashlib
+
+from django.conf import settings
+from django.db.models import Count, Q
+from PIL import Image
+
+HASH_BITS = 64
+BANDS = 6
+NEAR_DUPLICATE_DISTANCE = BANDS - 1
+
+
+def band_ranges():
+    """(shift, width) of each band; widths differ by at most one bit"""
+    ranges = []
+    shift = 0
+    for band in range(BANDS):
+        width = HASH_BITS // BANDS + (1 if band < HASH_BITS % BANDS else 0)
+        ranges.append((shift, width))
+        shift += width
+    return ranges
+
+
+BAND_RANGES = band_ranges()
+
+
+def dhash(picture):
+    """64-bit difference hash: is each pixel brighter than its right neighbour"""
+    small = picture.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            left = pixels[row * 9 + column]
+            value = value << 1 | (left > pixels[row * 9 + column + 1])
+    return value
+
+
+def to_signed(value):
+    """Fit an unsigned 64-bit hash into a BigIntegerField"""
+    return value - (1 << HASH_BITS) if value >= 1 << (HASH_BITS - 1) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def hamming(first, second):
+    return bin(to_unsigned(first) ^ to_unsigned(second)).count('1')
+
+
+def bands(value):
+    value = to_unsigned(value)
+    return [(band, (value >> shift) & ((1 << width) - 1)) for band, (shift, width) in enumerate(BAND_RANGES)]
+
+
+def content_hash(field):
+    digest = hashlib.sha256()
+    with field.open('rb') as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def index_hash(image_id, value):
+    """(Re)write the lookup bands of one image; unhashed images get none"""
+    from .models import AdImageHashBand
+
+    AdImageHashBand.objects.filter(image_id=image_id).delete()
+    if value is None:
+        return
+    AdImageHashBand.objects.bulk_create(
+        AdImageHashBand(image_id=image_id, band=band, value=band_value)
+        for band, band_value in bands(value)
+    )
+
+
+class Matches(list):
+    """[(match, distance), ...] closest first; ``truncated`` if some were left out"""
+
+    def __init__(self, matches=(), truncated=False):
+        super().__init__(matches)
+        self.truncated = truncated
+
+
+def closest(matches, truncated=False):
+    """Keep the ``NEAR_DUPLICATE_LIMIT`` closest of ``matches``"""
+    limit = getattr(settings, 'NEAR_DUPLICATE_LIMIT', 20)
+    matches = sorted(matches, key=lambda match: match[1])
+    return Matches(matches[:limit], truncated or len(matches) > limit)
+
+
+def find_near_duplicates(images, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """
+    {image id: Matches of (other AdImage, distance)} for hashed ``images``.
+
+    Images of the same ad are not reported as duplicates of each other.
+    Runs one candidate query for all ``images`` together.
+    """
+    from .models import AdImage, AdImageHashBand
+
+    hashed = [image for image in images if image.phash is not None]
+    if not hashed:
+        return {}
+    condition = Q()
+    for value in {image.phash for image in hashed}:
+        for band, band_value in bands(value):
+            condition |= Q(band=band, value=band_value)
+    cap = getattr(settings, 'NEAR_DUPLICATE_CANDIDATES', 1000)
+    candidate_ids = list(
+        AdImageHashBand.objects.filter(condition)
+        .exclude(image_id__in=[image.pk for image in hashed])
+        .values('image_id').annotate(shared=Count('id')).order_by('-shared')
+        .values_list('image_id', flat=True)[:cap]
+    )
+    capped = len(candidate_ids) == cap
+    candidates = list(AdImage.objects.filter(pk__in=candidate_ids).select_related('ad'))
+
+    found = {}
+    for image in hashed:
+        matches = [
+            (other, hamming(image.phash, other.phash))
+            for other in candidates
+            if other.ad_id != image.ad_id and other.phash is not None
+        ]
+        found[image.pk] = closest((match for match in matches if match[1] <= max_distance), capped)
+    return found
+
+
+def near_duplicates(image, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """Matches of (other AdImage, distance), closest first"""
+    return find_near_duplicates([image], max_distance).get(image.pk, Matches())
+
+
+def duplicate_ads(ad, max_distance=NEAR_DUPLICATE_DISTANCE):
+    """Matches of (other Ad, closest distance) for ads sharing a near-duplicate image with ``ad``"""
+    distances = {}
+    truncated = False
+    for matches in find_near_duplicates(ad.images.all(), max_distance).values():
+        truncated = truncated or matches.truncated
+        for other, distance in matches:
+            if other.ad not in distances or distance < distances[other.ad]:
+                distances[other.ad] = distance
+    return closest(distances.items(), truncated)
@@ -0,0 +1,227 @@
+"""
+Background processing of uploaded ad images.
+
+Uploads are stored untouched and the request returns as soon as the
+original is saved. After the transaction commits, the image id is handed
+to a small thread pool (Pillow releases the GIL while decoding, resizing
+and encoding) which writes every rendition in ``RENDITIONS`` as WebP and
+JPEG, records the pixel dimensions and a tiny base64 placeholder (shown
+while the real image lazy-loads) and then sets ``AdImage.processed_at``.
+
+Byte-identical uploads are not processed twice: the row reuses the
+results of the image already processed (see also ``ads.storage``, which
+stores identical files once).
+The worker also stores a perceptual hash for near-duplicate lookup (see
+``ads.duplicates``).
+
+Images still waiting (e.g. after a restart) are picked up by the
+``process_images`` management command. ``IMAGE_PROCESSING_WORKERS = 0``
+processes images inline, which is handy in tests.
+"""
+import base64
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from . import metrics
+from .duplicates import content_hash, dhash, index_hash, to_signed
+from .profiling import timed
+from .storage import release, retain
+
+logger = logging.getLogger(__name__)
+
+# name -> bounding box; images are never upscaled
+RENDITIONS = {
+    'thumb': (160, 160),
+    'card': (480, 480),
+    'full': (1200, 1200),
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+
+# Longest side of the inline placeholder preview
+PLACEHOLDER_SIZE = 20
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Rendition:
+    """URLs, size and placeholder of one rendition of an image, for templates"""
+
+    def __init__(self, jpeg, webp=None, width=None, height=None, placeholder=''):
+        self.jpeg = jpeg
+        self.webp = webp
+        self.width = width
+        self.height = height
+        self.placeholder = placeholder
+
+    def __str__(self):
+        return self.jpeg
+
+
+def rendition_path(name, size, extension):
+    """Storage path of a rendition of the file stored under ``name``"""
+    return f'renditions/{os.path.splitext(name)[0]}/{size}.{extension}'
+
+
+def rendition_paths(name):
+    return [rendition_path(name, size, extension) for size in RENDITIONS for extension in FORMATS]
+
+
+def fitted_size(width, height, box):
+    """Size of a ``width`` x ``height`` image after ``thumbnail(box)``"""
+    scale = min(box[0] / width, box[1] / height, 1)
+    return max(round(width * scale), 1), max(round(height * scale), 1)
+
+
+@timed('images')
+def renditions_for(image):
+    """{size: Rendition}; unprocessed images fall back to the original"""
+    field = image.image
+    if not field:
+        return {}
+    if image.processed_at is None:
+        original = Rendition(field.url, width=image.width, height=image.height, placeholder=image.placeholder)
+        return {size: original for size in RENDITIONS}
+    renditions = {}
+    for size, box in RENDITIONS.items():
+        width, height = fitted_size(image.width, image.height, box) if image.width else (None, None)
+        renditions[size] = Rendition(
+            jpeg=default_storage.url(rendition_path(field.name, size, 'jpeg')),
+            webp=default_storage.url(rendition_path(field.name, size, 'webp')),
+            width=width,
+            height=height,
+            placeholder=image.placeholder,
+        )
+    return renditions
+
+
+def load_original(field):
+    with field.open('rb') as source:
+        picture = Image.open(source)
+        picture = ImageOps.exif_transpose(picture)
+        picture.load()
+    if picture.mode in ('RGBA', 'LA', 'P'):
+        picture = picture.convert('RGBA')
+        background = Image.new('RGB', picture.size, 'white')
+        background.paste(picture, mask=picture.getchannel('A'))
+        return background
+    return picture.convert('RGB')
+
+
+def write_renditions(field, picture):
+    # Renditions live at fixed paths, not in the content-addressed image storage
+    storage = default_storage
+    for size, box in RENDITIONS.items():
+        resized = picture.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        for extension, options in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, **options)
+            path = rendition_path(field.name, size, extension)
+            if storage.exists(path):
+                storage.delete(path)
+            storage.save(path, ContentFile(buffer.getvalue()))
+
+
+def make_placeholder(picture):
+    """A ~20px JPEG of the picture as a data URI (a few hundred bytes)"""
+    preview = picture.copy()
+    preview.thumbnail((PLACEHOLDER_SIZE, PLACEHOLDER_SIZE))
+    buffer = BytesIO()
+    preview.save(buffer, format='JPEG', quality=40)
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def delete_renditions(name):
+    for path in rendition_paths(name):
+        if default_storage.exists(path):
+            default_storage.delete(path)
+
+
+@metrics.timed('olx_image_processing_seconds')
+def process_image(image_id):
+    """Write all renditions of one AdImage and mark it processed"""
+    from .models import AdImage
+
+    image = AdImage.objects.filter(pk=image_id).first()
+    if image is None or not image.image:
+        return False
+    started = timezone.now()
+    name = image.image.name
+    digest = content_hash(image.image)
+    # Only update the row if its file was not replaced while we were working
+    current = AdImage.objects.filter(pk=image_id, image=name)
+
+    twin = (
+        AdImage.objects.filter(content_hash=digest, processed_at__isnull=False)
+        .exclude(pk=image_id).exclude(image='').first()
+    )
+    if twin is not None:
+        # Same bytes already processed: reuse the results (and, for files
+        # stored before content addressing, share the other file)
+        with transaction.atomic():
+            if current.update(
+                image=twin.image.name, content_hash=digest, phash=twin.phash, processed_at=started,
+                width=twin.width, height=twin.height, placeholder=twin.placeholder,
+            ):
+                index_hash(image_id, twin.phash)
+                if twin.image.name != name:
+                    retain(twin.image.name)
+                    release(name)
+        return True
+
+    picture = load_original(image.image)
+    write_renditions(image.image, picture)
+    phash = dhash(picture)
+    with transaction.atomic():
+        if current.update(
+            processed_at=started,
+            width=picture.width,
+            height=picture.height,
+            placeholder=make_placeholder(picture),
+            content_hash=digest,
+            phash=to_signed(phash),
+        ):
+            index_hash(image_id, phash)
+    return True
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2),
+                thread_name_prefix='image-worker',
+            )
+        return _executor
+
+
+def run_job(image_id):
+    try:
+        process_image(image_id)
+    except Exception:
+        logger.exception('Processing image %s failed', image_id)
+    finally:
+        close_old_connections()
+
+
+def enqueue(image_id):
+    """Process the image once the current transaction commits"""
+    if getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2) <= 0:
+        transaction.on_commit(lambda: run_job(image_id))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(run_job, image_id))
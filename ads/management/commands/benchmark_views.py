@@ -0,0 +1,93 @@
+import json
+import logging
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from ads.benchmarks import build_scenarios, compare, run_scenario, seeded_database
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the listing and detail views on a seeded test database and compare with the baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ads', type=int, default=20000, help='Ads in the seeded data set (default: 20000)')
+        parser.add_argument('--users', type=int, default=500, help='Users in the seeded data set (default: 500)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the data set (default: 1)')
+        parser.add_argument('--repeat', type=int, default=20, help='Measured requests per scenario (default: 20)')
+        parser.add_argument('--warmup', type=int, default=2, help='Unmeasured requests first (default: 2)')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.25,
+            help='Allowed p95 latency increase over the baseline, as a fraction (default: 0.25)',
+        )
+        parser.add_argument(
+            '--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'views.json'),
+            help='Baseline file (default: benchmarks/views.json)',
+        )
+        parser.add_argument('--update-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument('--scenario', action='append', help='Only run scenarios starting with this name')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the seeded test database between runs')
+
+    def measure(self, options):
+        results = {}
+        # Failing scenarios are reported by status; one traceback per request is just noise
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        for scenario in build_scenarios():
+            if options['scenario'] and not scenario.name.startswith(tuple(options['scenario'])):
+                continue
+            results[scenario.name] = result = run_scenario(scenario, options['repeat'], options['warmup'])
+            if result['status'] != 200:
+                self.stdout.write(self.style.ERROR(f'{scenario.name:<28} {result["status"]:>4}'))
+                continue
+            self.stdout.write(
+                f'{scenario.name:<28} {result["status"]:>4} p50 {result["p50_ms"]:>8.1f}ms '
+                f'p95 {result["p95_ms"]:>8.1f}ms {result["queries"]:>3} queries'
+            )
+        return results
+
+    def handle(self, *args, **options):
+        environment = {'database': connection.vendor, 'ads': options['ads'], 'seed': options['seed']}
+        with seeded_database(
+            options['ads'], options['users'], options['seed'], options['keepdb'],
+            stdout=self.stdout if options['verbosity'] >= 2 else None,
+        ):
+            results = self.measure(options)
+
+        if not results:
+            raise CommandError('No scenarios were run')
+        path = options['baseline']
+        baseline = {}
+        if os.path.exists(path):
+            with open(path) as source:
+                baseline = json.load(source)
+
+        if options['update_baseline']:
+            failed = sorted(name for name, result in results.items() if result['status'] != 200)
+            if failed:
+                self.stdout.write(self.style.WARNING(f'Left out of the baseline, not 200: {", ".join(failed)}'))
+            results = {name: result for name, result in results.items() if name not in failed}
+            # --scenario only replaces the scenarios that were run
+            if options['scenario'] and baseline.get('environment') == environment:
+                results = {**baseline.get('results', {}), **results}
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as target:
+                json.dump({'environment': environment, 'results': results}, target, indent=2, sort_keys=True)
+                target.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {path}'))
+            return
+
+        if not baseline:
+            raise CommandError(f'No baseline at {path}; run with --update-baseline first')
+        if baseline.get('environment') != environment:
+            self.stdout.write(self.style.WARNING(
+                f'Baseline was recorded with {baseline.get("environment")}, this run used {environment}'
+            ))
+
+        problems = compare(results, baseline.get('results', {}), options['tolerance'])
+        for name, problem in problems:
+            self.stderr.write(f'{name}: {problem}')
+        if problems:
+            raise CommandError(f'{len(problems)} regression(s) against {path}')
+        self.stdout.write(self.style.SUCCESS(f'{len(results)} scenarios within the baseline'))
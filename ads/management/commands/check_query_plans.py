@@ -0,0 +1,132 @@
+import json
+import logging
+import os
+from collections import Counter
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from ads.benchmarks import filter_combinations, seeded_database
+from ads.query_plans import analyze, capture, explain, format_plan, large_tables, plan_problems
+from ads.slow_queries import normalize
+
+
+class Command(BaseCommand):
+    help = 'Check the query plans of every listing filter combination for new full scans and sorts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ads', type=int, default=20000, help='Ads in the seeded data set (default: 20000)')
+        parser.add_argument('--users', type=int, default=500, help='Users in the seeded data set (default: 500)')
+        parser.add_argument('--seed', type=int, default=1, help='Seed of the data set (default: 1)')
+        parser.add_argument(
+            '--min-rows', type=int, default=1000,
+            help='Tables smaller than this may be scanned in full (default: 1000)',
+        )
+        parser.add_argument(
+            '--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'query_plans.json'),
+            help='Known plan problems per database (default: benchmarks/query_plans.json)',
+        )
+        parser.add_argument(
+            '--update-baseline', action='store_true',
+            help='Record the problems found as known for this database',
+        )
+        parser.add_argument('--scenario', action='append', help='Only check combinations starting with this name')
+        parser.add_argument('--keepdb', action='store_true', help='Reuse the seeded test database between runs')
+
+    def check(self, options):
+        """
+        {combination: [problem, ...]}, per (combination, problem) the statement
+        and plan, and {combination: status} of the requests that were not 200
+        """
+        analyze()
+        large = large_tables(options['min_rows'])
+        client = Client(raise_request_exception=False)
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+
+        results, details, failed = {}, {}, {}
+        for scenario in filter_combinations():
+            if options['scenario'] and not scenario.name.startswith(tuple(options['scenario'])):
+                continue
+            status, statements = capture(client, scenario.url)
+            if status != 200:
+                # An error page's queries say nothing about the view's plans
+                failed[scenario.name] = status
+                self.stderr.write(f'{scenario.name}: status {status}')
+                continue
+            found = set()
+            for sql, params in statements:
+                plan = explain(sql, params)
+                for problem in plan_problems(plan, large):
+                    found.add(problem)
+                    details.setdefault((scenario.name, problem), (normalize(sql), format_plan(plan)))
+            results[scenario.name] = sorted(found)
+            if options['verbosity'] >= 2:
+                self.stdout.write(f'{scenario.name:<48} {status:>4} {len(statements):>3} queries {len(found)} problems')
+        return results, details, failed
+
+    def handle(self, *args, **options):
+        with seeded_database(
+            options['ads'], options['users'], options['seed'], options['keepdb'],
+            stdout=self.stdout if options['verbosity'] >= 2 else None,
+        ):
+            results, details, failed = self.check(options)
+
+        if failed:
+            raise CommandError(f'{len(failed)} filter combination(s) did not return 200: {", ".join(failed)}')
+        if not results:
+            raise CommandError('No filter combinations were checked')
+        path = options['baseline']
+        baseline = {}
+        if os.path.exists(path):
+            with open(path) as source:
+                baseline = json.load(source)
+        # Plans differ between databases, so each keeps its own list
+        known = baseline.get(connection.vendor)
+
+        if options['update_baseline']:
+            # --scenario only replaces the combinations that were checked
+            kept = {name: problems for name, problems in (known or {}).items() if name not in results}
+            baseline[connection.vendor] = {
+                **(kept if options['scenario'] else {}),
+                **{name: problems for name, problems in results.items() if problems},
+            }
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as target:
+                json.dump(baseline, target, indent=2, sort_keys=True)
+                target.write('\n')
+            self.stdout.write(self.style.SUCCESS(f'{connection.vendor} plan baseline written to {path}'))
+            return
+
+        if known is None:
+            raise CommandError(f'No {connection.vendor} baseline in {path}; run with --update-baseline first')
+
+        new = [
+            (name, problem) for name, problems in results.items()
+            for problem in problems if problem not in known.get(name, [])
+        ]
+        fixed = [
+            (name, problem) for name, problems in known.items() if name in results
+            for problem in problems if problem not in results[name]
+        ]
+        for name, problem in new:
+            sql, plan = details[name, problem]
+            self.stderr.write(f'{name}: {problem}')
+            self.stderr.write(f'  {sql[:500]}')
+            for line in plan.splitlines():
+                self.stderr.write(f'    {line}')
+        for name, problem in fixed:
+            self.stdout.write(self.style.WARNING(f'{name}: no longer has "{problem}"; update the baseline'))
+        # Known problems pass, but they are still problems
+        still_known = Counter(
+            problem for name, problems in results.items()
+            for problem in problems if problem in known.get(name, [])
+        )
+        for problem, total in still_known.most_common():
+            self.stdout.write(self.style.WARNING(f'Known in the baseline, {total} combination(s): {problem}'))
+        if new:
+            raise CommandError(f'{len(new)} new plan problem(s) against {path}')
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(results)} filter combinations checked on {connection.vendor}, no new plan problems'
+        ))
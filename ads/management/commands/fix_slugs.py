@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
-from django.utils.text import slugify
+from django.db import transaction
 from ads.models import Ad, Category, Location
+from ads.slugs import allocate_slugs
 from django.contrib.auth import get_user_model
 from decimal import Decimal
 
@@ -13,18 +14,14 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS('Fixing slugs and creating sample data...'))
         
-        # Fix any ads with empty slugs
-        ads_without_slugs = Ad.objects.filter(slug='')
-        for ad in ads_without_slugs:
-            base_slug = slugify(ad.title)
-            slug = base_slug
-            counter = 1
-            while Ad.objects.filter(slug=slug).exists():
-                slug = f'{base_slug}-{counter}'
-                counter += 1
-            ad.slug = slug
-            ad.save()
-            self.stdout.write(f'Fixed slug for ad: {ad.title} -> {ad.slug}')
+        # Fix any ads with empty slugs (one lookup for all of them, one bulk update)
+        with transaction.atomic():
+            ads_without_slugs = list(Ad.objects.select_for_update().filter(slug='').only('id', 'title'))
+            slugs = allocate_slugs(Ad, [ad.title for ad in ads_without_slugs])
+            for ad, slug in zip(ads_without_slugs, slugs):
+                ad.slug = slug
+                self.stdout.write(f'Fixed slug for ad: {ad.title} -> {ad.slug}')
+            Ad.objects.bulk_update(ads_without_slugs, ['slug'], batch_size=500)
         
         # Get or create demo user
         demo_user, created = User.objects.get_or_create(
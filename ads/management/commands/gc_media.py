@@ -0,0 +1,162 @@
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from ads.models import AdImage, ImageBlob
+from ads.storage import is_blob, lock_blob
+
+# Directories under MEDIA_ROOT holding ad images (uploads, blobs, renditions)
+SCANNED_DIRS = ('ads', 'blobs', 'renditions')
+RENDITIONS_DIR = 'renditions/'
+# Directories this deep are swept as one unit of work each
+SPLIT_DEPTH = 3
+
+
+class Command(BaseCommand):
+    help = 'Delete or quarantine ad image files that no AdImage refers to'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report orphaned files')
+        parser.add_argument('--quarantine', metavar='DIR', help='Move orphans into DIR instead of deleting them')
+        parser.add_argument('--workers', type=int, default=8, help='Directories swept in parallel')
+        parser.add_argument(
+            '--min-age-hours', type=float, default=24,
+            help='Skip files modified more recently (uploads not committed yet)',
+        )
+
+    def is_referenced(self, name):
+        if name.startswith(RENDITIONS_DIR):
+            return os.path.dirname(name[len(RENDITIONS_DIR):]) in self.referenced_stems
+        return name in self.referenced
+
+    def is_used(self, name):
+        """Re-read at delete time: the file may have been uploaded again since the sweep started"""
+        if name.startswith(RENDITIONS_DIR):
+            prefix = os.path.dirname(name[len(RENDITIONS_DIR):]) + '.'
+            return (
+                ImageBlob.objects.filter(name__startswith=prefix).exists()
+                or AdImage.objects.filter(image__startswith=prefix).exists()
+            )
+        return AdImage.objects.filter(image=name).exists()
+
+    def remove(self, path, name):
+        """Delete or quarantine one orphan; False if it turned out to be in use"""
+        with transaction.atomic():
+            # Same row lock as uploads and deletes (see ads.storage)
+            blob = lock_blob(name) if is_blob(name) else None
+            if (blob is not None and blob.refcount) or self.is_used(name):
+                return False
+            if self.quarantine:
+                target = os.path.join(self.quarantine, name)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(path, target)
+            else:
+                os.remove(path)
+            if blob is not None:
+                blob.delete()
+        return True
+
+    def check(self, path, stats):
+        name = os.path.relpath(path, self.root).replace(os.sep, '/')
+        stats['scanned'] += 1
+        if self.is_referenced(name):
+            return
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return
+        if stat.st_mtime > self.cutoff:
+            stats['recent'] += 1
+            return
+        if not self.dry_run:
+            try:
+                if not self.remove(path, name):
+                    stats['reused'] += 1
+                    return
+            except OSError as error:
+                stats['errors'] += 1
+                self.stderr.write(f'Could not remove {name}: {error}')
+                return
+        stats['orphans'] += 1
+        stats['bytes'] += stat.st_size
+        if self.verbosity >= 2:
+            self.stdout.write(f'Orphan: {name}')
+
+    def sweep(self, unit):
+        """Check one directory tree (or a list of loose files)"""
+        stats = Counter()
+        try:
+            if isinstance(unit, list):
+                for path in unit:
+                    self.check(path, stats)
+                return stats
+            for directory, _, files in os.walk(unit):
+                for file_name in files:
+                    self.check(os.path.join(directory, file_name), stats)
+            return stats
+        finally:
+            connection.close()
+
+    def work_units(self, directory, depth):
+        """Subdirectories at SPLIT_DEPTH, plus the files found above them"""
+        units, files = [], []
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if depth > 1:
+                        units.extend(self.work_units(entry.path, depth - 1))
+                    else:
+                        units.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    files.append(entry.path)
+        if files:
+            units.append(files)
+        return units
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.verbosity = options['verbosity']
+        self.dry_run = options['dry_run']
+        self.quarantine = options['quarantine']
+        self.root = str(settings.MEDIA_ROOT)
+        self.cutoff = time.time() - options['min_age_hours'] * 3600
+
+        # One streamed read; nothing is locked while the disk is swept, and
+        # each orphan is checked again just before it is removed
+        self.referenced = set(
+            AdImage.objects.exclude(image='').values_list('image', flat=True).iterator(chunk_size=10000)
+        )
+        self.referenced_stems = {os.path.splitext(name)[0] for name in self.referenced}
+        self.stdout.write(f'{len(self.referenced)} referenced files loaded in {time.monotonic() - started:.1f}s')
+
+        units = []
+        for directory in SCANNED_DIRS:
+            path = os.path.join(self.root, directory)
+            if os.path.isdir(path):
+                units.extend(self.work_units(path, SPLIT_DEPTH))
+
+        totals = Counter()
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            futures = [executor.submit(self.sweep, unit) for unit in units]
+            for done, future in enumerate(as_completed(futures), 1):
+                totals.update(future.result())
+                if self.verbosity >= 2 and done % 100 == 0:
+                    self.stdout.write(f'{done}/{len(units)} directories, {totals["scanned"]} files')
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        if self.dry_run:
+            action = 'would be removed'
+        elif self.quarantine:
+            action = f'moved to {self.quarantine}'
+        else:
+            action = 'deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'Scanned {totals["scanned"]} files in {elapsed:.1f}s ({totals["scanned"] / elapsed:.0f} files/s): '
+            f'{totals["orphans"]} orphans ({totals["bytes"] / 1024 / 1024:.1f} MB) {action}, '
+            f'{totals["recent"]} too recent, {totals["reused"]} reused during the sweep, {totals["errors"]} errors'
+        ))
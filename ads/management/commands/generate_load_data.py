@@ -0,0 +1,265 @@
+import random
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+from decimal import Decimal
+from functools import lru_cache
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from ads import counts, search
+from ads.models import Ad, AdImage, Category, Location
+from ads.normalization import normalize_search_text
+from ads.sample_images import COLORS, render_placeholder, store_rendered
+from ads.slugs import slug_allocators, slug_base
+from ads.storage import rebuild_refcounts
+
+User = get_user_model()
+
+# (title parts, price range) per category slug; other categories use 'default'
+VOCABULARY = {
+    'electronics': (
+        ['iPhone 13', 'iPhone 14 Pro', 'iPhone 15 Pro Max', 'Samsung Galaxy S23', 'Samsung Galaxy A54',
+         'Xiaomi Redmi Note 12', 'MacBook Air M2', 'Lenovo ThinkPad', 'PlayStation 5', 'Samsung TV 55"'],
+        ['64GB', '128GB', '256GB', '512GB', 'yangi', 'ishlatilgan', 'kafolat bilan', 'qutisi bilan'],
+        (500_000, 30_000_000),
+    ),
+    'transport': (
+        ['Chevrolet Cobalt', 'Chevrolet Gentra', 'Chevrolet Malibu', 'Toyota Camry', 'Hyundai Tucson',
+         'Kia K5', 'BYD Song Plus', 'Daewoo Matiz', 'Lada Vesta', 'Mercedes E-Class'],
+        [str(year) for year in range(2010, 2025)],
+        (30_000_000, 900_000_000),
+    ),
+    'real-estate': (
+        ['1-xonali kvartira', '2-xonali kvartira', '3-xonali kvartira', '4-xonali kvartira', 'Hovli uy',
+         'Dacha', 'Yer uchastkasi', 'Ofis', "Do'kon", 'Garaj'],
+        ['Chilonzor', 'Yunusobod', 'Mirzo Ulug\'bek', 'Sergeli', 'Yakkasaroy', 'Shayxontohur', 'markazda', 'yangi binoda'],
+        (40_000_000, 1_500_000_000),
+    ),
+    'default': (
+        ['Divan', 'Stol', 'Shkaf', 'Velosiped', 'Kurtka', 'Krossovka', 'Sovutgich', 'Kir yuvish mashinasi',
+         'Bolalar aravachasi', 'Gilam'],
+        ['yangi', 'ishlatilgan', 'arzon', 'sifatli', 'katta', 'kichik', 'zo\'r holatda', 'tez sotiladi'],
+        (50_000, 10_000_000),
+    ),
+}
+DESCRIPTIONS = [
+    'Holati juda yaxshi, hech qanday muammosi yo\'q.',
+    'Narxi kelishiladi, qo\'ng\'iroq qiling.',
+    'Faqat jiddiy xaridorlar uchun.',
+    'Yetkazib berish mavjud.',
+    'Hujjatlari joyida.',
+    'Ayirboshlash ham mumkin.',
+]
+CONDITIONS = [value for value, _ in Ad.CONDITION_CHOICES]
+PASSWORD = 'loadtest123'
+
+
+@lru_cache(maxsize=100_000)
+def search_key(title, description):
+    return normalize_search_text(f'{title} {description}')
+
+
+@contextmanager
+def explicit_timestamps(model):
+    """Let bulk_create keep the created_at/updated_at values it is given"""
+    fields = [
+        field for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Generate a large, reproducible data set (users, ads, images, favorites) for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Users to create (default: 1000)')
+        parser.add_argument('--ads', type=int, default=100_000, help='Ads to create (default: 100000)')
+        parser.add_argument('--favorites', type=int, default=0, help='Favorites to create in total')
+        parser.add_argument('--images-per-ad', type=int, default=0, help='Images per ad (default: 0)')
+        parser.add_argument(
+            '--image-variants', type=int, default=50,
+            help='Distinct placeholder images to render and share between ads (default: 50)',
+        )
+        parser.add_argument('--workers', type=int, default=None, help='Processes rendering images')
+        parser.add_argument('--days', type=int, default=90, help='Spread created_at over this many days')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Rows per INSERT (default: 5000)')
+        parser.add_argument('--seed', type=int, default=1, help='Same seed, same data (default: 1)')
+
+    def report(self, label, rows, started):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.stdout.write(f'{label}: {rows} in {elapsed:.1f}s ({rows / elapsed:.0f}/s)')
+
+    def create_users(self, count, seed, batch_size):
+        prefix = f'load{seed}_'
+        if count <= 0:
+            return []
+        if User.objects.filter(username__startswith=prefix).exists():
+            raise CommandError(f'Users for seed {seed} already exist; use another --seed')
+        # Hashing is deliberately slow, so every user shares one hash
+        password = make_password(PASSWORD)
+        has_phone = any(field.name == 'phone' for field in User._meta.get_fields())
+        user_ids = []
+        for start in range(0, count, batch_size):
+            users = []
+            for number in range(start, min(start + batch_size, count)):
+                user = User(username=f'{prefix}{number}', email=f'{prefix}{number}@example.com', password=password)
+                if has_phone:
+                    user.phone = f'+99890{number % 10_000_000:07d}'
+                users.append(user)
+            user_ids.extend(user.pk for user in User.objects.bulk_create(users))
+        return user_ids
+
+    def create_ads(self, rng, count, user_ids, batch_size, days):
+        categories = list(Category.objects.filter(is_active=True).values_list('id', 'slug'))
+        location_ids = list(Location.objects.filter(is_active=True).values_list('id', flat=True))
+        if not categories or not location_ids:
+            raise CommandError('No categories or locations; run populate_data first')
+
+        # Every title the generator can produce, so slugs need one lookup per 500 bases
+        max_length = Ad._meta.get_field('slug').max_length
+        titles = {
+            slug: [f'{item} {detail}' for item in items for detail in details]
+            for slug, (items, details, _) in VOCABULARY.items()
+        }
+        bases = {title: slug_base(title, max_length) for options in titles.values() for title in options}
+        allocators = slug_allocators(Ad, bases.values())
+
+        now = timezone.now()
+        span = days * 86400
+        ad_ids = []
+        with explicit_timestamps(Ad):
+            for start in range(0, count, batch_size):
+                ads = []
+                for _ in range(min(batch_size, count - start)):
+                    category_id, category_slug = rng.choice(categories)
+                    vocabulary = category_slug if category_slug in VOCABULARY else 'default'
+                    title = rng.choice(titles[vocabulary])
+                    low, high = VOCABULARY[vocabulary][2]
+                    description = rng.choice(DESCRIPTIONS)
+                    created_at = now - timedelta(seconds=rng.randrange(span))
+                    base = bases[title]
+                    ads.append(Ad(
+                        title=title,
+                        slug=allocators[base].allocate(base),
+                        description=description,
+                        category_id=category_id,
+                        location_id=rng.choice(location_ids),
+                        user_id=rng.choice(user_ids),
+                        price=Decimal(rng.randrange(low, high, 1000)),
+                        condition=rng.choice(CONDITIONS),
+                        phone=f'+99890{rng.randrange(10_000_000):07d}',
+                        is_negotiable=rng.random() < 0.5,
+                        is_active=rng.random() < 0.95,
+                        is_featured=rng.random() < 0.02,
+                        is_vip=rng.random() < 0.03,
+                        views_count=int(rng.expovariate(1 / 50)),
+                        created_at=created_at,
+                        updated_at=created_at,
+                        search_key=search_key(title, description),
+                    ))
+                ad_ids.extend(ad.pk for ad in Ad.objects.bulk_create(ads))
+                if self.verbosity >= 2:
+                    self.stdout.write(f'{len(ad_ids)}/{count} ads')
+        return ad_ids
+
+    def create_images(self, rng, ad_ids, per_ad, variants, workers, batch_size):
+        tasks = [(f'OLX #{number + 1}', COLORS[number % len(COLORS)]) for number in range(variants)]
+        # Rendering and resizing is CPU-bound; files are written here, once each
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            stored = [store_rendered(rendered) for rendered in executor.map(render_placeholder, tasks)]
+
+        total = 0
+        for start in range(0, len(ad_ids), batch_size):
+            images = [
+                AdImage(ad_id=ad_id, is_main=order == 0, order=order, **rng.choice(stored))
+                for ad_id in ad_ids[start:start + batch_size]
+                for order in range(per_ad)
+            ]
+            AdImage.objects.bulk_create(images)
+            total += len(images)
+        rebuild_refcounts()
+        return total
+
+    def create_favorites(self, rng, count, user_ids, ad_ids, batch_size):
+        through = Ad.favorited_by.through
+        ad_field = Ad.favorited_by.field.m2m_field_name()
+        user_field = Ad.favorited_by.field.m2m_reverse_field_name()
+        count = min(count, len(user_ids) * len(ad_ids))
+        pairs = set()
+        while len(pairs) < count:
+            pairs.add((rng.choice(ad_ids), rng.choice(user_ids)))
+        pairs = sorted(pairs)
+        for start in range(0, len(pairs), batch_size):
+            through.objects.bulk_create(
+                through(**{f'{ad_field}_id': ad_id, f'{user_field}_id': user_id})
+                for ad_id, user_id in pairs[start:start + batch_size]
+            )
+
+        # Counters take few distinct values, so one UPDATE per value
+        by_total = {}
+        for ad_id, total in Counter(ad_id for ad_id, _ in pairs).items():
+            by_total.setdefault(total, []).append(ad_id)
+        for total, ids in by_total.items():
+            for start in range(0, len(ids), batch_size):
+                Ad.objects.filter(pk__in=ids[start:start + batch_size]).update(favorites_count=total)
+        return len(pairs)
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        rng = random.Random(options['seed'])
+        batch_size = options['batch_size']
+        started = time.monotonic()
+
+        with transaction.atomic():
+            step = time.monotonic()
+            user_ids = self.create_users(options['users'], options['seed'], batch_size)
+            self.report('Users', len(user_ids), step)
+            if not user_ids:
+                user_ids = list(User.objects.values_list('id', flat=True))
+                if not user_ids:
+                    raise CommandError('No users to own the ads; use --users')
+
+            step = time.monotonic()
+            ad_ids = self.create_ads(rng, options['ads'], user_ids, batch_size, options['days'])
+            self.report('Ads', len(ad_ids), step)
+
+            if options['images_per_ad'] > 0 and ad_ids:
+                step = time.monotonic()
+                total = self.create_images(
+                    rng, ad_ids, options['images_per_ad'], max(options['image_variants'], 1),
+                    options['workers'], batch_size,
+                )
+                self.report('Images', total, step)
+
+            if options['favorites'] > 0 and ad_ids:
+                step = time.monotonic()
+                total = self.create_favorites(rng, options['favorites'], user_ids, ad_ids, batch_size)
+                self.report('Favorites', total, step)
+
+        # bulk_create skips signals: bring the derived data up to date in bulk
+        step = time.monotonic()
+        search.rebuild_index()
+        call_command('recount_ads', stdout=self.stdout if self.verbosity >= 2 else StringIO())
+        counts.bump_versions()
+        self.report('Index and counters', len(ad_ids), step)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated {len(ad_ids)} ads in {time.monotonic() - started:.1f}s (seed {options["seed"]})'
+        ))
@@ -0,0 +1,68 @@
+import os
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ads.images import RENDITIONS, FORMATS, rendition_path
+from ads.models import AdImage
+from ads.storage import image_storage, is_blob, rebuild_refcounts
+
+
+class Command(BaseCommand):
+    help = 'Move ad images into content-addressed storage and rebuild blob reference counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+
+    def move_renditions(self, old, new):
+        # Renditions are keyed by the file name; keep them instead of reprocessing
+        for size in RENDITIONS:
+            for extension in FORMATS:
+                source = rendition_path(old, size, extension)
+                if not default_storage.exists(source):
+                    continue
+                target = rendition_path(new, size, extension)
+                if default_storage.exists(target):
+                    default_storage.delete(source)
+                    continue
+                os.makedirs(os.path.dirname(default_storage.path(target)), exist_ok=True)
+                os.replace(default_storage.path(source), default_storage.path(target))
+
+    def handle(self, *args, **options):
+        names = AdImage.objects.exclude(image='').order_by().values_list('image', flat=True).distinct()
+        moved = {}
+        missing = 0
+        for name in names.iterator():
+            if is_blob(name):
+                continue
+            if not image_storage.exists(name):
+                missing += 1
+                self.stderr.write(f'Missing file: {name}')
+                continue
+            if options['dry_run']:
+                moved[name] = None
+                continue
+            with image_storage.open(name, 'rb') as original:
+                moved[name] = image_storage.save(name, File(original))
+            self.move_renditions(name, moved[name])
+
+        if options['dry_run']:
+            self.stdout.write(self.style.SUCCESS(f'{len(moved)} files would be moved ({missing} missing)'))
+            return
+
+        with transaction.atomic():
+            for old, new in moved.items():
+                AdImage.objects.filter(image=old).update(image=new)
+            blobs = rebuild_refcounts()
+
+        # The rows point at the blobs now; the old copies can go
+        for old in moved:
+            if image_storage.exists(old):
+                image_storage.delete(old)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {len(moved)} files into {len(set(moved.values()))} blobs '
+            f'({blobs} blobs referenced, {missing} missing)'
+        ))
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ads import search
+from ads.models import Ad, Category
+from ads.normalization import normalize_search_text
+
+
+class Command(BaseCommand):
+    help = 'Recompute normalized search keys for ads and categories, then rebuild the search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000, help='Rows per bulk_update')
+        parser.add_argument('--skip-index', action='store_true', help='Do not rebuild the full-text index')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        categories = list(Category.objects.all())
+        for category in categories:
+            category.search_key = normalize_search_text(f'{category.name} {category.name_ru}')
+        Category.objects.bulk_update(categories, ['search_key'], batch_size=batch_size)
+        self.stdout.write(f'Updated {len(categories)} categories')
+
+        updated = 0
+        batch = []
+        ads = Ad.objects.order_by().only('id', 'title', 'description')
+        for ad in ads.iterator(chunk_size=batch_size):
+            ad.search_key = normalize_search_text(f'{ad.title} {ad.description}')
+            batch.append(ad)
+            if len(batch) >= batch_size:
+                Ad.objects.bulk_update(batch, ['search_key'])
+                updated += len(batch)
+                batch = []
+        if batch:
+            Ad.objects.bulk_update(batch, ['search_key'])
+            updated += len(batch)
+        self.stdout.write(f'Updated {updated} ads')
+
+        if not options['skip_index']:
+            with transaction.atomic():
+                search.rebuild_index(batch_size=batch_size)
+            self.stdout.write('Search index rebuilt')
+
+        self.stdout.write(self.style.SUCCESS('Search keys normalized!'))
@@ -0,0 +1,36 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.db.models import Q
+
+from ads.images import process_image
+from ads.models import AdImage
+
+
+class Command(BaseCommand):
+    help = 'Write renditions, dimensions, placeholders and hashes for ad images that have not been processed yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Reprocess every image')
+        parser.add_argument('--workers', type=int, default=4, help='Images processed in parallel')
+
+    def process(self, image_id):
+        try:
+            return process_image(image_id)
+        except Exception as error:
+            self.stderr.write(f'Image {image_id} failed: {error}')
+            return False
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        images = AdImage.objects.exclude(image='')
+        if not options['all']:
+            images = images.filter(Q(processed_at__isnull=True) | Q(placeholder='') | Q(content_hash=''))
+        image_ids = list(images.values_list('id', flat=True))
+
+        with ThreadPoolExecutor(max_workers=max(options['workers'], 1)) as executor:
+            processed = sum(executor.map(self.process, image_ids))
+
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} of {len(image_ids)} images'))
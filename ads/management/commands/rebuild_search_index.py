@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ads import search
+from ads.models import Ad
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index for all ads'
+
+    def handle(self, *args, **options):
+        self.stdout.write('Rebuilding search index...')
+
+        with transaction.atomic():
+            rebuilt = search.rebuild_index()
+
+        if not rebuilt:
+            self.stdout.write(self.style.WARNING(
+                'Full-text search is not supported on this database, nothing to do'
+            ))
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Search index rebuilt for {Ad.objects.count()} ads'
+        ))
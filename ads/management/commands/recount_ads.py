@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from ads.models import Ad, Category, Location
+
+
+class Command(BaseCommand):
+    help = 'Recompute Category.ads_count and Location.ads_count from active ads'
+
+    def recount(self, model, field):
+        # One grouped query for all counters of this model
+        totals = dict(
+            Ad.objects.filter(is_active=True).order_by().values_list(field).annotate(total=Count('id'))
+        )
+        changed = []
+        for obj in model.objects.only('id', 'name', 'ads_count'):
+            total = totals.get(obj.pk, 0)
+            if obj.ads_count != total:
+                obj.ads_count = total
+                changed.append(obj)
+        model.objects.bulk_update(changed, ['ads_count'], batch_size=500)
+        return changed
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            categories = self.recount(Category, 'category')
+            locations = self.recount(Location, 'location')
+
+        for obj in categories + locations:
+            self.stdout.write(f'Fixed counter: {obj} -> {obj.ads_count}')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Counters reconciled ({len(categories)} categories, {len(locations)} locations fixed)'
+        ))
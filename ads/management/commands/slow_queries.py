@@ -0,0 +1,59 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ads.slow_queries import LOG_BACKUPS, log_path
+
+
+class Command(BaseCommand):
+    help = 'Summarize the slow query log: statements with the most total time first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None, help='Log file (default: SLOW_QUERY_LOG)')
+        parser.add_argument('--top', type=int, default=10, help='Fingerprints to show (default: 10)')
+        parser.add_argument('--plans', action='store_true', help='Print the captured query plan of each')
+
+    def entries(self, path):
+        """Entries of the log and its rotated backups, oldest first"""
+        paths = [f'{path}.{number}' for number in range(LOG_BACKUPS, 0, -1)] + [path]
+        for file_path in paths:
+            if not os.path.exists(file_path):
+                continue
+            with open(file_path, encoding='utf-8') as log:
+                for line in log:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def handle(self, *args, **options):
+        path = options['log'] or log_path()
+        if not os.path.exists(path):
+            raise CommandError(f'No slow query log at {path}; is SLOW_QUERY_MS set?')
+
+        stats = {}
+        for entry in self.entries(path):
+            item = stats.setdefault(entry['fingerprint'], {
+                'sql': entry['sql'], 'count': 0, 'total': 0.0, 'max': 0.0, 'views': set(), 'plan': None,
+            })
+            item['count'] += 1
+            item['total'] += entry['duration_ms']
+            item['max'] = max(item['max'], entry['duration_ms'])
+            item['views'].add(entry['view'])
+            # The latest plan wins: it reflects the current indexes
+            if entry.get('plan'):
+                item['plan'] = entry['plan']
+
+        ranked = sorted(stats.items(), key=lambda pair: pair[1]['total'], reverse=True)[:options['top']]
+        for fingerprint, item in ranked:
+            self.stdout.write(self.style.WARNING(
+                f'{fingerprint}  total {item["total"]:.0f}ms  count {item["count"]}  '
+                f'avg {item["total"] / item["count"]:.1f}ms  max {item["max"]:.1f}ms'
+            ))
+            self.stdout.write(f'  views: {", ".join(sorted(item["views"]))}')
+            self.stdout.write(f'  {item["sql"][:500]}')
+            if options['plans'] and item['plan']:
+                for line in item['plan'].splitlines():
+                    self.stdout.write(f'    {line}')
+        self.stdout.write(self.style.SUCCESS(f'{len(stats)} distinct slow statements in {path}'))
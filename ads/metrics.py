@@ -0,0 +1,347 @@
+"""
+In-process metrics, aggregated across worker processes through files.
+
+Every process keeps its counters and histograms in memory and writes
+them, at most every ``METRICS_FLUSH_SECONDS`` and at exit, to its own
+JSON file in ``METRICS_DIR``. ``render_prometheus`` sums the files of all
+processes (files of exited workers included, so counters never go
+backwards when a worker is recycled) and returns the Prometheus text
+format served by ``ads:metrics``. At most every
+``METRICS_COMPACT_SECONDS`` a scrape folds the files of exited workers
+into one ``retired.json`` and removes temp files left by interrupted
+writes, so the directory doesn't grow with every restart.
+
+``MetricsMiddleware`` records requests, latency and DB queries per
+resolved route; cache lookups and image processing are recorded where
+they happen.
+"""
+import atexit
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+try:
+    import fcntl
+except ImportError:  # Windows: exited workers' files are kept as they are
+    fcntl = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 4, 6, 8, 12, 16, 32, 64, 128)
+METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+
+# name: (type, help, buckets)
+METRICS = {
+    'olx_http_requests_total': ('counter', 'Requests by route, method and status', None),
+    'olx_http_request_duration_seconds': ('histogram', 'Request latency by route', LATENCY_BUCKETS),
+    'olx_db_queries_per_request': ('histogram', 'SQL queries per request by route', QUERY_BUCKETS),
+    'olx_cache_requests_total': ('counter', 'Cache lookups by cache and result (hit/miss)', None),
+    'olx_image_processing_seconds': ('histogram', 'Time to process one uploaded ad image', LATENCY_BUCKETS),
+}
+
+RETIRED_FILE = 'retired.json'
+LOCK_FILE = '.lock'
+# A temp file this old was left by a process that died while flushing
+STALE_TEMP_SECONDS = 3600
+
+
+def metrics_dir():
+    return getattr(settings, 'METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'olx-metrics')
+
+
+class Registry:
+    """Counters and histograms of this process"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.histograms = {}
+        self.flushed_at = time.monotonic()
+        self.compacted_at = None
+        self.file_name = None
+
+    def inc(self, name, amount=1, **labels):
+        with self.lock:
+            self.counters[name, tuple(sorted(labels.items()))] += amount
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        buckets = METRICS[name][2]
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+            for position, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram['buckets'][position] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [
+                    [name, labels, histogram['buckets'][:], histogram['sum'], histogram['count']]
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed_at >= getattr(settings, 'METRICS_FLUSH_SECONDS', 10):
+            self.flush()
+
+    def flush(self):
+        """Write this process's file"""
+        self.flushed_at = time.monotonic()
+        if not self.counters and not self.histograms:
+            return
+        directory = metrics_dir()
+        if self.file_name is None:
+            # The start time keeps a recycled pid from overwriting an exited worker's file
+            self.file_name = f'{os.getpid()}-{time.time_ns()}.json'
+        try:
+            write_metrics(os.path.join(directory, self.file_name), self.snapshot())
+        except OSError:
+            pass
+
+
+registry = Registry()
+atexit.register(registry.flush)
+
+
+def inc(name, amount=1, **labels):
+    registry.inc(name, amount, **labels)
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, **labels)
+
+
+def timed(name, **labels):
+    """Observe the duration of each call to the decorated function in histogram ``name``"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - started, **labels)
+        return wrapper
+    return decorator
+
+
+def read_metrics(path):
+    try:
+        with open(path) as source:
+            return json.load(source)
+    except (OSError, ValueError):
+        return None
+
+
+def write_metrics(path, data):
+    """Replace ``path`` atomically, so readers never see half of it"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(handle, 'w') as temp:
+        json.dump(data, temp)
+    os.replace(temp_path, path)
+
+
+def merge(counters, histograms, data):
+    for name, labels, value in data['counters']:
+        counters[name, tuple(map(tuple, labels))] += value
+    for name, labels, buckets, total, count in data['histograms']:
+        key = (name, tuple(map(tuple, labels)))
+        if key not in histograms:
+            histograms[key] = {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0}
+        histogram = histograms[key]
+        histogram['buckets'] = [mine + theirs for mine, theirs in zip(histogram['buckets'], buckets)]
+        histogram['sum'] += total
+        histogram['count'] += count
+
+
+def worker_pid(file_name):
+    """The pid in a worker file name (``<pid>-<start ns>.json``), else None"""
+    pid = file_name.split('-', 1)[0]
+    return int(pid) if file_name.endswith('.json') and pid.isdigit() else None
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def compact(directory):
+    """Fold the files of exited workers into RETIRED_FILE and remove stale temp files"""
+    if fcntl is None or not os.path.isdir(directory):
+        return
+    retired_path = os.path.join(directory, RETIRED_FILE)
+    with open(os.path.join(directory, LOCK_FILE), 'w') as lock:
+        # One compaction at a time, or two could fold the same file twice
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        file_names = set(os.listdir(directory))
+        stale = time.time() - STALE_TEMP_SECONDS
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            try:
+                if file_name.endswith('.tmp') and os.path.getmtime(path) < stale:
+                    os.remove(path)
+            except OSError:
+                pass
+
+        retired = read_metrics(retired_path) or {'counters': [], 'histograms': [], 'folded': []}
+        # Folded before, but a compaction stopped before removing them
+        folded = [file_name for file_name in retired['folded'] if file_name in file_names]
+        exited = {}
+        for file_name in sorted(file_names - set(folded)):
+            pid = worker_pid(file_name)
+            if pid is not None and not is_running(pid):
+                data = read_metrics(os.path.join(directory, file_name))
+                if data is not None:
+                    exited[file_name] = data
+        if exited:
+            counters, histograms = defaultdict(float), {}
+            merge(counters, histograms, retired)
+            for data in exited.values():
+                merge(counters, histograms, data)
+            # The folded names go in the same write, so they are never counted twice
+            write_metrics(retired_path, {
+                'counters': [[name, labels, value] for (name, labels), value in counters.items()],
+                'histograms': [
+                    [name, labels, histogram['buckets'], histogram['sum'], histogram['count']]
+                    for (name, labels), histogram in histograms.items()
+                ],
+                'folded': folded + list(exited),
+            })
+        for file_name in folded + list(exited):
+            try:
+                os.remove(os.path.join(directory, file_name))
+            except FileNotFoundError:
+                pass
+
+
+def collect():
+    """Sum of the metrics of every process that has written a file"""
+    registry.flush()
+    directory = metrics_dir()
+    now = time.monotonic()
+    interval = getattr(settings, 'METRICS_COMPACT_SECONDS', 300)
+    if registry.compacted_at is None or now - registry.compacted_at >= interval:
+        registry.compacted_at = now
+        try:
+            compact(directory)
+        except OSError:
+            pass
+
+    counters = defaultdict(float)
+    histograms = {}
+    try:
+        file_names = [name for name in os.listdir(directory) if name.endswith('.json')]
+    except FileNotFoundError:
+        file_names = []
+    # The retired file is read last: a worker file removed by a compaction
+    # meanwhile is then in its totals, and one read before is in ``folded``
+    file_names.sort(key=lambda name: name == RETIRED_FILE)
+    loaded = {}
+    for file_name in file_names:
+        data = read_metrics(os.path.join(directory, file_name))
+        if data is not None:
+            loaded[file_name] = data
+    folded = set(loaded.get(RETIRED_FILE, {}).get('folded', ()))
+    for file_name, data in loaded.items():
+        if file_name not in folded:
+            merge(counters, histograms, data)
+    return counters, histograms
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels) + '}'
+
+
+def format_number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render_prometheus():
+    counters, histograms = collect()
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind == 'counter':
+            for (metric, labels), value in sorted(counters.items()):
+                if metric == name:
+                    lines.append(f'{name}{format_labels(labels)} {format_number(value)}')
+            continue
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets, histogram['buckets']):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", format_number(bound)),))} {cumulative}')
+            lines.append(f'{name}_bucket{format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {format_number(histogram["sum"])}')
+            lines.append(f'{name}_count{format_labels(labels)} {histogram["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class MetricsMiddleware:
+    """Requests, latency and queries per resolved route (URL name, not path)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        counter = QueryCounter()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        match = getattr(request, 'resolver_match', None)
+        # Unresolved paths share one label, so scanners can't blow up the series count
+        route = match.view_name if match else 'unresolved'
+        method = request.method if request.method in METHODS else 'other'
+        inc('olx_http_requests_total', route=route, method=method, status=str(response.status_code))
+        observe('olx_http_request_duration_seconds', elapsed, route=route)
+        observe('olx_db_queries_per_request', counter.count, route=route)
+        return response
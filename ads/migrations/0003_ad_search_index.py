@@ -0,0 +1,43 @@
+from django.db import migrations
+
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS ads_ad_fts USING fts5("
+    "title, description, tokenize = 'unicode61 remove_diacritics 2')",
+    "INSERT INTO ads_ad_fts (rowid, title, description) "
+    "SELECT id, title, description FROM ads_ad",
+]
+SQLITE_BACKWARD = ['DROP TABLE IF EXISTS ads_ad_fts']
+
+POSTGRESQL_FORWARD = [
+    'CREATE TABLE IF NOT EXISTS ads_ad_search ('
+    'ad_id bigint PRIMARY KEY REFERENCES ads_ad (id) ON DELETE CASCADE '
+    'DEFERRABLE INITIALLY DEFERRED, document tsvector NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ads_ad_search_document_gin '
+    'ON ads_ad_search USING GIN (document)',
+    "INSERT INTO ads_ad_search (ad_id, document) SELECT id, "
+    "setweight(to_tsvector('simple', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'B') FROM ads_ad",
+]
+POSTGRESQL_BACKWARD = ['DROP TABLE IF EXISTS ads_ad_search']
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0002_alter_location_options'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_BACKWARD, 'postgresql': POSTGRESQL_BACKWARD}),
+        ),
+    ]
@@ -0,0 +1,89 @@
+# Generated by Django 5.2.3 on 2026-10-18 13:58
+
+from django.db import migrations, models
+
+from ads.normalization import normalize_search_text
+
+
+def backfill_search_keys(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    Category = apps.get_model('ads', 'Category')
+
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.search_key = normalize_search_text(f'{category.name} {category.name_ru}')
+    Category.objects.bulk_update(categories, ['search_key'])
+
+    batch = []
+    for ad in Ad.objects.only('id', 'title', 'description').iterator(chunk_size=2000):
+        ad.search_key = normalize_search_text(f'{ad.title} {ad.description}')
+        batch.append(ad)
+        if len(batch) >= 2000:
+            Ad.objects.bulk_update(batch, ['search_key'])
+            batch = []
+    Ad.objects.bulk_update(batch, ['search_key'])
+
+
+def rebuild_search_index(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    vendor = schema_editor.connection.vendor
+    rows = [
+        (ad_id, normalize_search_text(title), search_key)
+        for ad_id, title, search_key in Ad.objects.values_list('id', 'title', 'search_key')
+    ]
+
+    with schema_editor.connection.cursor() as cursor:
+        if vendor == 'sqlite':
+            cursor.execute('DROP TABLE IF EXISTS ads_ad_fts')
+            cursor.execute(
+                "CREATE VIRTUAL TABLE ads_ad_fts USING fts5("
+                "title, search_key, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+            cursor.executemany(
+                'INSERT INTO ads_ad_fts (rowid, title, search_key) VALUES (%s, %s, %s)', rows
+            )
+        elif vendor == 'postgresql':
+            cursor.execute('TRUNCATE ads_ad_search')
+            cursor.executemany(
+                "INSERT INTO ads_ad_search (ad_id, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || "
+                "setweight(to_tsvector('simple', %s), 'B'))",
+                rows,
+            )
+
+
+def restore_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS ads_ad_fts')
+        cursor.execute(
+            "CREATE VIRTUAL TABLE ads_ad_fts USING fts5("
+            "title, description, tokenize = 'unicode61 remove_diacritics 2')"
+        )
+        cursor.execute(
+            'INSERT INTO ads_ad_fts (rowid, title, description) '
+            'SELECT id, title, description FROM ads_ad'
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0003_ad_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='search_key',
+            field=models.TextField(blank=True, editable=False, verbose_name='Qidiruv kaliti'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='search_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, verbose_name='Qidiruv kaliti'),
+        ),
+        migrations.RunPython(backfill_search_keys, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_search_index, restore_search_index),
+    ]
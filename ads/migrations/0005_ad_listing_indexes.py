@@ -0,0 +1,27 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0004_search_key'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['is_active', '-is_featured', '-is_vip', '-created_at', '-id'], name='ad_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['category', 'is_active', '-is_featured', '-is_vip', '-created_at', '-id'], name='ad_category_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(fields=['location', 'is_active', '-is_featured', '-is_vip', '-created_at', '-id'], name='ad_location_listing_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:03
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_ads(apps, schema_editor):
+    Ad = apps.get_model('ads', 'Ad')
+    for model_name, field in (('Category', 'category'), ('Location', 'location')):
+        model = apps.get_model('ads', model_name)
+        totals = dict(
+            Ad.objects.filter(is_active=True).order_by().values_list(field).annotate(total=Count('id'))
+        )
+        objects = list(model.objects.all())
+        for obj in objects:
+            obj.ads_count = totals.get(obj.pk, 0)
+        model.objects.bulk_update(objects, ['ads_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0005_ad_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='ads_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="E'lonlar soni"),
+        ),
+        migrations.AddField(
+            model_name='location',
+            name='ads_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="E'lonlar soni"),
+        ),
+        migrations.RunPython(count_ads, migrations.RunPython.noop),
+    ]
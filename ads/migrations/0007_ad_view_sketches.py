@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0006_ads_count_columns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='unique_views_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name="Noyob ko'rishlar soni"),
+        ),
+        migrations.CreateModel(
+            name='AdViewSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Sana')),
+                ('sketch', models.BinaryField(verbose_name='Sketch')),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='view_sketches', to='ads.ad', verbose_name="E'lon")),
+            ],
+            options={
+                'verbose_name': "Ko'rishlar sketchi",
+                'verbose_name_plural': "Ko'rishlar sketchlari",
+                'unique_together': {('ad', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0007_ad_view_sketches'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adimage',
+            name='processed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='Qayta ishlangan sana'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0008_adimage_processed_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adimage',
+            name='height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Balandlik'),
+        ),
+        migrations.AddField(
+            model_name='adimage',
+            name='placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Placeholder'),
+        ),
+        migrations.AddField(
+            model_name='adimage',
+            name='width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Kenglik'),
+        ),
+    ]
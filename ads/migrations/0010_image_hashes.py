@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0009_adimage_dimensions_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='adimage',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, verbose_name='Fayl xeshi'),
+        ),
+        migrations.AddField(
+            model_name='adimage',
+            name='phash',
+            field=models.BigIntegerField(blank=True, editable=False, null=True, verbose_name='Perseptual xesh'),
+        ),
+        migrations.CreateModel(
+            name='AdImageHashBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('band', models.PositiveSmallIntegerField(verbose_name="Bo'lak")),
+                ('value', models.PositiveIntegerField(verbose_name='Qiymat')),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hash_bands', to='ads.adimage', verbose_name='Rasm')),
+            ],
+            options={
+                'verbose_name': "Rasm xeshi bo'lagi",
+                'verbose_name_plural': "Rasm xeshi bo'laklari",
+                'indexes': [models.Index(fields=['band', 'value'], name='ads_adimage_band_a87ed5_idx')],
+                'unique_together': {('image', 'band')},
+            },
+        ),
+    ]
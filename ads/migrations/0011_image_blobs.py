@@ -0,0 +1,33 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:15
+
+import ads.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0010_image_hashes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Fayl')),
+                ('size', models.PositiveBigIntegerField(default=0, verbose_name='Hajmi')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Havolalar soni')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Yaratilgan sana')),
+            ],
+            options={
+                'verbose_name': 'Rasm fayli',
+                'verbose_name_plural': 'Rasm fayllari',
+            },
+        ),
+        migrations.AlterField(
+            model_name='adimage',
+            name='image',
+            field=models.ImageField(storage=ads.storage.get_image_storage, upload_to='ads/%Y/%m/%d/', verbose_name='Rasm'),
+        ),
+    ]
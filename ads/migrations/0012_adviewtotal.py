@@ -0,0 +1,51 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+from ads.hyperloglog import HyperLogLog
+
+
+def merge_daily_sketches(apps, schema_editor):
+    AdViewSketch = apps.get_model('ads', 'AdViewSketch')
+    AdViewTotal = apps.get_model('ads', 'AdViewTotal')
+    batch = []
+    current_id, total = None, None
+    # Ordered by ad, so only one ad's sketch is held at a time
+    rows = AdViewSketch.objects.order_by('ad_id').values_list('ad_id', 'sketch')
+    for ad_id, data in rows.iterator():
+        sketch = HyperLogLog.from_bytes(data)
+        if ad_id == current_id:
+            total.merge(sketch)
+            continue
+        if total is not None:
+            batch.append(AdViewTotal(ad_id=current_id, sketch=total.to_bytes()))
+        current_id, total = ad_id, sketch
+        if len(batch) >= 1000:
+            AdViewTotal.objects.bulk_create(batch)
+            batch = []
+    if total is not None:
+        batch.append(AdViewTotal(ad_id=current_id, sketch=total.to_bytes()))
+    AdViewTotal.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0011_image_blobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdViewTotal',
+            fields=[
+                ('ad', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='view_total', serialize=False, to='ads.ad', verbose_name="E'lon")),
+                ('sketch', models.BinaryField(verbose_name='Sketch')),
+            ],
+            options={
+                'verbose_name': "Jami ko'rishlar sketchi",
+                'verbose_name_plural': "Jami ko'rishlar sketchlari",
+            },
+        ),
+        migrations.RunPython(merge_daily_sketches, migrations.RunPython.noop),
+    ]
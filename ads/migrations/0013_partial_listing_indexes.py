@@ -0,0 +1,39 @@
+# Generated by Django 5.2.3 on 2026-10-18 14:57
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ads', '0012_adviewtotal'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ad',
+            name='ad_listing_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ad',
+            name='ad_category_listing_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='ad',
+            name='ad_location_listing_idx',
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-is_featured', '-is_vip', '-created_at', '-id'], name='ad_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['category', '-is_featured', '-is_vip', '-created_at', '-id'], name='ad_category_listing_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='ad',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['location', '-is_featured', '-is_vip', '-created_at', '-id'], name='ad_location_listing_idx'),
+        ),
+    ]
@@ -1,10 +1,15 @@
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.utils.translation import gettext_lazy as _
 from django.utils.text import slugify
-from PIL import Image
-import os
+from .normalization import normalize_search_text
+from .slugs import SLUG_RETRIES, allocate_slug, random_slug, slug_base
+from .images import enqueue, renditions_for
+from .storage import get_image_storage, retain, release
+from .thumbnails import thumbnails_for
+from .duplicates import near_duplicates
 
 User = get_user_model()
 
@@ -20,6 +25,8 @@ class Category(models.Model):
     is_active = models.BooleanField(_('Faol'), default=True)
     order = models.PositiveIntegerField(_('Tartib'), default=0)
     created_at = models.DateTimeField(_('Yaratilgan sana'), auto_now_add=True)
+    search_key = models.CharField(_('Qidiruv kaliti'), max_length=255, blank=True, editable=False, db_index=True)
+    ads_count = models.PositiveIntegerField(_('E\'lonlar soni'), default=0, editable=False)
 
     class Meta:
         verbose_name = _('Kategoriya')
@@ -32,15 +39,16 @@ class Category(models.Model):
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'name', 'name_ru'}.intersection(update_fields):
+            self.search_key = normalize_search_text(f'{self.name} {self.name_ru}')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'search_key'}
         super().save(*args, **kwargs)
 
     def get_absolute_url(self):
         return reverse('ads:category', kwargs={'slug': self.slug})
 
-    @property
-    def ads_count(self):
-        return self.ads.filter(is_active=True).count()
-
 
 class Location(models.Model):
     """Locations for ads"""
@@ -49,6 +57,7 @@ class Location(models.Model):
     slug = models.SlugField(_('Slug'), unique=True)
     is_active = models.BooleanField(_('Faol'), default=True)
     order = models.PositiveIntegerField(_('Tartib'), default=0)
+    ads_count = models.PositiveIntegerField(_('E\'lonlar soni'), default=0, editable=False)
 
     class Meta:
         verbose_name = _('Joylashuv')
@@ -63,9 +72,24 @@ class Location(models.Model):
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
 
-    @property
-    def ads_count(self):
-        return self.ads.filter(is_active=True).count()
+
+def favorite_user_field():
+    """User column of the favorites table, named after the user model (e.g. customuser_id)"""
+    return f'{Ad.favorited_by.field.m2m_reverse_field_name()}_id'
+
+
+class AdQuerySet(models.QuerySet):
+    """Ad queryset helpers for listings"""
+
+    def with_main_image(self):
+        """Prefetch each ad's main image in one query for the whole page"""
+        return self.prefetch_related(
+            models.Prefetch(
+                'images',
+                queryset=AdImage.objects.order_by(*AdImage.MAIN_IMAGE_ORDERING)[:1],
+                to_attr='_main_images',
+            )
+        )
 
 
 class Ad(models.Model):
@@ -107,15 +131,22 @@ class Ad(models.Model):
     # Statistics
     views_count = models.PositiveIntegerField(_('Ko\'rishlar soni'), default=0)
     favorites_count = models.PositiveIntegerField(_('Tanlanganlar soni'), default=0)
+    # Estimated from the AdViewTotal sketch when view counts are flushed
+    unique_views_count = models.PositiveIntegerField(_('Noyob ko\'rishlar soni'), default=0, editable=False)
     
     # Dates
     created_at = models.DateTimeField(_('Yaratilgan sana'), auto_now_add=True)
     updated_at = models.DateTimeField(_('Yangilangan sana'), auto_now=True)
     expires_at = models.DateTimeField(_('Tugash sanasi'), null=True, blank=True)
     
+    # Normalized title + description used by search (see ads.normalization)
+    search_key = models.TextField(_('Qidiruv kaliti'), blank=True, editable=False)
+    
     # Many-to-many fields
     favorited_by = models.ManyToManyField(User, related_name='favorites', blank=True, verbose_name=_('Tanlanganlar'))
 
+    objects = AdQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('E\'lon')
         verbose_name_plural = _('E\'lonlar')
@@ -124,48 +155,116 @@ class Ad(models.Model):
             models.Index(fields=['category', 'location', 'is_active']),
             models.Index(fields=['created_at']),
             models.Index(fields=['is_featured', 'is_vip']),
+            # Keyset pagination follows the listing order (see ads.pagination).
+            # Partial, because is_active=True is a bare "WHERE is_active" on
+            # SQLite, which can't match an indexed is_active column
+            models.Index(
+                fields=['-is_featured', '-is_vip', '-created_at', '-id'],
+                condition=models.Q(is_active=True), name='ad_listing_idx',
+            ),
+            models.Index(
+                fields=['category', '-is_featured', '-is_vip', '-created_at', '-id'],
+                condition=models.Q(is_active=True), name='ad_category_listing_idx',
+            ),
+            models.Index(
+                fields=['location', '-is_featured', '-is_vip', '-created_at', '-id'],
+                condition=models.Q(is_active=True), name='ad_location_listing_idx',
+            ),
         ]
 
+    # Fields deciding which Category/Location.ads_count the ad is counted in
+    COUNTED_FIELDS = ('is_active', 'category_id', 'location_id')
+
     def __str__(self):
         return self.title
 
+    def counted_state(self, stored=None):
+        """
+        (is_active, category_id, location_id), or None if not loaded.
+
+        Deferred fields are not saved, so they are taken from ``stored``
+        (the state in the database) when it is given.
+        """
+        try:
+            return tuple(
+                self.__dict__[field] if field in self.__dict__ or stored is None else stored[position]
+                for position, field in enumerate(self.COUNTED_FIELDS)
+            )
+        except KeyError:
+            return None
+
     def save(self, *args, **kwargs):
-        if not self.slug:
-            base_slug = slugify(self.title)
-            slug = base_slug
-            counter = 1
-            while Ad.objects.filter(slug=slug).exists():
-                slug = f'{base_slug}-{counter}'
-                counter += 1
-            self.slug = slug
-        super().save(*args, **kwargs)
+        max_length = self._meta.get_field('slug').max_length
+        allocated = not self.slug
+        if allocated:
+            self.slug = allocate_slug(Ad, self.title, max_length)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is None or {'title', 'description'}.intersection(update_fields):
+            self.search_key = normalize_search_text(f'{self.title} {self.description}')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'search_key'}
+        for attempt in range(SLUG_RETRIES + 1):
+            try:
+                # Counters are adjusted in post_save (ads.signals), inside this transaction
+                with transaction.atomic():
+                    super().save(*args, **kwargs)
+                return
+            except IntegrityError:
+                # A concurrent insert may have taken the allocated slug
+                if not allocated or attempt == SLUG_RETRIES or not Ad.objects.filter(slug=self.slug).exists():
+                    raise
+                if attempt == 0:
+                    self.slug = allocate_slug(Ad, self.title, max_length)
+                else:
+                    self.slug = random_slug(slug_base(self.title, max_length))
 
     def get_absolute_url(self):
         return reverse('ads:detail', kwargs={'slug': self.slug})
 
-    def increment_views(self):
-        """Increment views count"""
+    def increment_views(self, visitor=None):
+        """Increment views count (written in batches, see ads.view_counts)"""
+        from .view_counts import record_view
+        record_view(self.pk, visitor)
         self.views_count += 1
-        self.save(update_fields=['views_count'])
 
     def toggle_favorite(self, user):
         """Toggle favorite status for user"""
-        if user in self.favorited_by.all():
-            self.favorited_by.remove(user)
-            self.favorites_count = max(0, self.favorites_count - 1)
-            is_favorite = False
-        else:
-            self.favorited_by.add(user)
-            self.favorites_count += 1
-            is_favorite = True
-        
-        self.save(update_fields=['favorites_count'])
-        return is_favorite
+        # Only the request that actually deletes/creates the row moves the
+        # counter, so concurrent toggles cannot double count
+        favorites = Ad.favorited_by.through.objects
+        row = {'ad_id': self.pk, favorite_user_field(): user.pk}
+        ads = Ad.objects.filter(pk=self.pk)
+        with transaction.atomic():
+            removed = favorites.filter(**row).delete()[0]
+            if removed:
+                ads.filter(favorites_count__gt=0).update(favorites_count=F('favorites_count') - 1)
+            else:
+                created = favorites.get_or_create(**row)[1]
+                if created:
+                    ads.update(favorites_count=F('favorites_count') + 1)
+        self.refresh_from_db(fields=['favorites_count'])
+        return not removed
+
+    @staticmethod
+    def favorite_ids(user, ads):
+        """Ids of ``ads`` (e.g. a listing page) that ``user`` has favorited, in one query"""
+        if not user.is_authenticated:
+            return set()
+        ad_ids = [ad.pk for ad in ads]
+        if not ad_ids:
+            return set()
+        return set(
+            Ad.favorited_by.through.objects
+            .filter(ad_id__in=ad_ids, **{favorite_user_field(): user.pk})
+            .values_list('ad_id', flat=True)
+        )
 
     @property
     def main_image(self):
-        """Get main image"""
-        return self.images.filter(is_main=True).first() or self.images.first()
+        """Get main image (prefetched by AdQuerySet.with_main_image when listing)"""
+        if not hasattr(self, '_main_images'):
+            self._main_images = list(self.images.order_by(*AdImage.MAIN_IMAGE_ORDERING)[:1])
+        return self._main_images[0] if self._main_images else None
 
     @property
     def is_owner(self):
@@ -174,14 +273,57 @@ class Ad(models.Model):
         return getattr(self, '_is_owner', False)
 
 
+class AdViewSketch(models.Model):
+    """Unique viewers of an ad on one day, as a HyperLogLog sketch"""
+
+    ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='view_sketches', verbose_name=_('E\'lon'))
+    date = models.DateField(_('Sana'))
+    sketch = models.BinaryField(_('Sketch'))
+
+    class Meta:
+        verbose_name = _('Ko\'rishlar sketchi')
+        verbose_name_plural = _('Ko\'rishlar sketchlari')
+        unique_together = ['ad', 'date']
+
+    def __str__(self):
+        return f'{self.ad_id} - {self.date}'
+
+
+class AdViewTotal(models.Model):
+    """Unique viewers of an ad over all days: the union of its daily sketches"""
+
+    ad = models.OneToOneField(Ad, on_delete=models.CASCADE, primary_key=True, related_name='view_total', verbose_name=_('E\'lon'))
+    sketch = models.BinaryField(_('Sketch'))
+
+    class Meta:
+        verbose_name = _('Jami ko\'rishlar sketchi')
+        verbose_name_plural = _('Jami ko\'rishlar sketchlari')
+
+    def __str__(self):
+        return str(self.ad_id)
+
+
 class AdImage(models.Model):
     """Ad images"""
     
     ad = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name='images', verbose_name=_('E\'lon'))
-    image = models.ImageField(_('Rasm'), upload_to='ads/%Y/%m/%d/')
+    # Stored once per distinct content (see ads.storage)
+    image = models.ImageField(_('Rasm'), upload_to='ads/%Y/%m/%d/', storage=get_image_storage)
     is_main = models.BooleanField(_('Asosiy rasm'), default=False)
     order = models.PositiveIntegerField(_('Tartib'), default=0)
     created_at = models.DateTimeField(_('Yaratilgan sana'), auto_now_add=True)
+    # Set once the renditions have been written (see ads.images)
+    processed_at = models.DateTimeField(_('Qayta ishlangan sana'), null=True, blank=True, editable=False)
+    width = models.PositiveIntegerField(_('Kenglik'), null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(_('Balandlik'), null=True, blank=True, editable=False)
+    # Tiny base64 preview shown until the real image has loaded
+    placeholder = models.TextField(_('Placeholder'), blank=True, editable=False)
+    # sha256 of the file and perceptual hash (see ads.duplicates)
+    content_hash = models.CharField(_('Fayl xeshi'), max_length=64, blank=True, db_index=True, editable=False)
+    phash = models.BigIntegerField(_('Perseptual xesh'), null=True, blank=True, editable=False)
+
+    # Main image first, then the default image order
+    MAIN_IMAGE_ORDERING = ('-is_main', 'order', 'created_at')
 
     class Meta:
         verbose_name = _('E\'lon rasmi')
@@ -192,22 +334,68 @@ class AdImage(models.Model):
         return f'{self.ad.title} - {self.order}'
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        
-        # Resize image
-        if self.image:
-            img = Image.open(self.image.path)
-            if img.height > 800 or img.width > 800:
-                output_size = (800, 800)
-                img.thumbnail(output_size)
-                img.save(self.image.path)
-
-    def delete(self, *args, **kwargs):
-        # Delete image file when model is deleted
-        if self.image:
-            if os.path.isfile(self.image.path):
-                os.remove(self.image.path)
-        super().delete(*args, **kwargs)
+        # New uploads are stored as is; renditions are made in the background
+        is_new_file = bool(self.image) and (self._state.adding or not self.image._committed)
+        previous = None
+        if is_new_file:
+            self.processed_at = None
+            if not self._state.adding:
+                previous = AdImage.objects.filter(pk=self.pk).values_list('image', flat=True).first()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if is_new_file and previous != self.image.name:
+                retain(self.image.name, self.image.size)
+                release(previous)
+        if is_new_file:
+            enqueue(self.pk)
+
+    @property
+    def renditions(self):
+        """{'thumb'|'card'|'full': Rendition} with .webp and .jpeg urls"""
+        return renditions_for(self)
+
+    @property
+    def thumbnails(self):
+        """{'WxH': Rendition} of on-demand thumbnail urls (see ads.thumbnails)"""
+        return thumbnails_for(self)
+
+    @property
+    def near_duplicates(self):
+        """[(AdImage, distance)] of similar images in other ads"""
+        return near_duplicates(self)
+
+
+class ImageBlob(models.Model):
+    """A stored image file and the number of AdImage rows using it"""
+
+    name = models.CharField(_('Fayl'), max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(_('Hajmi'), default=0)
+    refcount = models.PositiveIntegerField(_('Havolalar soni'), default=0)
+    created_at = models.DateTimeField(_('Yaratilgan sana'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Rasm fayli')
+        verbose_name_plural = _('Rasm fayllari')
+
+    def __str__(self):
+        return self.name
+
+
+class AdImageHashBand(models.Model):
+    """One band of an AdImage's perceptual hash, for near-duplicate lookup"""
+
+    image = models.ForeignKey(AdImage, on_delete=models.CASCADE, related_name='hash_bands', verbose_name=_('Rasm'))
+    band = models.PositiveSmallIntegerField(_('Bo\'lak'))
+    value = models.PositiveIntegerField(_('Qiymat'))
+
+    class Meta:
+        verbose_name = _('Rasm xeshi bo\'lagi')
+        verbose_name_plural = _('Rasm xeshi bo\'laklari')
+        unique_together = ['image', 'band']
+        indexes = [models.Index(fields=['band', 'value'])]
+
+    def __str__(self):
+        return f'{self.image_id} - {self.band}:{self.value}'
 
 
 class AdReport(models.Model):
@@ -0,0 +1,53 @@
+"""
+Search text normalization.
+
+Folds Uzbek Latin, Uzbek Cyrillic and Russian spellings of the same word
+into one lowercase Latin form, so "телефон", "Telefon" and "TELEFON" or
+"o'yinchoq" and "ўйинчоқ" produce the same search key.
+"""
+import re
+import unicodedata
+
+# Apostrophe look-alikes used in o', g' and the tutuq belgisi
+APOSTROPHES = "'`ʻʼ‘’´ʹ"
+
+CYRILLIC_TO_LATIN = {
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ё': 'yo',
+    'ж': 'j', 'з': 'z', 'и': 'i', 'й': 'y', 'к': 'k', 'л': 'l', 'м': 'm',
+    'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'x', 'ц': 's', 'ч': 'ch', 'ш': 'sh', 'щ': 'sh', 'ъ': '',
+    'ы': 'i', 'ь': '', 'э': 'e', 'ю': 'yu', 'я': 'ya',
+    # Uzbek specific letters
+    'ў': 'o', 'қ': 'q', 'ғ': 'g', 'ҳ': 'h',
+}
+
+# Spelling variants folded after transliteration, applied to every word
+PHONETIC_FOLDS = [
+    (re.compile(r'ph'), 'f'),
+    (re.compile(r'kh'), 'x'),
+    (re.compile(r'w'), 'v'),
+    (re.compile(r'^ay(?=[^aeiou])'), 'i'),  # айфон, айпад -> ifon, ipad
+    (re.compile(r'(?<=[^aeiou])e$'), ''),   # iphone -> ifon
+]
+
+TRANSLATION_TABLE = str.maketrans(
+    {**CYRILLIC_TO_LATIN, **{char: '' for char in APOSTROPHES}}
+)
+
+WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize_word(word):
+    """Normalize a single lowercase word"""
+    for pattern, replacement in PHONETIC_FOLDS:
+        word = pattern.sub(replacement, word)
+    return word
+
+
+def normalize_search_text(text):
+    """Return the canonical search form of ``text`` (space separated words)"""
+    if not text:
+        return ''
+    text = unicodedata.normalize('NFKC', text).lower().translate(TRANSLATION_TABLE)
+    words = (normalize_word(word) for word in WORD_RE.findall(text))
+    return ' '.join(word for word in words if word)
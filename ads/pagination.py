@@ -0,0 +1,174 @@
+"""
+Keyset (cursor) pagination for ad listings.
+
+Listings are ordered by ``LISTING_ORDERING``. The first few pages are
+served by Django's numbered ``Paginator``; from there on, and whenever a
+``cursor`` is given, pages are fetched with a ``WHERE (...) < (...)``
+condition on the ordering columns, so page 5000 costs the same as page 2
+and no ``COUNT(*)`` or ``OFFSET`` is needed.
+
+Both kinds of page expose ``next_query`` / ``previous_query`` (the query
+string for the neighbouring page, other filters preserved), so templates
+link with ``?{{ ads.next_query }}`` whichever mode served the page.
+"""
+import base64
+import json
+
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+LISTING_ORDERING = ('-is_featured', '-is_vip', '-created_at', '-id')
+KEYSET_FIELDS = ('is_featured', 'is_vip', 'created_at', 'id')
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(obj, backwards=False):
+    values = [getattr(obj, field) for field in KEYSET_FIELDS]
+    values[2] = values[2].isoformat()
+    payload = json.dumps(values + ['p' if backwards else 'n'], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        is_featured, is_vip, created_at, pk, direction = json.loads(base64.urlsafe_b64decode(padded))
+        values = (bool(is_featured), bool(is_vip), parse_datetime(created_at), int(pk))
+    except (TypeError, ValueError):
+        raise InvalidCursor(token)
+    if values[2] is None or direction not in ('n', 'p'):
+        raise InvalidCursor(token)
+    return values, direction == 'p'
+
+
+def keyset_filter(values, backwards=False):
+    """Rows strictly after ``values`` in listing order (before, if ``backwards``)"""
+    lookup = 'gt' if backwards else 'lt'
+    condition = Q()
+    for position, field in enumerate(KEYSET_FIELDS):
+        equal = {name: value for name, value in zip(KEYSET_FIELDS[:position], values)}
+        condition |= Q(**equal, **{f'{field}__{lookup}': values[position]})
+    return condition
+
+
+class CursorPage:
+    """A page fetched by keyset; quacks like Django's Page for templates"""
+
+    number = None
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+        self.next_query = ''
+        self.previous_query = ''
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Fetch listing pages relative to a cursor, ``per_page + 1`` rows at a time"""
+
+    def __init__(self, queryset, per_page):
+        self.queryset = queryset
+        self.per_page = per_page
+
+    def page(self, cursor):
+        values, backwards = decode_cursor(cursor)
+        queryset = self.queryset.filter(keyset_filter(values, backwards))
+        if backwards:
+            queryset = queryset.reverse()
+
+        rows = list(queryset[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return CursorPage(rows)
+
+        has_next = True if backwards else has_more
+        has_previous = has_more if backwards else True
+        return CursorPage(
+            rows,
+            next_cursor=encode_cursor(rows[-1]) if has_next else None,
+            previous_cursor=encode_cursor(rows[0], backwards=True) if has_previous else None,
+        )
+
+
+def page_query(request, **params):
+    query = request.GET.copy()
+    query.pop('page', None)
+    query.pop('cursor', None)
+    for key, value in params.items():
+        query[key] = value
+    return query.urlencode()
+
+
+def paginate_listing(request, queryset, per_page=None, count=None):
+    """
+    Paginate an ad listing by cursor when possible, by page number otherwise.
+
+    Numbered pages are limited to ``LISTING_NUMBERED_PAGES``; the link after
+    the last numbered page switches to a cursor. Querysets not ordered by
+    ``LISTING_ORDERING`` (e.g. relevance-ranked search) stay numbered.
+    A precomputed ``count`` (see ``ads.counts``) spares the paginator's COUNT.
+    """
+    per_page = per_page or settings.PAGINATE_BY
+    keyset = tuple(queryset.query.order_by) == LISTING_ORDERING
+    cursor = request.GET.get('cursor')
+
+    if keyset and cursor:
+        try:
+            page = CursorPaginator(queryset, per_page).page(cursor)
+        except InvalidCursor:
+            page = None
+        if page is not None:
+            if page.has_next():
+                page.next_query = page_query(request, cursor=page.next_cursor)
+            if page.has_previous():
+                page.previous_query = page_query(request, cursor=page.previous_cursor)
+            return page
+
+    paginator = Paginator(queryset, per_page)
+    if count is not None:
+        paginator.count = count
+    number = request.GET.get('page')
+    max_pages = getattr(settings, 'LISTING_NUMBERED_PAGES', 5)
+    if keyset:
+        try:
+            number = min(int(number), max_pages)
+        except (TypeError, ValueError):
+            number = 1
+    page = paginator.get_page(number)
+
+    page.next_query = page.previous_query = ''
+    if page.has_next():
+        if keyset and page.number >= max_pages:
+            page.next_query = page_query(request, cursor=encode_cursor(page[len(page) - 1]))
+        else:
+            page.next_query = page_query(request, page=page.next_page_number())
+    if page.has_previous():
+        page.previous_query = page_query(request, page=page.previous_page_number())
+    return page
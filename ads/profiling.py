@@ -0,0 +1,150 @@
+"""
+Sampled request profiling.
+
+``ProfilingMiddleware`` profiles a ``PROFILING_SAMPLE_RATE`` fraction of
+requests: DB time and query count (``execute_wrapper`` on every
+connection), template rendering, image URL generation (functions marked
+with ``@timed('images')``), the view and the whole request. Results go to
+a ``Server-Timing`` header, so they show up in the browser's network
+panel, and to one JSON log line on the ``ads.profiling`` logger.
+
+With a sample rate of 0 the middleware removes itself at startup
+(``MiddlewareNotUsed``) and ``@timed`` functions pay one context variable
+lookup per call.
+"""
+import contextvars
+import functools
+import json
+import logging
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+
+logger = logging.getLogger(__name__)
+
+# Server-Timing metric names and descriptions, in header order
+METRICS = {
+    'db': 'Database',
+    'template': 'Templates',
+    'images': 'Image URLs',
+    'view': 'View',
+    'total': 'Total',
+}
+
+_current = contextvars.ContextVar('ads_profile', default=None)
+_template_patched = False
+
+
+class Profile:
+    """Timings (in seconds) collected for one request"""
+
+    def __init__(self):
+        self.timings = dict.fromkeys(METRICS, 0.0)
+        self.queries = 0
+        self.depth = {}
+
+    def add(self, name, seconds):
+        self.timings[name] += seconds
+
+    def enter(self, name):
+        """True for the outermost of nested timed calls, which is the one counted"""
+        self.depth[name] = self.depth.get(name, 0) + 1
+        return self.depth[name] == 1
+
+    def leave(self, name):
+        self.depth[name] -= 1
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.timings['db'] += time.perf_counter() - started
+            self.queries += 1
+
+    def server_timing(self):
+        entries = []
+        for name, description in METRICS.items():
+            if name == 'db':
+                description = f'{description} ({self.queries} queries)'
+            entries.append(f'{name};dur={self.timings[name] * 1000:.1f};desc="{description}"')
+        return ', '.join(entries)
+
+
+def timed(name):
+    """Count the time spent in the decorated function under ``name`` when profiling"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            profile = _current.get()
+            if profile is None:
+                return function(*args, **kwargs)
+            outermost = profile.enter(name)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                if outermost:
+                    profile.add(name, time.perf_counter() - started)
+                profile.leave(name)
+        return wrapper
+    return decorator
+
+
+def patch_templates():
+    """Time Template._render (nested templates count once, under the outermost)"""
+    global _template_patched
+    if _template_patched:
+        return
+    Template._render = timed('template')(Template._render)
+    _template_patched = True
+
+
+class ProfilingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0)
+        if self.sample_rate <= 0:
+            raise MiddlewareNotUsed
+        patch_templates()
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        profile = Profile()
+        token = _current.set(profile)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(profile))
+                request._profile_view_started = None
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        finished = time.perf_counter()
+        profile.add('total', finished - started)
+        if request._profile_view_started is not None:
+            profile.add('view', finished - request._profile_view_started)
+
+        response['Server-Timing'] = profile.server_timing()
+        match = getattr(request, 'resolver_match', None)
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'route': match.view_name if match else None,
+            'status': response.status_code,
+            'queries': profile.queries,
+            **{f'{name}_ms': round(seconds * 1000, 2) for name, seconds in profile.timings.items()},
+        }))
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if _current.get() is not None:
+            request._profile_view_started = time.perf_counter()
@@ -0,0 +1,121 @@
+"""
+Per-view SQL query budgets.
+
+``@query_budget(6)`` declares how many queries a view may run, template
+rendering included. Budgets are only checked in DEBUG and in strict mode
+(``QUERY_BUDGET_STRICT``, which ``ads.test_runner.TestRunner`` turns on),
+so production requests pay one settings lookup. In DEBUG an
+exceeded budget logs a warning with the stack of every query; in strict
+mode it raises ``QueryBudgetExceeded`` and the test fails. The same SQL
+run ``REPEATED_QUERY_THRESHOLD`` or more times in one request is logged
+as a suspected N+1 either way.
+"""
+import functools
+import logging
+import sys
+import traceback
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+REPEATED_QUERY_THRESHOLD = 3
+STACK_DEPTH = 8
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def is_strict():
+    return getattr(settings, 'QUERY_BUDGET_STRICT', False)
+
+
+def template_frame(frame):
+    """The template line a Django template node is rendering, if ``frame`` is one"""
+    node = frame.f_locals.get('self') if frame.f_code.co_name == 'render_annotated' else None
+    token = getattr(node, 'token', None)
+    origin = getattr(node, 'origin', None)
+    if token is None or origin is None:
+        return None
+    return traceback.FrameSummary(origin.template_name or origin.name, token.lineno, 'template', line=token.contents)
+
+
+def project_stack():
+    """Project code and template lines leading to the current query, innermost last"""
+    root = str(settings.BASE_DIR)
+    frames = []
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root) and 'site-packages' not in filename and filename != __file__:
+            frames.append(traceback.FrameSummary(filename, frame.f_lineno, frame.f_code.co_name))
+        else:
+            summary = template_frame(frame)
+            if summary is not None and (not frames or frames[-1].filename != summary.filename
+                                        or frames[-1].lineno != summary.lineno):
+                frames.append(summary)
+        frame = frame.f_back
+    return frames[STACK_DEPTH - 1::-1]
+
+
+class QueryRecorder:
+    """``connection.execute_wrapper`` that keeps each query's SQL and call stack"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, project_stack()))
+        return execute(sql, params, many, context)
+
+    def repeated(self):
+        totals = Counter(sql for sql, _ in self.queries)
+        return [(sql, total) for sql, total in totals.items() if total >= REPEATED_QUERY_THRESHOLD]
+
+    def describe(self):
+        """Each distinct query with its count and the stack of its first run"""
+        totals = Counter(sql for sql, _ in self.queries)
+        lines, seen = [], set()
+        for sql, stack in self.queries:
+            if sql in seen:
+                continue
+            seen.add(sql)
+            lines.append(f'{totals[sql]}x {sql}')
+            lines.extend(line.rstrip() for line in traceback.format_list(stack))
+        return '\n'.join(lines)
+
+
+def check_budget(name, limit, recorder, strict):
+    for sql, total in recorder.repeated():
+        logger.warning('Suspected N+1 in %s: the same query ran %d times: %s', name, total, sql)
+    if len(recorder.queries) <= limit:
+        return
+    message = f'{name} ran {len(recorder.queries)} queries, its budget is {limit}'
+    if strict:
+        raise QueryBudgetExceeded(f'{message}\n{recorder.describe()}')
+    logger.warning('%s\n%s', message, recorder.describe())
+
+
+def query_budget(limit):
+    """Declare that a view runs at most ``limit`` SQL queries"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(request, *args, **kwargs):
+            strict = is_strict()
+            if not (settings.DEBUG or strict):
+                return view(request, *args, **kwargs)
+            recorder = QueryRecorder()
+            with connection.execute_wrapper(recorder):
+                response = view(request, *args, **kwargs)
+                # TemplateResponse renders later; count its queries here
+                if hasattr(response, 'render') and not response.is_rendered:
+                    response.render()
+            check_budget(view.__qualname__, limit, recorder, strict)
+            return response
+
+        wrapper.query_budget = limit
+        return wrapper
+    return decorator
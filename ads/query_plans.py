@@ -0,0 +1,123 @@
+"""
+Query plan checks for listing requests.
+
+``capture`` records the SELECT statements one request runs;
+``plan_problems`` explains a statement and reports what is wrong with its
+plan: a full scan of a large table, or a sort over one that the database
+does itself (SQLite's temp B-tree, a PostgreSQL ``Sort`` node) instead of
+reading an index in order. Small tables (categories, locations) are read
+in full by any sensible plan, so only tables of at least ``min_rows`` rows
+count. Partial sorts, where an index already supplies the leading ORDER BY
+columns, are not reported, and neither are sorts of a subquery's result
+(a sliced prefetch sorts its page of rows again): a sort only counts
+against a large table read at its own level of the plan.
+"""
+import json
+import re
+
+from django.apps import apps
+from django.db import connection
+
+from .slow_queries import unwrapped
+
+SQLITE_TABLE_RE = re.compile(r'^(SCAN|SEARCH) (\w+)')
+
+
+class StatementRecorder:
+    """``execute_wrapper`` keeping the (sql, params) of every SELECT"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(('SELECT', 'WITH')):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def capture(client, url):
+    """(status code, [(sql, params), ...]) of one GET request; the caller checks the status"""
+    recorder = StatementRecorder()
+    with connection.execute_wrapper(recorder):
+        response = client.get(url)
+    return response.status_code, recorder.statements
+
+
+def analyze():
+    """Refresh planner statistics so plans match a real, populated database"""
+    with unwrapped(connection), connection.cursor() as cursor:
+        cursor.execute('ANALYZE')
+
+
+def large_tables(min_rows):
+    tables = {model._meta.db_table for model in apps.get_models(include_auto_created=True)}
+    existing = set(connection.introspection.table_names())
+    large = set()
+    with unwrapped(connection), connection.cursor() as cursor:
+        for table in sorted(tables & existing):
+            cursor.execute(f'SELECT COUNT(*) FROM {connection.ops.quote_name(table)}')
+            if cursor.fetchone()[0] >= min_rows:
+                large.add(table)
+    return large
+
+
+def explain(sql, params):
+    """The raw plan: SQLite (id, parent, detail) rows, or PostgreSQL's JSON plan tree"""
+    with unwrapped(connection), connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [(row[0], row[1], row[3]) for row in cursor.fetchall()]
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+        plan = cursor.fetchone()[0]
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+
+def plan_nodes(node, subqueries=True):
+    """``node`` and its descendants; without ``subqueries``, not those below a Subquery Scan"""
+    yield node
+    for child in node.get('Plans', ()):
+        if subqueries or child['Node Type'] != 'Subquery Scan':
+            yield from plan_nodes(child, subqueries)
+
+
+def format_plan(plan):
+    if connection.vendor == 'sqlite':
+        depths, lines = {}, []
+        for node_id, parent, detail in plan:
+            depths[node_id] = depths.get(parent, -1) + 1
+            lines.append('  ' * depths[node_id] + detail)
+        return '\n'.join(lines)
+    lines = []
+    for node in plan_nodes(plan[0]['Plan']):
+        target = node.get('Relation Name') or node.get('Index Name') or ''
+        lines.append(f'{node["Node Type"]} {target}'.rstrip())
+    return '\n'.join(lines)
+
+
+def plan_problems(plan, large):
+    """['full scan of ads_ad', 'sort over ads_ad: USE TEMP B-TREE FOR ORDER BY', ...] for one plan"""
+    problems = []
+    if connection.vendor == 'sqlite':
+        # {parent id: large tables read at that level}
+        read = {}
+        for node_id, parent, detail in plan:
+            match = SQLITE_TABLE_RE.match(detail)
+            if match and match.group(2) in large:
+                read.setdefault(parent, []).append(match.group(2))
+                if match.group(1) == 'SCAN' and 'USING' not in detail and 'VIRTUAL TABLE' not in detail:
+                    problems.append(f'full scan of {match.group(2)}')
+            elif detail.startswith('USE TEMP B-TREE') and 'RIGHT PART' not in detail and parent in read:
+                problems.append(f'sort over {read[parent][0]}: {detail}')
+        return problems
+
+    for node in plan_nodes(plan[0]['Plan']):
+        if node['Node Type'] == 'Seq Scan' and node.get('Relation Name') in large:
+            problems.append(f'full scan of {node["Relation Name"]}')
+        elif node['Node Type'] == 'Sort':
+            read = [
+                child['Relation Name'] for child in plan_nodes(node, subqueries=False)
+                if child.get('Relation Name') in large
+            ]
+            if read:
+                problems.append(f'sort over {read[0]}: {", ".join(node.get("Sort Key", []))}')
+    return problems
@@ -0,0 +1,100 @@
+"""
+Placeholder images for sample and load-test data.
+
+``render_placeholder`` is meant to run in worker processes. It draws one
+image at its final size and does everything ``ads.images.process_image``
+would do with it (renditions, placeholder, hashes), returning only bytes
+and numbers. The parent process then just writes the files with
+``store_rendered`` and inserts ``AdImage`` rows that are already
+processed, so no image is opened twice. Placeholders all look alike, so they
+get no perceptual hash and never show up as near-duplicates.
+"""
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageDraw, ImageFont
+
+from .images import FORMATS, RENDITIONS, make_placeholder, rendition_path
+from .storage import image_storage
+
+COLORS = [
+    (52, 152, 219),   # Blue
+    (155, 89, 182),   # Purple
+    (46, 204, 113),   # Green
+    (241, 196, 15),   # Yellow
+    (230, 126, 34),   # Orange
+    (231, 76, 60),    # Red
+    (149, 165, 166),  # Gray
+    (26, 188, 156),   # Turquoise
+]
+IMAGE_SIZE = (800, 600)
+
+
+def load_font(size=40):
+    try:
+        return ImageFont.truetype('arial.ttf', size)
+    except OSError:
+        pass
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def draw_placeholder(text, color, size=IMAGE_SIZE):
+    """A plain coloured image with ``text`` centred on it"""
+    picture = Image.new('RGB', size, color)
+    draw = ImageDraw.Draw(picture)
+    font = load_font()
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    position = ((size[0] - (right - left)) / 2, (size[1] - (bottom - top)) / 2)
+    draw.text(position, text, font=font, fill=(255, 255, 255))
+    return picture
+
+
+def render_placeholder(task):
+    """Render ``(text, color)`` and all its derived data (runs in a worker process)"""
+    text, color = task
+    picture = draw_placeholder(text, color)
+    buffer = BytesIO()
+    picture.save(buffer, format='JPEG', quality=85)
+    original = buffer.getvalue()
+
+    renditions = {}
+    for size, box in RENDITIONS.items():
+        resized = picture.copy()
+        resized.thumbnail(box, Image.LANCZOS)
+        for extension, options in FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, **options)
+            renditions[size, extension] = buffer.getvalue()
+
+    return {
+        'original': original,
+        'renditions': renditions,
+        'width': picture.width,
+        'height': picture.height,
+        'placeholder': make_placeholder(picture),
+        'content_hash': hashlib.sha256(original).hexdigest(),
+    }
+
+
+def store_rendered(rendered, name='placeholder.jpg'):
+    """Write a rendered placeholder's files; returns the AdImage field values"""
+    stored = image_storage.save(name, ContentFile(rendered['original']))
+    for (size, extension), data in rendered['renditions'].items():
+        path = rendition_path(stored, size, extension)
+        if not default_storage.exists(path):
+            default_storage.save(path, ContentFile(data))
+    return {
+        'image': stored,
+        'width': rendered['width'],
+        'height': rendered['height'],
+        'placeholder': rendered['placeholder'],
+        'content_hash': rendered['content_hash'],
+        'processed_at': timezone.now(),
+    }
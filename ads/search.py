@@ -0,0 +1,193 @@
+"""
+Full-text search for ads.
+
+SQLite uses an FTS5 virtual table, PostgreSQL a tsvector table with a GIN
+index. Both live next to ``ads_ad`` and are keyed by the ad id, so the
+listing querysets only need an ``id IN (...)`` filter plus a rank annotation.
+Other databases fall back to a ``contains`` scan over ``Ad.search_key``.
+
+Everything that goes into the index, and every query, is passed through
+``normalize_search_text`` first, so Latin and Cyrillic spellings match.
+"""
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.expressions import RawSQL
+
+from .normalization import normalize_search_text
+from .pagination import LISTING_ORDERING
+
+FTS_TABLE = 'ads_ad_fts'
+TSVECTOR_TABLE = 'ads_ad_search'
+
+# Fields that feed the index; saves that touch none of them skip reindexing
+INDEXED_FIELDS = frozenset({'title', 'description', 'search_key'})
+
+REBUILD_BATCH_SIZE = 2000
+
+
+def tokenize(query):
+    """Split a user query into normalized word tokens"""
+    return normalize_search_text(query).split()
+
+
+class SQLiteBackend:
+    """FTS5 index with bm25 ranking (title weighted over the full key)"""
+
+    def match_expression(self, tokens):
+        return ' '.join('"%s"*' % token for token in tokens)
+
+    def filter_sql(self):
+        return f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s'
+
+    def rank_sql(self, id_column):
+        return (
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s AND rowid = {id_column}'
+        )
+
+    def index(self, cursor, rows, replace=True):
+        if replace:
+            cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(row[0],) for row in rows])
+        cursor.executemany(
+            f'INSERT INTO {FTS_TABLE} (rowid, title, search_key) VALUES (%s, %s, %s)',
+            rows,
+        )
+
+    def remove(self, cursor, ad_id):
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [ad_id])
+
+    def clear(self, cursor):
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+    def optimize(self, cursor):
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+
+
+class PostgreSQLBackend:
+    """tsvector side table with a GIN index and ts_rank ranking"""
+
+    document_sql = (
+        "setweight(to_tsvector('simple', %s), 'A') || "
+        "setweight(to_tsvector('simple', %s), 'B')"
+    )
+
+    def match_expression(self, tokens):
+        return ' & '.join('%s:*' % token for token in tokens)
+
+    def filter_sql(self):
+        return (
+            f"SELECT ad_id FROM {TSVECTOR_TABLE} "
+            f"WHERE document @@ to_tsquery('simple', %s)"
+        )
+
+    def rank_sql(self, id_column):
+        return (
+            f"SELECT ts_rank(document, to_tsquery('simple', %s)) FROM {TSVECTOR_TABLE} "
+            f"WHERE ad_id = {id_column}"
+        )
+
+    def index(self, cursor, rows, replace=True):
+        cursor.executemany(
+            f'INSERT INTO {TSVECTOR_TABLE} (ad_id, document) VALUES (%s, {self.document_sql}) '
+            f'ON CONFLICT (ad_id) DO UPDATE SET document = EXCLUDED.document',
+            rows,
+        )
+
+    def remove(self, cursor, ad_id):
+        cursor.execute(f'DELETE FROM {TSVECTOR_TABLE} WHERE ad_id = %s', [ad_id])
+
+    def clear(self, cursor):
+        cursor.execute(f'TRUNCATE {TSVECTOR_TABLE}')
+
+    def optimize(self, cursor):
+        cursor.execute(f'ANALYZE {TSVECTOR_TABLE}')
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend(),
+    'postgresql': PostgreSQLBackend(),
+}
+
+
+def get_backend():
+    """Return the search backend for the default connection, or None"""
+    return BACKENDS.get(connection.vendor)
+
+
+def index_row(ad_id, title, search_key):
+    """Build one index row; the title is normalized here, the key already is"""
+    return (ad_id, normalize_search_text(title), search_key)
+
+
+def search_ads(queryset, query):
+    """Filter an Ad queryset by a search query and annotate ``search_rank``"""
+    tokens = tokenize(query)
+    if not tokens:
+        # Punctuation only: nothing can match, as with the old icontains filter
+        return queryset.none()
+
+    backend = get_backend()
+    if backend is None:
+        for token in tokens:
+            queryset = queryset.filter(search_key__contains=token)
+        return queryset
+
+    match = backend.match_expression(tokens)
+    id_column = '%s.%s' % (
+        connection.ops.quote_name(queryset.model._meta.db_table),
+        connection.ops.quote_name('id'),
+    )
+    return queryset.filter(
+        id__in=RawSQL(backend.filter_sql(), [match])
+    ).annotate(
+        search_rank=RawSQL(backend.rank_sql(id_column), [match], output_field=FloatField())
+    )
+
+
+def order_listing(queryset):
+    """Featured/VIP first, then relevance when searching, then newest"""
+    ordering = list(LISTING_ORDERING)
+    if 'search_rank' in queryset.query.annotations:
+        ordering.insert(2, '-search_rank')
+    return queryset.order_by(*ordering)
+
+
+def index_ad(ad):
+    """Write one ad into the search index"""
+    backend = get_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.index(cursor, [index_row(ad.pk, ad.title, ad.search_key)])
+
+
+def remove_ad(ad_id):
+    """Drop one ad from the search index"""
+    backend = get_backend()
+    if backend is not None:
+        with connection.cursor() as cursor:
+            backend.remove(cursor, ad_id)
+
+
+def rebuild_index(batch_size=REBUILD_BATCH_SIZE):
+    """Rebuild the whole search index from ``Ad.search_key`` in batches"""
+    from .models import Ad
+
+    backend = get_backend()
+    if backend is None:
+        return False
+
+    rows = Ad.objects.order_by().values_list('id', 'title', 'search_key')
+    # One transaction: readers never see a half-built index, and SQLite
+    # does not commit (and sync) after every row
+    with transaction.atomic(), connection.cursor() as cursor:
+        backend.clear(cursor)
+        batch = []
+        for ad_id, title, search_key in rows.iterator(chunk_size=batch_size):
+            batch.append(index_row(ad_id, title, search_key))
+            if len(batch) >= batch_size:
+                backend.index(cursor, batch, replace=False)
+                batch = []
+        if batch:
+            backend.index(cursor, batch, replace=False)
+        backend.optimize(cursor)
+    return True
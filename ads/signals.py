@@ -0,0 +1,157 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from . import counts, search, storage, suggestions
+from .models import Ad, AdImage, Category, Location
+
+
+@receiver(post_save, sender=Ad)
+def update_search_index(sender, instance, update_fields=None, **kwargs):
+    """Keep the full-text index in sync with the ad text"""
+    if update_fields is not None and not search.INDEXED_FIELDS.intersection(update_fields):
+        return
+    search.index_ad(instance)
+
+
+@receiver(post_delete, sender=Ad)
+def remove_from_search_index(sender, instance, **kwargs):
+    """Drop deleted ads from the full-text index"""
+    search.remove_ad(instance.pk)
+
+
+@receiver(post_save, sender=Ad)
+def update_suggestions(sender, instance, update_fields=None, **kwargs):
+    """Add new/renamed ads to the suggestion index, drop deactivated ones"""
+    if update_fields is not None and not {'title', 'is_active'}.intersection(update_fields):
+        return
+    transaction.on_commit(lambda: suggestions.update_ad(instance))
+
+
+@receiver(post_delete, sender=Ad)
+def remove_from_suggestions(sender, instance, **kwargs):
+    ad_id = instance.pk
+    transaction.on_commit(lambda: suggestions.remove_ad(ad_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def reload_suggestion_places(sender, **kwargs):
+    transaction.on_commit(suggestions.invalidate_places)
+
+
+# Fields that decide which listings (and so which cached counts) an ad is in;
+# Ad.COUNTED_FIELDS are the ones deciding Category/Location.ads_count
+LISTING_FIELDS = frozenset({
+    'is_active', 'category', 'category_id', 'location', 'location_id',
+    'price', 'title', 'description', 'search_key',
+})
+
+
+@receiver(post_save, sender=Ad)
+def invalidate_counts(sender, instance, update_fields=None, **kwargs):
+    """Expire cached listing counts for the ad's category and location"""
+    if update_fields is not None and not LISTING_FIELDS.intersection(update_fields):
+        return
+    # _counted_state is the stored state before this save (see
+    # remember_counted_state): counts of a category the ad left expire too
+    old_state = getattr(instance, '_counted_state', None) or (None, None, None)
+    counts.bump_versions(
+        categories=(old_state[1], instance.category_id),
+        locations=(old_state[2], instance.location_id),
+    )
+
+
+@receiver(post_delete, sender=Ad)
+def invalidate_counts_on_delete(sender, instance, **kwargs):
+    counts.bump_versions(categories=(instance.category_id,), locations=(instance.location_id,))
+
+
+def counter_targets(state):
+    """(category_id, location_id) an ad in ``state`` is counted under"""
+    if state is None or not state[0]:
+        return None, None
+    return state[1], state[2]
+
+
+def move_counter(model, old_id, new_id):
+    if old_id == new_id:
+        return
+    if old_id is not None:
+        model.objects.filter(pk=old_id, ads_count__gt=0).update(ads_count=F('ads_count') - 1)
+    if new_id is not None:
+        model.objects.filter(pk=new_id).update(ads_count=F('ads_count') + 1)
+
+
+def move_counters(old_state, new_state):
+    old_category, old_location = counter_targets(old_state)
+    new_category, new_location = counter_targets(new_state)
+    move_counter(Category, old_category, new_category)
+    move_counter(Location, old_location, new_location)
+
+
+def stored_counted_state(ad_id):
+    """
+    The state the row is counted under, read from the database and locked.
+
+    Called inside the save/delete transaction: a concurrent save or delete
+    of the same ad waits for this one to commit and then sees its result,
+    so two deactivations cannot both decrement (on SQLite the writers are
+    serialized anyway). None when the row is gone.
+    """
+    return Ad.objects.select_for_update().filter(pk=ad_id).values_list(*Ad.COUNTED_FIELDS).first()
+
+
+def saves_counted_fields(update_fields):
+    if update_fields is None:
+        return True
+    names = {name.removesuffix('_id') for name in update_fields}
+    return any(field.removesuffix('_id') in names for field in Ad.COUNTED_FIELDS)
+
+
+@receiver(pre_save, sender=Ad)
+def remember_counted_state(sender, instance, update_fields=None, **kwargs):
+    """Read the state the row is currently counted under (Ad.save is atomic)"""
+    if instance._state.adding or not saves_counted_fields(update_fields):
+        instance._counted_state = None
+    else:
+        instance._counted_state = stored_counted_state(instance.pk)
+
+
+@receiver(post_save, sender=Ad)
+def update_ads_counters(sender, instance, created, update_fields=None, **kwargs):
+    """Keep Category/Location.ads_count in step with active ads"""
+    old_state = instance._counted_state
+    if not created and old_state is None:
+        # Nothing counted was saved, or the row was gone
+        return
+    new_state = instance.counted_state(stored=old_state)
+    if update_fields is not None and new_state is not None:
+        # Fields left out of a partial save keep their stored values
+        names = {name.removesuffix('_id') for name in update_fields}
+        new_state = tuple(
+            value if field.removesuffix('_id') in names else old_state[position]
+            for position, (field, value) in enumerate(zip(Ad.COUNTED_FIELDS, new_state))
+        )
+    move_counters(old_state, new_state)
+
+
+@receiver(pre_delete, sender=Ad)
+def remember_counted_state_on_delete(sender, instance, **kwargs):
+    # Deletes run pre_delete inside their transaction
+    instance._counted_state = stored_counted_state(instance.pk)
+
+
+@receiver(post_delete, sender=Ad)
+def update_ads_counters_on_delete(sender, instance, **kwargs):
+    move_counters(instance._counted_state, None)
+
+
+@receiver(post_delete, sender=AdImage)
+def release_image_file(sender, instance, **kwargs):
+    """Drop the row's reference to its file (also for queryset and cascade deletes)"""
+    if instance.image:
+        storage.release(instance.image.name)
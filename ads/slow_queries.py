@@ -0,0 +1,223 @@
+"""
+Opt-in slow query sampler.
+
+With ``SLOW_QUERY_MS`` set, ``SlowQueryMiddleware`` times every SQL
+statement of a request, SELECTs including the time spent fetching their
+rows (SQLite does most of a query's work then), and at the end of the
+request writes those over the threshold to a rotating
+JSON-lines log (``SLOW_QUERY_LOG``): duration, a fingerprint of the
+statement with literals stripped, the view that ran it and the
+database's plan (``EXPLAIN QUERY PLAN`` on SQLite, ``EXPLAIN`` elsewhere).
+Each fingerprint is explained at most once per ``EXPLAIN_INTERVAL`` per
+process, so a hot slow query does not double its own cost.
+
+``manage.py slow_queries`` summarizes the log by fingerprint.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import ExitStack, contextmanager
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connections, transaction
+from django.utils import timezone
+
+EXPLAIN_INTERVAL = 3600
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUPS = 5
+
+logger = logging.getLogger(__name__)
+logger.propagate = False
+
+# (alias, fingerprint): when it was last explained, oldest first
+_explained = OrderedDict()
+_explained_lock = threading.Lock()
+_handler_lock = threading.Lock()
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+
+def log_path():
+    return str(getattr(settings, 'SLOW_QUERY_LOG', None) or os.path.join(settings.BASE_DIR, 'logs', 'slow_queries.log'))
+
+
+def ensure_handler():
+    """Attach the rotating file handler on first use (creating its directory)"""
+    if logger.handlers:
+        return
+    with _handler_lock:
+        if logger.handlers:
+            return
+        path = log_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        handler = RotatingFileHandler(path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+def normalize(sql):
+    """``sql`` with literals and parameters as ``?`` and IN lists collapsed"""
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql.replace('%s', '?'))
+    sql = LIST_RE.sub('(?+)', sql)
+    return ' '.join(sql.split())
+
+
+def fingerprint(normalized):
+    return hashlib.md5(normalized.encode()).hexdigest()[:12]
+
+
+@contextmanager
+def unwrapped(connection):
+    """Hide queries from every execute wrapper: budgets, metrics and this sampler itself"""
+    wrappers, connection.execute_wrappers = connection.execute_wrappers, []
+    try:
+        yield
+    finally:
+        connection.execute_wrappers = wrappers
+
+
+def is_select(sql):
+    return sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+
+def explain(connection, sql, params):
+    """The plan of ``sql`` as text, or None for statements that are not explained"""
+    if not is_select(sql):
+        return None
+    prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+    try:
+        # A savepoint keeps a failed EXPLAIN from breaking the caller's transaction
+        with unwrapped(connection), transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError as error:
+        return f'EXPLAIN failed: {error}'
+    return '\n'.join(' '.join(str(value) for value in row) for row in rows)
+
+
+def should_explain(key):
+    now = time.monotonic()
+    with _explained_lock:
+        # Entries past the interval would be explained again anyway
+        while _explained and now - next(iter(_explained.values())) >= EXPLAIN_INTERVAL:
+            _explained.popitem(last=False)
+        if key in _explained:
+            return False
+        _explained[key] = now
+    return True
+
+
+class TimedCursor:
+    """DB-API cursor adding the time spent fetching rows to its statement's duration"""
+
+    def __init__(self, cursor, statement):
+        self.cursor = cursor
+        self.statement = statement
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def timed(self, fetch, *args):
+        started = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            self.statement['duration_ms'] += (time.perf_counter() - started) * 1000
+
+    def fetchone(self):
+        return self.timed(self.cursor.fetchone)
+
+    def fetchmany(self, *args):
+        return self.timed(self.cursor.fetchmany, *args)
+
+    def fetchall(self):
+        return self.timed(self.cursor.fetchall)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+
+class SlowQueryRecorder:
+    """``execute_wrapper`` logging statements slower than ``threshold_ms``"""
+
+    def __init__(self, connection, threshold_ms, source):
+        self.connection = connection
+        self.threshold_ms = threshold_ms
+        self.source = source
+        self.selects = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration_ms = (time.perf_counter() - started) * 1000
+        if many or not is_select(sql):
+            if duration_ms >= self.threshold_ms:
+                self.record(sql, params, many, duration_ms)
+            return result
+        # Rows are fetched after execute() returns; finish() logs the total
+        statement = {'sql': sql, 'params': params, 'duration_ms': duration_ms}
+        self.selects.append(statement)
+        cursor = context['cursor']
+        if isinstance(cursor.cursor, TimedCursor):
+            cursor.cursor.statement = statement
+        else:
+            cursor.cursor = TimedCursor(cursor.cursor, statement)
+        return result
+
+    def finish(self):
+        """Log the SELECTs whose execute and fetches took ``threshold_ms`` together"""
+        selects, self.selects = self.selects, []
+        for statement in selects:
+            if statement['duration_ms'] >= self.threshold_ms:
+                self.record(statement['sql'], statement['params'], False, statement['duration_ms'])
+
+    def record(self, sql, params, many, duration_ms):
+        normalized = normalize(sql)
+        key = fingerprint(normalized)
+        plan = None
+        if not many and should_explain((self.connection.alias, key)):
+            plan = explain(self.connection, sql, params)
+        ensure_handler()
+        logger.info(json.dumps({
+            'time': timezone.now().isoformat(),
+            'duration_ms': round(duration_ms, 2),
+            'fingerprint': key,
+            'sql': normalized,
+            'view': self.source(),
+            'database': self.connection.alias,
+            'plan': plan,
+        }))
+
+
+class SlowQueryMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.threshold_ms = getattr(settings, 'SLOW_QUERY_MS', None)
+        if self.threshold_ms is None:
+            raise MiddlewareNotUsed
+
+    def __call__(self, request):
+        def source():
+            match = getattr(request, 'resolver_match', None)
+            return match.view_name if match else request.path
+
+        recorders = [SlowQueryRecorder(connection, self.threshold_ms, source) for connection in connections.all()]
+        try:
+            with ExitStack() as stack:
+                for recorder in recorders:
+                    stack.enter_context(recorder.connection.execute_wrapper(recorder))
+                return self.get_response(request)
+        finally:
+            for recorder in recorders:
+                recorder.finish()
@@ -0,0 +1,97 @@
+"""
+Unique slug allocation for ads.
+
+Slugs are ``<base>`` or ``<base>-<n>``. Instead of probing ``-1``, ``-2``,
+... one ``exists()`` at a time, the slugs already taken for a set of bases
+are read in one query and the next suffix is computed in Python. Inserts
+racing for the same suffix are retried by ``Ad.save`` (see
+``SLUG_RETRIES``); the last retries fall back to a random suffix.
+
+The lookup reads ``<base>-*`` as a range of the slug index (``-`` is
+followed by ``.`` in ASCII); numeric suffixes are picked out in Python.
+"""
+from django.db import connection
+from django.db.models import Q
+from django.utils.crypto import get_random_string
+from django.utils.text import slugify
+
+from .normalization import TRANSLATION_TABLE
+
+# Room left in the slug column for "-<suffix>"
+SUFFIX_LENGTH = 7
+RANDOM_SUFFIX_CHARS = 'abcdefghijklmnopqrstuvwxyz0123456789'
+SLUG_RETRIES = 3
+BATCH_SIZE = 500
+
+
+def slug_base(title, max_length=50):
+    """Slug of ``title`` without suffix; Cyrillic titles are transliterated"""
+    base = slugify(title.lower().translate(TRANSLATION_TABLE))
+    return base[:max_length - SUFFIX_LENGTH].strip('-') or 'elon'
+
+
+def random_slug(base):
+    return f'{base}-{get_random_string(SUFFIX_LENGTH - 1, RANDOM_SUFFIX_CHARS)}'
+
+
+def suffixed(base):
+    """Slugs starting with ``<base>-``, as a condition the slug index can serve"""
+    if connection.vendor == 'postgresql':
+        # Locale collations ignore punctuation, so a range would miss rows;
+        # Django indexes slugs with varchar_pattern_ops for LIKE 'prefix%'
+        return Q(slug__startswith=f'{base}-')
+    return Q(slug__gte=f'{base}-', slug__lt=f'{base}.')
+
+
+class SlugAllocator:
+    """Hands out free slugs for a batch of bases after one lookup query"""
+
+    def __init__(self, model, bases):
+        self.bare_taken = set()
+        self.last_suffix = {}
+        bases = set(bases)
+        if not bases:
+            return
+        condition = Q()
+        for base in bases:
+            condition |= Q(slug=base) | suffixed(base)
+        for slug in model.objects.filter(condition).order_by().values_list('slug', flat=True).iterator():
+            if slug in bases:
+                self.bare_taken.add(slug)
+            else:
+                base, suffix = slug.rsplit('-', 1)
+                if base in bases and suffix.isdigit():
+                    self.last_suffix[base] = max(self.last_suffix.get(base, 0), int(suffix))
+
+    def allocate(self, base):
+        if base not in self.bare_taken:
+            self.bare_taken.add(base)
+            return base
+        suffix = self.last_suffix.get(base, 0) + 1
+        self.last_suffix[base] = suffix
+        slug = f'{base}-{suffix}'
+        return slug if len(str(suffix)) < SUFFIX_LENGTH else random_slug(base)
+
+
+def allocate_slug(model, title, max_length=50):
+    """A slug for ``title`` that is free right now (one query)"""
+    base = slug_base(title, max_length)
+    return SlugAllocator(model, [base]).allocate(base)
+
+
+def slug_allocators(model, bases):
+    """{base: SlugAllocator} for ``bases``, one query per BATCH_SIZE distinct bases"""
+    distinct = list(dict.fromkeys(bases))
+    allocators = {}
+    for start in range(0, len(distinct), BATCH_SIZE):
+        batch = distinct[start:start + BATCH_SIZE]
+        allocator = SlugAllocator(model, batch)
+        allocators.update((base, allocator) for base in batch)
+    return allocators
+
+
+def allocate_slugs(model, titles, max_length=50):
+    """Free, mutually distinct slugs for ``titles``"""
+    bases = [slug_base(title, max_length) for title in titles]
+    allocators = slug_allocators(model, bases)
+    return [allocators[base].allocate(base) for base in bases]
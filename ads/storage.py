@@ -0,0 +1,163 @@
+"""
+Content-addressed storage for ad image files.
+
+Uploads are stored once under the sha256 of their bytes
+(``blobs/ab/cd/abcd...ef.jpg``), whatever their original name, so a file
+uploaded again by any number of ads costs no extra space. ``ImageBlob``
+counts the AdImage rows pointing at each file: ``retain`` when a row
+starts using a file, ``release`` when it stops (including queryset and
+cascade deletes, via ``post_delete``). The file and its renditions are
+removed after the transaction in which the last reference went away.
+
+Saving, releasing and deleting a file all lock its ImageBlob row, and an
+upload holds that lock until its own transaction ends, so a file is never
+deleted between an identical upload reusing it and that upload's
+``retain`` being committed.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.utils.deconstruct import deconstructible
+
+BLOB_DIR = 'blobs'
+
+
+def blob_name(digest, extension):
+    return f'{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension.lower()}'
+
+
+def is_blob(name):
+    return name.startswith(f'{BLOB_DIR}/')
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by the sha256 of their content"""
+
+    def get_available_name(self, name, max_length=None):
+        # Identical content maps to the same name; _save reuses the file
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        name = blob_name(digest.hexdigest(), os.path.splitext(name)[1])
+        with transaction.atomic():
+            # Inside AdImage.save the lock lasts until retain() is committed
+            lock_blob(name, content.size)
+            if self.exists(name):
+                return name
+
+            path = self.path(name)
+            directory = os.path.dirname(path)
+            os.makedirs(directory, exist_ok=True)
+            # Write next to the target and rename, so racing uploads of the
+            # same content never leave a partial file behind
+            handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+            try:
+                with os.fdopen(handle, 'wb') as temp:
+                    for chunk in content.chunks():
+                        temp.write(chunk)
+                if self.file_permissions_mode is not None:
+                    os.chmod(temp_path, self.file_permissions_mode)
+                os.replace(temp_path, path)
+            except BaseException:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                raise
+        return name
+
+
+image_storage = ContentAddressedStorage()
+
+
+def get_image_storage():
+    return image_storage
+
+
+def lock_blob(name, size=0):
+    """The ImageBlob of ``name`` (created unreferenced if missing), locked until the transaction ends"""
+    from .models import ImageBlob
+
+    blob, _ = ImageBlob.objects.get_or_create(name=name, defaults={'size': size})
+    return ImageBlob.objects.select_for_update().get(pk=blob.pk)
+
+
+def retain(name, size=0):
+    """Count one more reference to the stored file ``name``"""
+    from .models import ImageBlob
+
+    if not name:
+        return
+    if ImageBlob.objects.filter(name=name).update(refcount=F('refcount') + 1):
+        return
+    try:
+        with transaction.atomic():
+            ImageBlob.objects.create(name=name, size=size, refcount=1)
+    except IntegrityError:
+        ImageBlob.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release(name):
+    """Drop one reference; the file goes when nothing refers to it any more"""
+    from .models import AdImage, ImageBlob
+
+    if not name:
+        return
+    with transaction.atomic():
+        blob = ImageBlob.objects.select_for_update().filter(name=name, refcount__gt=0).first()
+        if blob is not None:
+            blob.refcount -= 1
+            blob.save(update_fields=['refcount'])
+            unused = not blob.refcount
+        else:
+            # Files stored before blobs were tracked: fall back to the rows themselves
+            unused = not AdImage.objects.filter(image=name).exists()
+    if unused:
+        transaction.on_commit(lambda: delete_file(name))
+
+
+def delete_file(name):
+    """Delete ``name`` and its renditions unless it was retained again meanwhile"""
+    from .images import delete_renditions
+    from .models import AdImage
+
+    with transaction.atomic():
+        blob = lock_blob(name)
+        if blob.refcount or AdImage.objects.filter(image=name).exists():
+            return False
+        delete_renditions(name)
+        if default_storage.exists(name):
+            default_storage.delete(name)
+        blob.delete()
+    return True
+
+
+def rebuild_refcounts():
+    """Recount ImageBlob.refcount from AdImage rows; returns the number of blobs"""
+    from .models import AdImage, ImageBlob
+
+    totals = dict(
+        AdImage.objects.exclude(image='').order_by().values_list('image').annotate(total=Count('id'))
+    )
+    blobs = {blob.name: blob for blob in ImageBlob.objects.all()}
+    changed, created = [], []
+    for name, total in totals.items():
+        blob = blobs.pop(name, None)
+        if blob is None:
+            size = default_storage.size(name) if default_storage.exists(name) else 0
+            created.append(ImageBlob(name=name, size=size, refcount=total))
+        elif blob.refcount != total:
+            blob.refcount = total
+            changed.append(blob)
+    ImageBlob.objects.bulk_create(created, batch_size=500)
+    ImageBlob.objects.bulk_update(changed, ['refcount'], batch_size=500)
+    ImageBlob.objects.filter(pk__in=[blob.pk for blob in blobs.values()]).delete()
+    return len(totals)
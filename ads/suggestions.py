@@ -0,0 +1,242 @@
+"""
+In-process prefix index for search-as-you-type suggestions.
+
+Each kind of suggestion (categories, locations, ad titles) lives in a
+sorted array of ``(key, suggestion)`` pairs, where the keys are the
+normalized text starting at each of the first few words. A lookup is a
+``bisect`` plus a short bounded scan, so no query runs per keystroke.
+
+Ads are added/removed incrementally from signals. Other worker processes
+catch up with one ``updated_at`` query at most every
+``SUGGEST_REFRESH_SECONDS`` and do a full rebuild every
+``SUGGEST_REBUILD_SECONDS`` (which also drops ads deleted elsewhere).
+Both run in a background thread, one at a time, while lookups keep
+using the current index; until the first build finishes, only
+categories and locations are suggested.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+from django.utils import timezone
+
+from .normalization import normalize_search_text
+
+logger = logging.getLogger(__name__)
+
+# Ad suggestions carry no url; the view links them to a search instead
+Suggestion = namedtuple('Suggestion', ['text', 'kind', 'url'])
+
+# Only the first words of a phrase start a key; keys are truncated
+MAX_KEY_WORDS = 4
+MAX_KEY_LENGTH = 64
+
+# How many matching entries a lookup may scan per requested suggestion
+SCAN_FACTOR = 10
+
+
+def phrase_keys(text):
+    """Normalized keys starting at each of the first MAX_KEY_WORDS words"""
+    words = normalize_search_text(text).split()
+    return {
+        ' '.join(words[start:])[:MAX_KEY_LENGTH]
+        for start in range(min(len(words), MAX_KEY_WORDS))
+    }
+
+
+class PrefixIndex:
+    """Sorted array of (key, suggestion) pairs with reference counts"""
+
+    def __init__(self):
+        self.entries = []
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def add(self, suggestion):
+        count = self.counts.get(suggestion, 0)
+        self.counts[suggestion] = count + 1
+        if count == 0:
+            for key in phrase_keys(suggestion.text):
+                insort(self.entries, (key, suggestion))
+
+    def discard(self, suggestion):
+        count = self.counts.get(suggestion, 0)
+        if count > 1:
+            self.counts[suggestion] = count - 1
+            return
+        if count == 0:
+            return
+        del self.counts[suggestion]
+        for key in phrase_keys(suggestion.text):
+            position = bisect_left(self.entries, (key, suggestion))
+            if position < len(self.entries) and self.entries[position] == (key, suggestion):
+                del self.entries[position]
+
+    def load(self, suggestions):
+        """Replace the contents in one sort instead of repeated inserts"""
+        counts = {}
+        for suggestion in suggestions:
+            counts[suggestion] = counts.get(suggestion, 0) + 1
+        self.counts = counts
+        self.entries = sorted(
+            (key, suggestion) for suggestion in counts for key in phrase_keys(suggestion.text)
+        )
+
+    def search(self, prefix, limit):
+        """Up to ``limit`` suggestions whose key starts with ``prefix``, most frequent first"""
+        found = []
+        seen = set()
+        position = bisect_left(self.entries, (prefix,))
+        end = min(len(self.entries), position + limit * SCAN_FACTOR)
+        while position < end:
+            key, suggestion = self.entries[position]
+            if not key.startswith(prefix):
+                break
+            if suggestion not in seen:
+                seen.add(suggestion)
+                found.append(suggestion)
+            position += 1
+        found.sort(key=lambda suggestion: -self.counts[suggestion])
+        return found[:limit]
+
+
+class SuggestionIndex:
+    """Categories, locations and active ad titles behind one lookup"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.categories = PrefixIndex()
+        self.locations = PrefixIndex()
+        self.ads = PrefixIndex()
+        self.ad_titles = {}
+        self.places_loaded = False
+        self.refreshing = False
+        self.built_at = None
+        self.checked_at = None
+        self.synced_at = None
+
+    def load_places(self):
+        from .models import Category, Location
+
+        categories = Category.objects.filter(is_active=True).values_list('name', 'name_ru', 'slug')
+        locations = Location.objects.filter(is_active=True).values_list('name', 'slug')
+        with self.lock:
+            self.categories.load(
+                Suggestion(label, 'category', reverse('ads:category', kwargs={'slug': slug}))
+                for name, name_ru, slug in categories
+                for label in filter(None, (name, name_ru))
+            )
+            self.locations.load(
+                Suggestion(name, 'location', reverse('ads:location', kwargs={'slug': slug}))
+                for name, slug in locations
+            )
+            self.places_loaded = True
+
+    def rebuild(self):
+        from .models import Ad
+
+        synced_at = timezone.now()
+        titles = dict(Ad.objects.filter(is_active=True).order_by().values_list('id', 'title').iterator())
+        self.load_places()
+        with self.lock:
+            self.ads.load(Suggestion(title, 'ad', '') for title in titles.values())
+            self.ad_titles = titles
+            self.synced_at = synced_at
+            self.built_at = self.checked_at = time.monotonic()
+
+    def catch_up(self):
+        """Apply ads changed by other processes since the last sync"""
+        from .models import Ad
+
+        synced_at = timezone.now()
+        changed = Ad.objects.filter(updated_at__gte=self.synced_at).values_list('id', 'title', 'is_active')
+        with self.lock:
+            for ad_id, title, is_active in changed:
+                self.set_ad(ad_id, title if is_active else None)
+            self.synced_at = synced_at
+            self.checked_at = time.monotonic()
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.refreshing:
+                refresh = None
+            elif self.built_at is None or now - self.built_at > getattr(settings, 'SUGGEST_REBUILD_SECONDS', 3600):
+                refresh = self.rebuild
+            elif now - self.checked_at > getattr(settings, 'SUGGEST_REFRESH_SECONDS', 60):
+                refresh = self.catch_up
+            else:
+                refresh = None
+            self.refreshing = refresh is not None
+        if refresh is not None:
+            if getattr(settings, 'SUGGEST_REFRESH_IN_BACKGROUND', True):
+                threading.Thread(target=self.run_refresh, args=(refresh, True), name='suggest-refresh', daemon=True).start()
+            else:
+                self.run_refresh(refresh)
+        if not self.places_loaded:
+            self.load_places()
+
+    def run_refresh(self, refresh, in_thread=False):
+        try:
+            refresh()
+        except Exception:
+            logger.exception('Refreshing the suggestion index failed')
+        finally:
+            with self.lock:
+                self.refreshing = False
+            if in_thread:
+                # The thread's own connections would otherwise stay open
+                connections.close_all()
+
+    def set_ad(self, ad_id, title):
+        """Index ``title`` for an ad, or drop the ad when ``title`` is None"""
+        with self.lock:
+            previous = self.ad_titles.pop(ad_id, None)
+            if previous is not None:
+                self.ads.discard(Suggestion(previous, 'ad', ''))
+            if title:
+                self.ad_titles[ad_id] = title
+                self.ads.add(Suggestion(title, 'ad', ''))
+
+    def invalidate_places(self):
+        self.places_loaded = False
+
+    def suggest(self, query, limit):
+        prefix = normalize_search_text(query)
+        if not prefix:
+            return []
+        self.ensure_fresh()
+        with self.lock:
+            results = self.categories.search(prefix, limit)
+            results += self.locations.search(prefix, limit - len(results))
+            results += self.ads.search(prefix, limit - len(results))
+        return results
+
+
+suggestion_index = SuggestionIndex()
+
+
+def update_ad(ad):
+    """Reflect a saved ad in this process' index (if it has been built)"""
+    if suggestion_index.built_at is not None:
+        suggestion_index.set_ad(ad.pk, ad.title if ad.is_active else None)
+
+
+def remove_ad(ad_id):
+    if suggestion_index.built_at is not None:
+        suggestion_index.set_ad(ad_id, None)
+
+
+def invalidate_places():
+    suggestion_index.invalidate_places()
+
+
+def suggest(query, limit=8):
+    return suggestion_index.suggest(query, limit)
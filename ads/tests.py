@@ -1,3 +1,886 @@
-from django.test import TestCase
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.template.loader import render_to_string
+from django.urls import reverse
+from PIL import Image
+
+from . import metrics, thumbnails
+from .benchmarks import Scenario, compare, run_scenario
+from .admin import AdImageAdmin
+from .counts import count_ads
+from .duplicates import index_hash, to_signed
+from .hyperloglog import HyperLogLog
+from .images import rendition_paths
+from .models import Ad, AdImage, AdViewSketch, AdViewTotal, Category, ImageBlob, Location
+from .pagination import paginate_listing
+from .profiling import METRICS, ProfilingMiddleware
+from .query_budgets import QueryBudgetExceeded, query_budget
+from .query_plans import explain, plan_problems
+from .sample_images import COLORS, load_font, render_placeholder, store_rendered
+from .search import order_listing, search_ads
+from .slow_queries import EXPLAIN_INTERVAL, SlowQueryRecorder, should_explain
+from .slugs import allocate_slug, allocate_slugs
+from .storage import image_storage
+from .suggestions import SuggestionIndex
+from .view_counts import ViewCountBuffer, record_view
+
+
+def create_ad(user, category, location, **fields):
+    fields.setdefault('title', 'Sotiladi')
+    fields.setdefault('description', 'Tavsif')
+    return Ad.objects.create(user=user, category=category, location=location, price=100, phone='+998901234567', **fields)
+
+
+def create_seller():
+    """(user, category, location) the test ads are posted with"""
+    user = get_user_model().objects.create_user(
+        username='sotuvchi', email='sotuvchi@example.com', password='parol12345',
+    )
+    category = Category.objects.create(name='Elektronika', slug='elektronika')
+    location = Location.objects.create(name='Toshkent', slug='toshkent')
+    return user, category, location
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class AdTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.category, cls.location = create_seller()
+
+    def setUp(self):
+        cache.clear()
+
+    def create_ad(self, **fields):
+        fields.setdefault('category', self.category)
+        fields.setdefault('location', self.location)
+        return create_ad(self.user, **fields)
+
+
+class SearchTests(AdTestCase):
+    def search(self, query):
+        return set(search_ads(Ad.objects.all(), query).values_list('title', flat=True))
+
+    def test_matches_across_scripts(self):
+        self.create_ad(title='Telefon Samsung')
+        self.create_ad(title='Velosiped')
+        self.assertEqual(self.search('телефон'), {'Telefon Samsung'})
+        self.assertEqual(self.search('TELEFON'), {'Telefon Samsung'})
+
+    def test_matches_word_prefixes(self):
+        self.create_ad(title='Telefon Samsung')
+        self.assertEqual(self.search('tele sams'), {'Telefon Samsung'})
+
+    def test_all_words_must_match(self):
+        self.create_ad(title='Telefon Samsung')
+        self.create_ad(title='Telefon Nokia')
+        self.assertEqual(self.search('telefon nokia'), {'Telefon Nokia'})
+
+    def test_query_without_words_matches_nothing(self):
+        self.create_ad(title='Telefon Samsung')
+        self.assertEqual(self.search('???'), set())
+
+    def test_follows_title_changes(self):
+        ad = self.create_ad(title='Telefon Samsung')
+        ad.title = 'Muzlatgich'
+        ad.save()
+        self.assertEqual(self.search('telefon'), set())
+        self.assertEqual(self.search('muzlatgich'), {'Muzlatgich'})
+
+
+class SearchKeyTests(AdTestCase):
+    def test_partial_save_of_title_updates_search_key(self):
+        ad = self.create_ad(title='Telefon Samsung')
+        ad.title = 'Muzlatgich'
+        ad.save(update_fields=['title'])
+        ad.refresh_from_db()
+        self.assertIn('muzlatgich', ad.search_key)
+        self.assertEqual(set(search_ads(Ad.objects.all(), 'muzlatgich')), {ad})
+
+    def test_partial_save_of_category_name_updates_search_key(self):
+        self.category.name_ru = 'Бытовая техника'
+        self.category.save(update_fields=['name_ru'])
+        self.category.refresh_from_db()
+        self.assertIn('texnika', self.category.search_key.split())
+
+    def test_admin_search_keeps_list_filter(self):
+        admin = get_user_model().objects.create_superuser(
+            username='admin', email='admin@example.com', password='parol12345',
+        )
+        Category.objects.create(name='Телефоны', slug='telefony', is_active=False)
+        active = Category.objects.create(name='Telefonlar', slug='telefonlar')
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:ads_category_changelist'), {'q': 'telefon', 'is_active__exact': '1'}
+        )
+        self.assertEqual(list(response.context['cl'].result_list), [active])
+
+
+class SuggestionTests(AdTestCase):
+    def texts(self, index, query):
+        return [suggestion.text for suggestion in index.suggest(query, 8)]
+
+    @override_settings(SUGGEST_REFRESH_IN_BACKGROUND=False)
+    def test_suggests_places_and_ad_titles(self):
+        self.create_ad(title='Telefon Samsung')
+        index = SuggestionIndex()
+        self.assertEqual(self.texts(index, 'tosh'), ['Toshkent'])
+        self.assertEqual(self.texts(index, 'тел'), ['Telefon Samsung'])
+
+    def test_lookups_do_not_wait_for_the_build(self):
+        index = SuggestionIndex()
+        release = threading.Event()
+        started = []
+
+        def slow_rebuild():
+            started.append(True)
+            release.wait(5)
+
+        with mock.patch.object(index, 'rebuild', slow_rebuild):
+            self.assertEqual(self.texts(index, 'elek'), ['Elektronika'])
+            self.assertEqual(self.texts(index, 'elek'), ['Elektronika'])
+            release.set()
+        self.assertEqual(started, [True])
+
+
+class MainImageTests(AdTestCase):
+    def add_images(self, ad):
+        AdImage.objects.bulk_create([
+            AdImage(ad=ad, image='ads/ikkinchi.jpg', order=0),
+            AdImage(ad=ad, image='ads/asosiy.jpg', order=1, is_main=True),
+            AdImage(ad=ad, image='ads/uchinchi.jpg', order=2),
+        ])
+
+    def home_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(reverse('core:home')).status_code, 200)
+        return len(queries)
+
+    def test_main_images_of_a_page_in_one_query(self):
+        for _ in range(3):
+            self.add_images(self.create_ad())
+        with self.assertNumQueries(2):
+            main_images = [ad.main_image for ad in Ad.objects.with_main_image()]
+        self.assertEqual([image.image.name for image in main_images], ['ads/asosiy.jpg'] * 3)
+
+    def test_listing_queries_do_not_grow_with_ads(self):
+        self.add_images(self.create_ad())
+        queries = self.home_queries()
+        for _ in range(4):
+            self.add_images(self.create_ad())
+        cache.clear()
+        self.assertEqual(self.home_queries(), queries)
+
+
+class KeysetPaginationTests(AdTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for number in range(7):
+            create_ad(cls.user, cls.category, cls.location, title=f'E\'lon {number}', is_featured=number == 3)
+        cls.ordered = list(order_listing(Ad.objects.all()))
+
+    def page(self, **params):
+        request = RequestFactory().get('/', params)
+        return paginate_listing(request, order_listing(Ad.objects.all()), per_page=2)
+
+    def query_params(self, query):
+        return dict(pair.split('=') for pair in query.split('&'))
+
+    def test_featured_ads_come_first(self):
+        self.assertTrue(self.ordered[0].is_featured)
+
+    @override_settings(LISTING_NUMBERED_PAGES=1)
+    def test_cursor_pages_walk_the_whole_listing(self):
+        page = self.page()
+        seen = list(page)
+        while page.has_next():
+            page = self.page(**self.query_params(page.next_query))
+            self.assertIsNone(page.number)
+            seen += list(page)
+        self.assertEqual(seen, self.ordered)
+
+    @override_settings(LISTING_NUMBERED_PAGES=1)
+    def test_previous_cursor_returns_the_previous_page(self):
+        second = self.page(**self.query_params(self.page().next_query))
+        third = self.page(**self.query_params(second.next_query))
+        back = self.page(**self.query_params(third.previous_query))
+        self.assertEqual(list(back), list(second))
+
+    def test_numbered_pages_switch_to_a_cursor(self):
+        with override_settings(LISTING_NUMBERED_PAGES=2):
+            page = self.page(page=2)
+        self.assertEqual(list(page), self.ordered[2:4])
+        self.assertIn('cursor', self.query_params(page.next_query))
+
+    def test_invalid_cursor_falls_back_to_the_first_page(self):
+        self.assertEqual(list(self.page(cursor='garbage')), self.ordered[:2])
+
+
+@override_settings(COUNT_STALE_SECONDS=0)
+class CountTests(AdTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_category = Category.objects.create(name='Transport', slug='transport')
+
+    def count(self, category):
+        return count_ads(Ad.objects.filter(is_active=True, category=category), category=category.id)
+
+    def test_counts_are_cached(self):
+        self.create_ad()
+        self.assertEqual(self.count(self.category), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count(self.category), 1)
+
+    def test_saving_an_ad_expires_counts_of_its_category_only(self):
+        self.assertEqual(self.count(self.category), 0)
+        self.assertEqual(self.count(self.other_category), 0)
+        self.create_ad()
+        self.assertEqual(self.count(self.category), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.count(self.other_category), 0)
+
+    def test_moving_an_ad_expires_counts_of_both_categories(self):
+        ad = self.create_ad()
+        self.assertEqual(self.count(self.category), 1)
+        self.assertEqual(self.count(self.other_category), 0)
+        ad.category = self.other_category
+        ad.save()
+        self.assertEqual(self.count(self.category), 0)
+        self.assertEqual(self.count(self.other_category), 1)
+
+    def test_home_count_filtered_by_slug_follows_saves(self):
+        url = reverse('core:home')
+        self.assertEqual(self.client.get(url, {'category': 'elektronika'}).context['ads_count'], 0)
+        self.create_ad()
+        self.assertEqual(self.client.get(url, {'category': 'elektronika'}).context['ads_count'], 1)
+
+
+class AdsCountTests(AdTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.other_category = Category.objects.create(name='Transport', slug='transport')
+
+    def assertCounts(self, category, other_category, location):
+        self.assertEqual(
+            [
+                Category.objects.get(pk=self.category.pk).ads_count,
+                Category.objects.get(pk=self.other_category.pk).ads_count,
+                Location.objects.get(pk=self.location.pk).ads_count,
+            ],
+            [category, other_category, location],
+        )
+
+    def test_create_deactivate_and_delete(self):
+        ad = self.create_ad()
+        self.create_ad()
+        self.assertCounts(2, 0, 2)
+        ad.is_active = False
+        ad.save()
+        self.assertCounts(1, 0, 1)
+        ad.delete()
+        self.assertCounts(1, 0, 1)
+
+    def test_moving_an_ad_moves_the_counter(self):
+        ad = self.create_ad()
+        ad.category = self.other_category
+        ad.save()
+        self.assertCounts(0, 1, 1)
+
+    def test_stale_copies_deactivating_the_same_ad_count_once(self):
+        self.create_ad()
+        ad = self.create_ad()
+        first, second = Ad.objects.get(pk=ad.pk), Ad.objects.get(pk=ad.pk)
+        first.is_active = second.is_active = False
+        first.save()
+        second.save()
+        self.assertCounts(1, 0, 1)
+
+    def test_stale_copies_deleting_the_same_ad_count_once(self):
+        self.create_ad()
+        ad = self.create_ad()
+        stale = Ad.objects.get(pk=ad.pk)
+        ad.delete()
+        stale.delete()
+        self.assertCounts(1, 0, 1)
+
+    def test_partial_save_only_moves_saved_fields(self):
+        ad = self.create_ad()
+        ad.is_active = False
+        ad.save(update_fields=['title'])
+        self.assertCounts(1, 0, 1)
+        ad.save(update_fields=['is_active'])
+        self.assertCounts(0, 0, 0)
+
+
+@override_settings(VIEW_COUNT_FLUSH_SECONDS=0)
+class UniqueViewTests(AdTestCase):
+    def view(self, ad, visitor, day):
+        with mock.patch('ads.view_counts.timezone.localdate', return_value=day):
+            record_view(ad.pk, visitor)
+
+    def test_unique_viewers_add_up_across_days(self):
+        ad = self.create_ad()
+        first, second = datetime.date(2026, 1, 1), datetime.date(2026, 1, 2)
+        for visitor in ('a', 'b', 'c'):
+            self.view(ad, visitor, first)
+        for visitor in ('c', 'd'):
+            self.view(ad, visitor, second)
+        ad.refresh_from_db()
+        self.assertEqual(ad.views_count, 5)
+        self.assertEqual(ad.unique_views_count, 4)
+        self.assertEqual(AdViewSketch.objects.filter(ad=ad).count(), 2)
+
+    def test_flush_does_not_reread_older_days(self):
+        ad = self.create_ad()
+        self.view(ad, 'a', datetime.date(2026, 1, 1))
+        with CaptureQueriesContext(connection) as queries:
+            self.view(ad, 'b', datetime.date(2026, 1, 2))
+        daily_reads = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT') and 'ads_adviewsketch' in query['sql']
+        ]
+        # Only the flushed day's row is read
+        self.assertEqual(len(daily_reads), 1)
+        self.assertIn("'2026-01-02'", daily_reads[0])
+        merged = HyperLogLog()
+        for data in AdViewSketch.objects.filter(ad=ad).values_list('sketch', flat=True):
+            merged.merge(HyperLogLog.from_bytes(data))
+        total = HyperLogLog.from_bytes(AdViewTotal.objects.get(ad=ad).sketch)
+        self.assertEqual(total.registers, merged.registers)
+
+
+# Foreign keys are only checked on commit
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ViewFlushTests(TransactionTestCase):
+    def setUp(self):
+        self.user, self.category, self.location = create_seller()
+
+    def create_ad(self):
+        return create_ad(self.user, self.category, self.location)
+
+    def test_views_of_a_deleted_ad_are_dropped(self):
+        deleted, kept = self.create_ad(), self.create_ad()
+        buffer = ViewCountBuffer()
+        with mock.patch.object(buffer, 'ensure_thread'):
+            buffer.record(deleted.pk, 'user:1')
+            buffer.record(kept.pk, 'user:1')
+        deleted.delete()
+
+        self.assertEqual(buffer.flush(), 2)
+        kept.refresh_from_db()
+        self.assertEqual((kept.views_count, kept.unique_views_count), (1, 1))
+        self.assertFalse(buffer.pending)
+        self.assertFalse(buffer.sketches)
+        self.assertEqual(buffer.flush(), 0)
+
+    def buffered(self, count, visitor=None):
+        """A buffer holding two views of each of ``count`` new ads"""
+        buffer = ViewCountBuffer()
+        with mock.patch.object(buffer, 'ensure_thread'):
+            for _ in range(count):
+                ad = self.create_ad()
+                buffer.record(ad.pk, visitor)
+                buffer.record(ad.pk, visitor)
+        return buffer
+
+    def test_view_counts_are_written_in_one_update(self):
+        buffer = self.buffered(5)
+        # BEGIN, the UPDATE and COMMIT
+        with self.assertNumQueries(3):
+            self.assertEqual(buffer.flush(), 10)
+        self.assertEqual(set(Ad.objects.values_list('views_count', flat=True)), {2})
+
+    def test_unique_views_take_a_fixed_number_of_queries(self):
+        few, many = self.buffered(2, 'user:1'), self.buffered(6, 'user:1')
+        with CaptureQueriesContext(connection) as queries:
+            few.flush()
+        with self.assertNumQueries(len(queries)):
+            many.flush()
+        self.assertEqual(set(Ad.objects.values_list('unique_views_count', flat=True)), {1})
+
+
+class FavoriteTests(AdTestCase):
+    def test_toggle_counts_each_user_once(self):
+        ad = self.create_ad()
+        self.assertTrue(ad.toggle_favorite(self.user))
+        self.assertEqual(Ad.objects.get(pk=ad.pk).favorites_count, 1)
+        self.assertFalse(ad.toggle_favorite(self.user))
+        self.assertEqual(Ad.objects.get(pk=ad.pk).favorites_count, 0)
+
+    def test_home_marks_favorited_ads(self):
+        favorite = self.create_ad(title='Telefon')
+        self.create_ad(title='Velosiped')
+        favorite.toggle_favorite(self.user)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('core:home'))
+        self.assertEqual(response.context['favorite_ids'], {favorite.pk})
+        self.assertContains(response, 'bi-heart-fill', count=1)
+
+
+class SlugTests(AdTestCase):
+    def test_next_numeric_suffix(self):
+        for slug in ('telefon', 'telefon-2', 'telefon-x7k2m9', 'telefon-samsung', 'telefon-samsung-9'):
+            self.create_ad(slug=slug)
+        self.assertEqual(allocate_slug(Ad, 'Telefon'), 'telefon-3')
+        self.assertEqual(allocate_slug(Ad, 'Телефон Samsung'), 'telefon-samsung-10')
+        self.assertEqual(allocate_slug(Ad, 'Velosiped'), 'velosiped')
+
+    def test_batch_allocation_is_distinct(self):
+        self.create_ad(slug='telefon')
+        self.assertEqual(
+            allocate_slugs(Ad, ['Telefon', 'Telefon', 'Velosiped']),
+            ['telefon-1', 'telefon-2', 'velosiped'],
+        )
+
+    def test_saving_allocates_a_free_slug(self):
+        first = self.create_ad(title='Telefon')
+        second = self.create_ad(title='Telefon')
+        self.assertEqual([first.slug, second.slug], ['telefon', 'telefon-1'])
+
+    def test_lookup_reads_the_slug_index(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite query plan')
+        with CaptureQueriesContext(connection) as queries:
+            allocate_slug(Ad, 'Telefon')
+        sql = queries[0]['sql']
+        self.assertNotIn('LIKE', sql)
+        self.assertNotIn('REGEXP', sql)
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql)
+            plan = [row[3] for row in cursor.fetchall()]
+        self.assertTrue(any('USING' in detail for detail in plan), plan)
+        self.assertFalse([detail for detail in plan if detail.startswith('SCAN')])
+
+
+def jpeg(size=(64, 48), color='red'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class MediaMixin:
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def upload(self, data=b'rasm'):
+        image = AdImage(ad=self.ad)
+        image.image.save('rasm.jpg', ContentFile(data))
+        return image
+
+
+@mock.patch('ads.models.enqueue')
+class StorageTests(MediaMixin, AdTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ad = self.create_ad()
+
+    def test_identical_uploads_share_one_counted_file(self, enqueue):
+        first, second = self.upload(), self.upload()
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(ImageBlob.objects.get(name=first.image.name).refcount, 2)
+        self.assertEqual(len(os.listdir(os.path.dirname(image_storage.path(first.image.name)))), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(ImageBlob.objects.get(name=second.image.name).refcount, 1)
+        self.assertTrue(image_storage.exists(second.image.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(ImageBlob.objects.filter(name=second.image.name).exists())
+        self.assertFalse(image_storage.exists(second.image.name))
+
+    def test_queryset_delete_releases_every_row(self, enqueue):
+        name = self.upload().image.name
+        self.upload()
+        with self.captureOnCommitCallbacks(execute=True):
+            AdImage.objects.filter(ad=self.ad).delete()
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+        self.assertFalse(image_storage.exists(name))
+
+    def test_reupload_before_its_retain_keeps_the_file(self, enqueue):
+        name = self.upload().image.name
+        with self.captureOnCommitCallbacks() as callbacks:
+            AdImage.objects.get().delete()
+            # An identical upload whose retain() has not been committed yet
+            with mock.patch('ads.models.retain'):
+                self.upload()
+        for callback in callbacks:
+            callback()
+        self.assertTrue(image_storage.exists(name))
+
+
+@override_settings(IMAGE_PROCESSING_WORKERS=0)
+class ImageProcessingTests(MediaMixin, AdTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ad = self.create_ad()
+
+    def process(self, data):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = self.upload(data)
+        image.refresh_from_db()
+        return image
+
+    def test_upload_writes_renditions(self):
+        image = self.process(jpeg((600, 300)))
+        self.assertIsNotNone(image.processed_at)
+        for path in rendition_paths(image.image.name):
+            self.assertTrue(default_storage.exists(path), path)
+        with default_storage.open(rendition_paths(image.image.name)[0]) as thumb:
+            self.assertEqual(Image.open(thumb).size, (160, 80))
+
+    def test_decode_failure_leaves_the_image_unprocessed(self):
+        with self.assertLogs('ads.images', 'ERROR'):
+            image = self.process(b'rasm emas')
+        self.assertIsNone(image.processed_at)
+        self.assertFalse(any(default_storage.exists(path) for path in rendition_paths(image.image.name)))
+
+    def test_processing_stores_dimensions_and_placeholder(self):
+        image = self.process(jpeg((600, 300)))
+        self.assertEqual((image.width, image.height), (600, 300))
+        self.assertTrue(image.placeholder.startswith('data:image/jpeg;base64,'))
+
+    @mock.patch('ads.models.enqueue')
+    def test_unprocessed_image_shows_placeholder_and_size(self, enqueue):
+        image = self.upload(jpeg((600, 300)))
+        AdImage.objects.filter(pk=image.pk).update(width=600, height=300, placeholder='data:image/jpeg;base64,AAAA')
+        image.refresh_from_db()
+        self.assertIsNone(image.processed_at)
+        html = render_to_string('includes/ad_image.html', {'rendition': image.renditions['card'], 'alt': 'Rasm'})
+        self.assertIn(f'src="{image.image.url}"', html)
+        self.assertIn('width="600" height="300"', html)
+        self.assertIn("url('data:image/jpeg;base64,AAAA')", html)
+
+
+@mock.patch('ads.models.enqueue')
+class ThumbnailTests(MediaMixin, AdTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ad = self.create_ad()
+        self.image = self.upload(jpeg())
+        for name in ('_cache_bytes', '_scanned_at'):
+            patcher = mock.patch.object(thumbnails, name, None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def url(self, size='120x120', extension='webp'):
+        return reverse('ads:thumbnail', kwargs={'pk': self.image.pk, 'size': size, 'extension': extension})
+
+    def get(self, url, **headers):
+        response = self.client.get(url, **headers)
+        self.addCleanup(response.close)
+        return response
+
+    def cached(self):
+        return [path for _, _, path in thumbnails.cache_files()]
+
+    def test_size_not_in_the_list_is_404(self, enqueue):
+        with self.assertLogs('django.request', 'WARNING'):
+            self.assertEqual(self.get(self.url(size='64x64')).status_code, 404)
+        self.assertEqual(self.cached(), [])
+
+    def test_matching_etag_is_304(self, enqueue):
+        response = self.get(self.url())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (120, 120))
+        response = self.get(self.url(), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_evicts_past_the_limit(self, enqueue):
+        self.get(self.url())
+        self.assertEqual(len(self.cached()), 1)
+        with override_settings(THUMBNAIL_CACHE_MAX_BYTES=1):
+            response = self.get(self.url(size='400x200'))
+            self.assertTrue(b''.join(response.streaming_content))
+        self.assertEqual(self.cached(), [])
+
+    def test_counts_files_written_by_other_workers(self, enqueue):
+        self.get(self.url())
+        other = os.path.join(thumbnails.cache_root(), 'other.webp')
+        with open(other, 'wb') as file:
+            file.write(b'x' * 10000)
+        with override_settings(THUMBNAIL_CACHE_MAX_BYTES=5000):
+            thumbnails.record_write(0)
+            self.assertTrue(os.path.exists(other))
+            thumbnails._scanned_at -= thumbnails.RESCAN_INTERVAL
+            thumbnails.record_write(0)
+        self.assertFalse(os.path.exists(other))
+
+
+class SampleImageTests(MediaMixin, AdTestCase):
+    def test_stored_placeholders_are_not_near_duplicates(self):
+        stored = store_rendered(render_placeholder(('OLX', COLORS[0])))
+        first, second = AdImage.objects.bulk_create(
+            AdImage(ad=self.create_ad(), **stored) for _ in range(2)
+        )
+        self.assertIsNotNone(first.processed_at)
+        self.assertIsNone(AdImage.objects.get(pk=first.pk).phash)
+        self.assertFalse(first.hash_bands.exists())
+        self.assertEqual(first.near_duplicates, [])
+
+    @mock.patch('ads.sample_images.ImageFont')
+    def test_font_without_size_on_old_pillow(self, image_font):
+        image_font.truetype.side_effect = OSError
+        image_font.load_default.side_effect = [TypeError, 'bitmap']
+        self.assertEqual(load_font(), 'bitmap')
+        image_font.load_default.assert_called_with()
+
+
+class NearDuplicateTests(AdTestCase):
+    PHOTO = 0x0123456789ABCDEF
+
+    def hashed_image(self, value):
+        image, = AdImage.objects.bulk_create([
+            AdImage(ad=self.create_ad(), image='ads/rasm.jpg', phash=to_signed(value)),
+        ])
+        index_hash(image.pk, image.phash)
+        return image
+
+    def test_finds_near_duplicates_only(self):
+        photo = self.hashed_image(self.PHOTO)
+        copy = self.hashed_image(self.PHOTO ^ 0b101)
+        self.hashed_image(self.PHOTO ^ 0xFFFFFFFF)
+        matches = photo.near_duplicates
+        self.assertEqual([(image.pk, distance) for image, distance in matches], [(copy.pk, 2)])
+        self.assertFalse(matches.truncated)
+
+    @override_settings(NEAR_DUPLICATE_LIMIT=1)
+    def test_keeps_only_the_closest_matches(self):
+        photo = self.hashed_image(self.PHOTO)
+        self.hashed_image(self.PHOTO ^ 0b111)
+        closest = self.hashed_image(self.PHOTO ^ 0b1)
+        matches = photo.near_duplicates
+        self.assertEqual([(image.pk, distance) for image, distance in matches], [(closest.pk, 1)])
+        self.assertTrue(matches.truncated)
+        field = AdImageAdmin(AdImage, admin.site).near_duplicate_images(photo)
+        self.assertIn('Faqat eng yaqin 1 tasi', field)
+
+
+class BenchmarkTests(AdTestCase):
+    def test_run_scenario_measures_successful_requests(self):
+        self.create_ad()
+        result = run_scenario(Scenario('home', reverse('core:home')), repeat=3, warmup=1)
+        self.assertEqual(result['status'], 200)
+        self.assertGreater(result['queries'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+
+    def test_run_scenario_stops_at_an_error(self):
+        with self.assertLogs('django.request', 'WARNING'):
+            result = run_scenario(Scenario('detail', reverse('ads:detail', kwargs={'slug': 'yoq'})), warmup=0)
+        self.assertEqual(result, {'status': 404})
+
+    def test_compare(self):
+        baseline = {
+            'home': {'status': 200, 'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 4},
+            'list': {'status': 200, 'p50_ms': 10.0, 'p95_ms': 100.0, 'queries': 4},
+        }
+        results = {
+            # Within LATENCY_SLACK_MS of a fast baseline
+            'home': {'status': 200, 'p50_ms': 12.0, 'p95_ms': 24.0, 'queries': 4},
+            'list': {'status': 200, 'p50_ms': 10.0, 'p95_ms': 130.0, 'queries': 5},
+            'location': {'status': 500},
+            'category': {'status': 200, 'p50_ms': 10.0, 'p95_ms': 20.0, 'queries': 9},
+        }
+        self.assertEqual(compare(results, baseline, tolerance=0.25), [
+            ('list', 'queries 4 -> 5'),
+            ('list', 'p95 100.0ms -> 130.0ms'),
+            ('location', 'status 500'),
+        ])
+
+
+@query_budget(1)
+def two_query_view(request):
+    list(Category.objects.all())
+    list(Location.objects.all())
+    return HttpResponse()
+
+
+class QueryBudgetTests(AdTestCase):
+    def test_view_over_budget_raises(self):
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'two_query_view ran 2 queries, its budget is 1'):
+            two_query_view(RequestFactory().get('/'))
+
+    @override_settings(QUERY_BUDGET_STRICT=False, DEBUG=False)
+    def test_budgets_are_not_checked_in_production(self):
+        self.assertEqual(two_query_view(RequestFactory().get('/')).status_code, 200)
+
+
+class ProfilingTests(AdTestCase):
+    @override_settings(PROFILING_SAMPLE_RATE=1)
+    def test_sampled_request_gets_server_timing(self):
+        self.create_ad()
+        with self.assertLogs('ads.profiling', 'INFO') as logs:
+            response = self.client.get(reverse('core:home'))
+        entries = response['Server-Timing'].split(', ')
+        self.assertEqual([entry.split(';')[0] for entry in entries], list(METRICS))
+        for entry in entries:
+            self.assertRegex(entry, r'^\w+;dur=\d+\.\d;desc="[^"]+"$')
+        self.assertRegex(entries[0], r'\(([1-9]\d*) queries\)')
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((line['route'], line['status']), ('core:home', 200))
+
+    @override_settings(PROFILING_SAMPLE_RATE=0)
+    def test_rate_zero_is_not_used(self):
+        with self.assertRaises(MiddlewareNotUsed):
+            ProfilingMiddleware(lambda request: None)
+        self.assertNotIn('Server-Timing', self.client.get(reverse('core:home')))
+
+
+@override_settings(METRICS_COMPACT_SECONDS=0)
+class MetricsTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        directory = override_settings(METRICS_DIR=self.directory)
+        directory.enable()
+        self.addCleanup(directory.disable)
+        patches = [
+            mock.patch('ads.metrics.registry', metrics.Registry()),
+            # Pids 1001 and 1002 have exited, this process is still running
+            mock.patch('ads.metrics.is_running', lambda pid: pid == os.getpid()),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def write_worker(self, file_name, requests):
+        metrics.write_metrics(os.path.join(self.directory, file_name), {
+            'counters': [['olx_http_requests_total', [['route', 'core:home']], requests]],
+            'histograms': [['olx_image_processing_seconds', [], [1] + [0] * 10, 0.5, 1]],
+        })
+
+    def requests(self):
+        counters, histograms = metrics.collect()
+        return counters['olx_http_requests_total', (('route', 'core:home'),)], histograms
+
+    def test_exited_workers_are_folded_once(self):
+        self.write_worker('1001-1.json', 3)
+        self.write_worker('1002-1.json', 4)
+        self.write_worker(f'{os.getpid()}-1.json', 5)
+        stale = os.path.join(self.directory, 'abandoned.tmp')
+        open(stale, 'w').close()
+        os.utime(stale, (0, 0))
+
+        total, histograms = self.requests()
+        self.assertEqual(total, 12)
+        self.assertEqual(histograms['olx_image_processing_seconds', ()]['count'], 3)
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [metrics.LOCK_FILE, f'{os.getpid()}-1.json', metrics.RETIRED_FILE],
+        )
+        self.assertEqual(self.requests()[0], 12)
+
+    def test_interrupted_compaction_is_not_counted_twice(self):
+        self.write_worker('1001-1.json', 3)
+        metrics.write_metrics(os.path.join(self.directory, metrics.RETIRED_FILE), {
+            'counters': [['olx_http_requests_total', [['route', 'core:home']], 3]],
+            'histograms': [],
+            'folded': ['1001-1.json'],
+        })
+        with mock.patch('ads.metrics.compact'):
+            self.assertEqual(self.requests()[0], 3)
+        self.assertEqual(self.requests()[0], 3)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, '1001-1.json')))
+
+
+class SlowQueryTests(AdTestCase):
+    def test_fetching_rows_counts_towards_the_duration(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite function')
+        connection.ensure_connection()
+        connection.connection.create_function('nap', 1, lambda value: time.sleep(0.01) or value)
+        recorder = SlowQueryRecorder(connection, 50, lambda: 'test')
+        sql = 'WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < 10) SELECT nap(x) FROM n'
+        with mock.patch.object(recorder, 'record') as record:
+            with connection.execute_wrapper(recorder), connection.cursor() as cursor:
+                cursor.execute(sql)
+                self.assertEqual(len(cursor.fetchall()), 10)
+            record.assert_not_called()
+            recorder.finish()
+        record.assert_called_once()
+        self.assertGreaterEqual(record.call_args.args[3], 90)
+
+    @mock.patch('ads.slow_queries._explained', new_callable=OrderedDict)
+    @mock.patch('ads.slow_queries.time.monotonic')
+    def test_explained_fingerprints_expire(self, monotonic, explained):
+        monotonic.return_value = 1000
+        self.assertTrue(should_explain(('default', 'a')))
+        self.assertFalse(should_explain(('default', 'a')))
+        monotonic.return_value = 1000 + EXPLAIN_INTERVAL
+        self.assertTrue(should_explain(('default', 'b')))
+        self.assertEqual(list(explained), [('default', 'b')])
+        self.assertTrue(should_explain(('default', 'a')))
+
+
+class QueryPlanTests(AdTestCase):
+    def test_sorts_count_against_tables_at_their_level(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite query plan')
+        # A sliced prefetch: the outer sort only orders the page of rows the subquery found
+        prefetch = [
+            (2, 0, 'CO-ROUTINE qualify'),
+            (5, 2, 'SEARCH ads_adimage USING INDEX ads_adimage_ad_id_a8c5ff80 (ad_id=?)'),
+            (85, 2, 'USE TEMP B-TREE FOR RIGHT PART OF ORDER BY'),
+            (186, 0, 'SCAN qualify'),
+            (208, 0, 'USE TEMP B-TREE FOR ORDER BY'),
+        ]
+        self.assertEqual(plan_problems(prefetch, {'ads_adimage'}), [])
+        listing = [
+            (6, 0, 'SCAN ads_location'),
+            (8, 0, 'SEARCH ads_ad USING INDEX ads_ad_categor_ee8499_idx (category_id=? AND location_id=?)'),
+            (55, 0, 'USE TEMP B-TREE FOR ORDER BY'),
+        ]
+        self.assertEqual(plan_problems(listing, {'ads_ad'}), ['sort over ads_ad: USE TEMP B-TREE FOR ORDER BY'])
+
+    def test_listing_reads_the_partial_index_in_order(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite query plan')
+        for queryset in (Ad.objects.all(), Ad.objects.filter(category=self.category)):
+            sql, params = order_listing(queryset.filter(is_active=True))[:12].query.sql_with_params()
+            self.assertEqual(plan_problems(explain(sql, params), {'ads_ad'}), [])
+
+
+# gc_media sweeps in worker threads, which need committed rows
+@mock.patch('ads.models.enqueue')
+class GcMediaTests(MediaMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ad = create_ad(*create_seller())
+
+    def test_rechecks_before_deleting(self, enqueue):
+        used = self.upload().image.name
+        orphan = image_storage.save('eski.jpg', ContentFile(b'eski'))
+        # As if both files were uploaded again after the sweep read the references
+        with mock.patch('ads.management.commands.gc_media.Command.is_referenced', return_value=False):
+            call_command('gc_media', min_age_hours=0, workers=1, stdout=io.StringIO())
+        self.assertTrue(image_storage.exists(used))
+        self.assertFalse(image_storage.exists(orphan))
+        self.assertFalse(ImageBlob.objects.filter(name=orphan).exists())
@@ -0,0 +1,164 @@
+"""
+On-demand thumbnails with a size-bounded disk cache.
+
+``/ads/thumb/<id>/<W>x<H>.<webp|jpeg>?v=<version>`` crops the original
+to one of the whitelisted ``THUMBNAIL_SIZES``. Each file is generated on
+first request under ``MEDIA_ROOT/thumbs`` and served from disk afterwards.
+The ``v`` query parameter changes whenever the image file changes, so
+responses can be cached forever.
+
+The cache is an LRU on file mtimes: hits refresh the mtime (at most once
+per ``TOUCH_INTERVAL``) and, once the cache grows past
+``THUMBNAIL_CACHE_MAX_BYTES``, the least recently used files are removed
+until it is back under ``EVICT_TO`` of the limit. Each worker process
+only counts its own writes, so the directory is re-scanned at least every
+``RESCAN_INTERVAL`` seconds to pick up what the other workers wrote.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image, ImageOps
+
+from . import metrics
+from .images import FORMATS, Rendition, load_original
+from .profiling import timed
+
+CACHE_DIR = 'thumbs'
+CONTENT_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg'}
+TOUCH_INTERVAL = 3600
+EVICT_TO = 0.9
+RESCAN_INTERVAL = 60
+
+_lock = threading.Lock()
+_cache_bytes = None
+_scanned_at = None
+
+
+def allowed_sizes():
+    return getattr(settings, 'THUMBNAIL_SIZES', ['120x120', '400x200', '800x400'])
+
+
+def parse_size(size):
+    width, height = size.split('x')
+    return int(width), int(height)
+
+
+def version(name):
+    """Changes whenever the AdImage points at another file"""
+    return hashlib.md5(name.encode()).hexdigest()[:10]
+
+
+def etag(name, size, extension):
+    return f'"{version(name)}-{size}.{extension}"'
+
+
+def cache_root():
+    return os.path.join(settings.MEDIA_ROOT, CACHE_DIR)
+
+
+def cache_path(image_id, name, size, extension):
+    return os.path.join(cache_root(), str(image_id), f'{version(name)}-{size}.{extension}')
+
+
+@timed('images')
+def thumbnails_for(image):
+    """{'WxH': Rendition} of thumbnail urls, for templates"""
+    if not image.image:
+        return {}
+    query = f'?v={version(image.image.name)}'
+    thumbnails = {}
+    for size in allowed_sizes():
+        width, height = parse_size(size)
+        urls = {
+            extension: reverse('ads:thumbnail', kwargs={'pk': image.pk, 'size': size, 'extension': extension}) + query
+            for extension in FORMATS
+        }
+        thumbnails[size] = Rendition(**urls, width=width, height=height, placeholder=image.placeholder)
+    return thumbnails
+
+
+def render(name, size, extension):
+    with default_storage.open(name, 'rb') as field:
+        picture = load_original(field)
+    picture = ImageOps.fit(picture, parse_size(size), Image.LANCZOS)
+    buffer = BytesIO()
+    picture.save(buffer, **FORMATS[extension])
+    return buffer.getvalue()
+
+
+def open_thumbnail(image_id, name, size, extension):
+    """Open the cached thumbnail file, generating it on a miss"""
+    path = cache_path(image_id, name, size, extension)
+    try:
+        thumbnail = open(path, 'rb')
+    except FileNotFoundError:
+        pass
+    else:
+        metrics.inc('olx_cache_requests_total', cache='thumbnails', result='hit')
+        now = time.time()
+        if now - os.fstat(thumbnail.fileno()).st_mtime > TOUCH_INTERVAL:
+            try:
+                os.utime(path, (now, now))
+            except FileNotFoundError:
+                pass
+        return thumbnail
+
+    metrics.inc('olx_cache_requests_total', cache='thumbnails', result='miss')
+    data = render(name, size, extension)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write to a temp file first so concurrent requests never see half a file
+    handle, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(handle, 'wb') as temp:
+        temp.write(data)
+    os.replace(temp_path, path)
+    # Opened before eviction runs, so it stays readable even if evicted
+    thumbnail = open(path, 'rb')
+    record_write(len(data))
+    return thumbnail
+
+
+def cache_files():
+    for directory, _, files in os.walk(cache_root()):
+        for file_name in files:
+            path = os.path.join(directory, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield stat.st_mtime, stat.st_size, path
+
+
+def record_write(size):
+    global _cache_bytes, _scanned_at
+    limit = getattr(settings, 'THUMBNAIL_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    with _lock:
+        now = time.monotonic()
+        if _scanned_at is None or now - _scanned_at >= RESCAN_INTERVAL:
+            _cache_bytes = sum(file_size for _, file_size, _ in cache_files())
+            _scanned_at = now
+        else:
+            _cache_bytes += size
+        if _cache_bytes > limit:
+            _cache_bytes = evict(int(limit * EVICT_TO))
+
+
+def evict(target):
+    """Delete least recently used files until the cache fits in ``target`` bytes"""
+    files = sorted(cache_files())
+    total = sum(size for _, size, _ in files)
+    for _, size, path in files:
+        if total <= target:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+    return total
@@ -18,4 +18,11 @@ urlpatterns = [
     # AJAX endpoints
     path('report/', views.report_ad_view, name='report'),
     path('ajax-delete/', views.ajax_delete_ad, name='ajax_delete'),
+    path('suggest/', views.suggest_view, name='suggest'),
+    
+    # Images
+    path('thumb/<int:pk>/<str:size>.<str:extension>', views.thumbnail_view, name='thumbnail'),
+
+    # Monitoring
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
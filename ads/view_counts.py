@@ -0,0 +1,192 @@
+"""
+Buffered ad view counting.
+
+Detail page hits only bump an in-process counter. A daemon thread flushes
+the buffer every ``VIEW_COUNT_FLUSH_SECONDS`` with one
+``UPDATE ... SET views_count = views_count + n WHERE id IN (...)`` per
+distinct increment, and whatever is left is flushed at exit. With the
+interval set to 0 every view is written straight away (useful in tests).
+
+Visitors are also added to per-ad, per-day HyperLogLog sketches (see
+``ads.hyperloglog``), merged into ``AdViewSketch`` rows on flush. The same
+buffered sketches are merged into the ad's running ``AdViewTotal``
+sketch, whose estimate is stored in ``Ad.unique_views_count``, so a flush
+never re-reads the ad's older days.
+"""
+import atexit
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .hyperloglog import HyperLogLog
+
+logger = logging.getLogger(__name__)
+
+BOT_RE = re.compile(r'bot|crawl|spider|slurp|preview|headless', re.IGNORECASE)
+
+
+def visitor_key(request):
+    """Identify the viewer for unique counts, or None for crawlers"""
+    agent = request.META.get('HTTP_USER_AGENT', '')
+    if not agent or BOT_RE.search(agent):
+        return None
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return f"anon:{request.META.get('REMOTE_ADDR', '')}:{agent}"
+
+
+class ViewCountBuffer:
+    """Per-process buffer of pending view increments and visitor sketches"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = Counter()
+        self.sketches = {}
+        self.thread = None
+
+    @property
+    def interval(self):
+        return getattr(settings, 'VIEW_COUNT_FLUSH_SECONDS', 10)
+
+    def record(self, ad_id, visitor=None):
+        with self.lock:
+            self.pending[ad_id] += 1
+            if visitor:
+                key = (ad_id, timezone.localdate())
+                if key not in self.sketches:
+                    self.sketches[key] = HyperLogLog()
+                self.sketches[key].add(visitor)
+        if self.interval <= 0:
+            self.flush()
+        else:
+            self.ensure_thread()
+
+    def flush(self):
+        """Write all pending increments; returns the number of views written"""
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            sketches, self.sketches = self.sketches, {}
+        if not pending and not sketches:
+            return 0
+
+        try:
+            with transaction.atomic():
+                write_views(pending)
+                write_sketches(sketches)
+        except DatabaseError:
+            # Keep everything for the next attempt
+            with self.lock:
+                self.pending.update(pending)
+                for key, sketch in sketches.items():
+                    if key in self.sketches:
+                        sketch.merge(self.sketches[key])
+                    self.sketches[key] = sketch
+            raise
+        return sum(pending.values())
+
+    def ensure_thread(self):
+        if self.thread is not None and self.thread.is_alive():
+            return
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='view-count-flush', daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            time.sleep(max(self.interval, 1))
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing view counts failed')
+            finally:
+                close_old_connections()
+
+    def flush_at_exit(self):
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Flushing view counts at exit failed')
+
+
+def write_views(pending):
+    from .models import Ad
+
+    by_increment = defaultdict(list)
+    for ad_id, views in pending.items():
+        by_increment[views].append(ad_id)
+    for views, ad_ids in by_increment.items():
+        Ad.objects.filter(pk__in=ad_ids).update(views_count=F('views_count') + views)
+
+
+def write_sketches(sketches):
+    """Merge buffered sketches into the daily and lifetime rows and refresh the estimates"""
+    from .models import Ad, AdViewSketch, AdViewTotal
+
+    # Ads deleted since their views were buffered: their rows can never be
+    # written, and keeping them would fail every later flush
+    ad_ids = set(
+        Ad.objects.select_for_update().filter(pk__in={ad_id for ad_id, day in sketches}).values_list('pk', flat=True)
+    )
+    sketches = {key: sketch for key, sketch in sketches.items() if key[0] in ad_ids}
+    if not sketches:
+        return
+    existing = {
+        (row.ad_id, row.date): row
+        for row in AdViewSketch.objects.select_for_update().filter(
+            ad_id__in=ad_ids, date__in={day for ad_id, day in sketches},
+        )
+    }
+    created, updated = [], []
+    for (ad_id, day), sketch in sketches.items():
+        row = existing.get((ad_id, day))
+        if row is None:
+            created.append(AdViewSketch(ad_id=ad_id, date=day, sketch=sketch.to_bytes()))
+        else:
+            row.sketch = HyperLogLog.from_bytes(row.sketch).merge(sketch).to_bytes()
+            updated.append(row)
+    AdViewSketch.objects.bulk_create(created)
+    AdViewSketch.objects.bulk_update(updated, ['sketch'])
+
+    # A union of unions: merging only the new visitors into the lifetime
+    # sketch gives the same registers as merging every daily row again
+    stored = {
+        row.ad_id: row
+        for row in AdViewTotal.objects.select_for_update().filter(ad_id__in=ad_ids)
+    }
+    totals = {ad_id: HyperLogLog.from_bytes(row.sketch) for ad_id, row in stored.items()}
+    for (ad_id, day), sketch in sketches.items():
+        totals[ad_id] = totals[ad_id].merge(sketch) if ad_id in totals else HyperLogLog(sketch.registers)
+    created, updated = [], []
+    for ad_id, sketch in totals.items():
+        row = stored.get(ad_id)
+        if row is None:
+            created.append(AdViewTotal(ad_id=ad_id, sketch=sketch.to_bytes()))
+        else:
+            row.sketch = sketch.to_bytes()
+            updated.append(row)
+    AdViewTotal.objects.bulk_create(created)
+    AdViewTotal.objects.bulk_update(updated, ['sketch'])
+    Ad.objects.bulk_update(
+        [Ad(pk=ad_id, unique_views_count=sketch.count()) for ad_id, sketch in totals.items()],
+        ['unique_views_count'],
+    )
+
+
+view_count_buffer = ViewCountBuffer()
+atexit.register(view_count_buffer.flush_at_exit)
+
+
+def record_view(ad_id, visitor=None):
+    view_count_buffer.record(ad_id, visitor)
+
+
+def flush_views():
+    return view_count_buffer.flush()
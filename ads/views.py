@@ -1,20 +1,34 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
+from django.views.decorators.http import require_GET, require_POST
 from django.utils.translation import gettext_lazy as _
 from django.db import transaction
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.utils.http import urlencode
+from PIL import UnidentifiedImageError
 
 from .models import Ad, Category, Location, AdReport, AdImage
+from .counts import count_ads
+from .metrics import render_prometheus
+from .pagination import paginate_listing
+from .query_budgets import query_budget
+from .search import search_ads, order_listing
+from .suggestions import suggest
+from .thumbnails import CONTENT_TYPES, allowed_sizes, etag, open_thumbnail
+from .view_counts import visitor_key
 from .forms import AdForm, AdImageFormSet, AdSearchForm
 
 
+@query_budget(8)
 def ads_list_view(request):
     """List all ads with filters"""
-    ads = Ad.objects.filter(is_active=True).select_related('category', 'location', 'user')
+    ads = Ad.objects.filter(is_active=True).select_related('category', 'location', 'user').with_main_image()
     
     # Apply filters
     query = request.GET.get('q')
@@ -22,7 +36,7 @@ def ads_list_view(request):
     location = request.GET.get('location')
     
     if query:
-        ads = ads.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        ads = search_ads(ads, query)
     
     if category:
         ads = ads.filter(category__slug=category)
@@ -30,18 +44,30 @@ def ads_list_view(request):
     if location:
         ads = ads.filter(location__slug=location)
     
-    # Order by featured/vip first
-    ads = ads.order_by('-is_featured', '-is_vip', '-created_at')
+    # Order by featured/vip first, then by relevance when searching
+    ads = order_listing(ads)
     
-    # Pagination
-    paginator = Paginator(ads, 12)
-    page = request.GET.get('page')
-    ads = paginator.get_page(page)
+    categories = list(Category.objects.filter(is_active=True))
+    locations = list(Location.objects.filter(is_active=True))
+    
+    # Pagination (cursor based past the first few pages); the ids scope
+    # which ad saves invalidate the cached count
+    ads_count = count_ads(
+        ads,
+        category=next((item.id for item in categories if item.slug == category), None),
+        location=next((item.id for item in locations if item.slug == location), None),
+        q=query,
+        category_slug=category,
+        location_slug=location,
+    )
+    ads = paginate_listing(request, ads, count=ads_count)
     
     context = {
         'ads': ads,
-        'categories': Category.objects.filter(is_active=True),
-        'locations': Location.objects.filter(is_active=True),
+        'ads_count': ads_count,
+        'favorite_ids': Ad.favorite_ids(request.user, ads),
+        'categories': categories,
+        'locations': locations,
         'current_query': query,
         'current_category': category,
         'current_location': location,
@@ -50,13 +76,18 @@ def ads_list_view(request):
     return render(request, 'ads/list.html', context)
 
 
+@query_budget(8)
 def ad_detail_view(request, slug):
     """Ad detail view"""
-    ad = get_object_or_404(Ad, slug=slug, is_active=True)
+    ad = get_object_or_404(
+        Ad.objects.select_related('category', 'location', 'user').prefetch_related('images'),
+        slug=slug,
+        is_active=True,
+    )
     
     # Increment views count (but not for the owner)
     if request.user != ad.user:
-        ad.increment_views()
+        ad.increment_views(visitor_key(request))
     
     # Check if current user has favorited this ad
     is_favorite = False
@@ -67,7 +98,7 @@ def ad_detail_view(request, slug):
     related_ads = Ad.objects.filter(
         category=ad.category,
         is_active=True
-    ).exclude(id=ad.id)[:6]
+    ).exclude(id=ad.id).with_main_image()[:6]
     
     context = {
         'ad': ad,
@@ -79,15 +110,16 @@ def ad_detail_view(request, slug):
     return render(request, 'ads/detail.html', context)
 
 
+@query_budget(8)
 def category_view(request, slug):
     """Category page view with location and price filtering"""
     category = get_object_or_404(Category, slug=slug, is_active=True)
-    ads = category.ads.filter(is_active=True)
+    ads = category.ads.filter(is_active=True).select_related('location').with_main_image()
     
     # Apply search filter
     query = request.GET.get('q')
     if query:
-        ads = ads.filter(Q(title__icontains=query) | Q(description__icontains=query))
+        ads = search_ads(ads, query)
     
     # Apply location filter if provided
     location_slug = request.GET.get('location')
@@ -116,16 +148,24 @@ def category_view(request, slug):
             pass
     
     # Order ads
-    ads = ads.order_by('-is_featured', '-is_vip', '-created_at')
-    
-    # Pagination
-    paginator = Paginator(ads, 12)
-    page = request.GET.get('page')
-    ads = paginator.get_page(page)
+    ads = order_listing(ads)
+    
+    # Pagination (cursor based past the first few pages)
+    ads_count = count_ads(
+        ads,
+        category=category.id,
+        location=selected_location.id if selected_location else None,
+        q=query,
+        min_price=min_price,
+        max_price=max_price,
+    )
+    ads = paginate_listing(request, ads, count=ads_count)
     
     context = {
         'category': category,
         'ads': ads,
+        'ads_count': ads_count,
+        'favorite_ids': Ad.favorite_ids(request.user, ads),
         'locations': Location.objects.filter(is_active=True),
         'selected_location': selected_location,
         'current_location': location_slug,
@@ -134,19 +174,21 @@ def category_view(request, slug):
     return render(request, 'ads/category.html', context)
 
 
+@query_budget(8)
 def location_view(request, slug):
     """Location page view"""
     location = get_object_or_404(Location, slug=slug, is_active=True)
-    ads = location.ads.filter(is_active=True).order_by('-is_featured', '-is_vip', '-created_at')
+    ads = order_listing(location.ads.filter(is_active=True).with_main_image())
     
-    # Pagination
-    paginator = Paginator(ads, 12)
-    page = request.GET.get('page')
-    ads = paginator.get_page(page)
+    # Pagination (cursor based past the first few pages)
+    ads_count = count_ads(ads, location=location.id)
+    ads = paginate_listing(request, ads, count=ads_count)
     
     context = {
         'location': location,
         'ads': ads,
+        'ads_count': ads_count,
+        'favorite_ids': Ad.favorite_ids(request.user, ads),
         'categories': Category.objects.filter(is_active=True),
     }
     
@@ -306,3 +348,59 @@ def report_ad_view(request):
             
     except Ad.DoesNotExist:
         return JsonResponse({'error': 'Ad not found'}, status=404)
+
+
+@require_GET
+def suggest_view(request):
+    """Search-as-you-type suggestions from the in-memory prefix index"""
+    query = request.GET.get('q', '').strip()
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), 20)
+    except (ValueError, TypeError):
+        limit = 8
+    
+    home_url = reverse('core:home')
+    results = [
+        {
+            'text': suggestion.text,
+            'type': suggestion.kind,
+            'url': suggestion.url or f"{home_url}?{urlencode({'q': suggestion.text})}",
+        }
+        for suggestion in suggest(query[:100], limit)
+    ]
+    
+    return JsonResponse({'query': query, 'suggestions': results})
+
+
+@require_GET
+def thumbnail_view(request, pk, size, extension):
+    """Cropped thumbnail of an ad image in one of the whitelisted sizes"""
+    if size not in allowed_sizes() or extension not in CONTENT_TYPES:
+        raise Http404
+    name = AdImage.objects.filter(pk=pk).values_list('image', flat=True).first()
+    if not name:
+        raise Http404
+    
+    tag = etag(name, size, extension)
+    response = get_conditional_response(request, etag=tag)
+    if response is None:
+        try:
+            thumbnail = open_thumbnail(pk, name, size, extension)
+        except (OSError, UnidentifiedImageError):
+            raise Http404
+        response = FileResponse(thumbnail, content_type=CONTENT_TYPES[extension])
+    
+    # The url carries the file version, so it never needs revalidation
+    response['ETag'] = tag
+    patch_cache_control(response, public=True, max_age=31536000, immutable=True)
+    return response
+
+
+@require_GET
+def metrics_view(request):
+    """Prometheus metrics of all worker processes (staff or METRICS_TOKEN only)"""
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and constant_time_compare(authorization, f'Bearer {token}'))):
+        raise PermissionDenied
+    return HttpResponse(render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,9 +1,13 @@
 from django.shortcuts import render
-from django.core.paginator import Paginator
-from django.db.models import Q
 from ads.models import Ad, Category, Location
+from ads.counts import count_ads
+from ads.pagination import paginate_listing
+from ads.query_budgets import query_budget
+from ads.search import search_ads, order_listing
 
 
+# Signed-in visitors add the session, user and favorites lookups
+@query_budget(8)
 def home_view(request):
     """Home page view"""
     # Get search parameters
@@ -12,13 +16,10 @@ def home_view(request):
     location_slug = request.GET.get('location', '')
     
     # Filter ads
-    ads = Ad.objects.filter(is_active=True).select_related('category', 'location', 'user')
+    ads = Ad.objects.filter(is_active=True).select_related('category', 'location', 'user').with_main_image()
     
     if query:
-        ads = ads.filter(
-            Q(title__icontains=query) | 
-            Q(description__icontains=query)
-        )
+        ads = search_ads(ads, query)
     
     if category_slug:
         ads = ads.filter(category__slug=category_slug)
@@ -26,26 +27,35 @@ def home_view(request):
     if location_slug:
         ads = ads.filter(location__slug=location_slug)
     
-    # Order by featured/vip first, then by creation date
-    ads = ads.order_by('-is_featured', '-is_vip', '-created_at')
-    
-    # Pagination
-    paginator = Paginator(ads, 12)
-    page = request.GET.get('page')
-    ads = paginator.get_page(page)
+    # Order by featured/vip first, then by relevance, then by creation date
+    ads = order_listing(ads)
     
     # Get categories and locations for filters
-    categories = Category.objects.filter(is_active=True)
-    locations = Location.objects.filter(is_active=True)
+    categories = list(Category.objects.filter(is_active=True))
+    locations = list(Location.objects.filter(is_active=True))
+    
+    # Pagination (cursor based past the first few pages); the ids scope
+    # which ad saves invalidate the cached count
+    ads_count = count_ads(
+        ads,
+        category=next((item.id for item in categories if item.slug == category_slug), None),
+        location=next((item.id for item in locations if item.slug == location_slug), None),
+        q=query,
+        category_slug=category_slug,
+        location_slug=location_slug,
+    )
+    ads = paginate_listing(request, ads, count=ads_count)
     
     context = {
         'ads': ads,
+        'favorite_ids': Ad.favorite_ids(request.user, ads),
         'categories': categories,
         'locations': locations,
         'current_query': query,
         'current_category': category_slug,
         'current_location': location_slug,
-        'total_ads': Ad.objects.filter(is_active=True).count(),
+        'ads_count': ads_count,
+        'total_ads': count_ads(Ad.objects.filter(is_active=True)),
     }
     
     return render(request, 'core/home.html', context)
@@ -53,6 +53,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ads.profiling.ProfilingMiddleware',
+    'ads.metrics.MetricsMiddleware',
+    'ads.slow_queries.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -176,6 +179,68 @@ EMAIL_HOST_PASSWORD = ''
 
 # Pagination
 PAGINATE_BY = 12
+LISTING_NUMBERED_PAGES = 5  # deeper listing pages are served by cursor
+
+# Cache shared by all worker processes: cached listing counts are
+# invalidated through it (ads/counts.py), which a per-process LocMemCache
+# would only do for the worker that saved the ad. Set REDIS_URL (needs the
+# redis package) to share it between hosts too.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': BASE_DIR / 'cache',
+        }
+    }
+
+# Listing counts (see ads/counts.py)
+COUNT_EXACT_LIMIT = 1000  # counted exactly up to this many ads
+COUNT_CACHE_TIMEOUT = 300  # seconds a cached count may live
+COUNT_STALE_SECONDS = 30  # seconds a count may be served after its slice changed
+
+# Ad view counts are buffered per process and flushed in batches (ads/view_counts.py)
+VIEW_COUNT_FLUSH_SECONDS = 10  # 0 writes every view immediately
+
+# Uploaded ad images are resized into renditions by a background thread pool (ads/images.py)
+IMAGE_PROCESSING_WORKERS = 2  # 0 processes images inline after commit
+
+# Cropped thumbnails served by ads:thumbnail, cached under MEDIA_ROOT/thumbs (ads/thumbnails.py)
+THUMBNAIL_SIZES = ['120x120', '400x200', '800x400']
+THUMBNAIL_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# Near-duplicate image lookup (ads/duplicates.py)
+NEAR_DUPLICATE_CANDIDATES = 1000  # images whose exact distance is checked per lookup
+NEAR_DUPLICATE_LIMIT = 20  # closest matches kept; the admin notes when more were found
+
+# Request profiling (ads/profiling.py): Server-Timing header and a JSON log line
+PROFILING_SAMPLE_RATE = 0  # fraction of requests profiled; 0 disables the middleware
+
+# Metrics served as Prometheus text at ads:metrics (ads/metrics.py)
+METRICS_ENABLED = True
+METRICS_DIR = BASE_DIR / 'metrics'  # one file per worker process, summed on scrape
+METRICS_FLUSH_SECONDS = 10
+METRICS_COMPACT_SECONDS = 300  # fold exited workers' files into retired.json at most this often
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')  # lets a scraper in with "Authorization: Bearer <token>"
+
+# Slow query sampler (ads/slow_queries.py, summarized by manage.py slow_queries)
+SLOW_QUERY_MS = None  # log statements slower than this many ms; None disables the sampler
+SLOW_QUERY_LOG = BASE_DIR / 'logs' / 'slow_queries.log'  # rotated at 10MB, 5 backups
+
+# Per-view SQL query budgets (ads/query_budgets.py): warn in DEBUG, raise when strict
+QUERY_BUDGET_STRICT = False  # raise on an exceeded budget; the test runner below turns it on
+TEST_RUNNER = 'ads.test_runner.TestRunner'
+
+# Search suggestions (in-memory prefix index, see ads/suggestions.py)
+SUGGEST_REFRESH_SECONDS = 60  # pick up ads saved by other workers
+SUGGEST_REBUILD_SECONDS = 3600  # full rebuild, drops ads deleted elsewhere
+SUGGEST_REFRESH_IN_BACKGROUND = True  # False refreshes inside the request (handy in tests)
 
 # File upload settings
 DATA_UPLOAD_MAX_MEMORY_SIZE = 5242880  # 5MB
@@ -199,6 +264,11 @@ LOGGING = {
             'level': 'DEBUG',
             'propagate': False,
         },
+        'ads.profiling': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
     },
 }
 